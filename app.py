@@ -1,11 +1,10 @@
 import os
-import shutil
 import zipfile
 import logging
 import magic
 from uuid import uuid4
-from datetime import datetime, timedelta
-from threading import Thread
+from datetime import datetime
+from threading import Lock, Thread
 from flask import Flask, request, render_template, send_from_directory, jsonify, session, redirect, url_for
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
@@ -15,6 +14,8 @@ from io import BytesIO
 from concurrent.futures import ThreadPoolExecutor
 from apscheduler.schedulers.background import BackgroundScheduler
 from flask import session
+from watermark import utils as watermark_utils
+from watermark.expiry import ExpiryIndex
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -142,28 +143,25 @@ MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
 
 progress_tracker = {}
 
-# Define cleanup function first
-def clear_previous_sessions():
-    """Clean up old files and folders"""
-    logger.info("Starting cleanup of previous sessions")
-    for folder in [UPLOAD_FOLDER, ZIP_FOLDER]:
-        for filename in os.listdir(folder):
-            file_path = os.path.join(folder, filename)
-            try:
-                if os.path.isfile(file_path) or os.path.islink(file_path):
-                    # Check if file is older than 24 hours
-                    if datetime.now() - datetime.fromtimestamp(os.path.getctime(file_path)) > timedelta(hours=24):
-                        os.unlink(file_path)
-                elif os.path.isdir(file_path):
-                    if datetime.now() - datetime.fromtimestamp(os.path.getctime(file_path)) > timedelta(hours=24):
-                        shutil.rmtree(file_path)
-            except Exception as e:
-                logger.error(f"Failed to delete {file_path}: {e}")
-
-# Initialize scheduler for cleanup
-scheduler = BackgroundScheduler()
-scheduler.add_job(func=clear_previous_sessions, trigger="interval", hours=24)
-scheduler.start()
+# Finished sessions are indexed by expiry time; a reaper deletes only what is due
+OUTPUT_TTL = 24 * 3600
+_expiry_index = None
+_expiry_lock = Lock()
+
+def expiry_index():
+    """Open the expiry index on first use rather than on import"""
+    global _expiry_index
+    with _expiry_lock:
+        if _expiry_index is None:
+            _expiry_index = ExpiryIndex(os.path.join("static", "expiry.sqlite3"))
+        return _expiry_index
+
+def start_reaper():
+    """Reap expired sessions every minute in a background scheduler"""
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(func=expiry_index().reap, trigger="interval", minutes=1)
+    scheduler.start()
+    return scheduler
 
 
 def allowed_file(filename):
@@ -183,46 +181,12 @@ def validate_file(file):
         raise ValueError(f"Invalid file type: {mime}")
     return True
 
-def clear_previous_sessions():
-    """Clean up old files and folders"""
-    logger.info("Starting cleanup of previous sessions")
-    for folder in [UPLOAD_FOLDER, ZIP_FOLDER]:
-        for filename in os.listdir(folder):
-            file_path = os.path.join(folder, filename)
-            try:
-                if os.path.isfile(file_path) or os.path.islink(file_path):
-                    # Check if file is older than 24 hours
-                    if datetime.now() - datetime.fromtimestamp(os.path.getctime(file_path)) > timedelta(hours=24):
-                        os.unlink(file_path)
-                elif os.path.isdir(file_path):
-                    if datetime.now() - datetime.fromtimestamp(os.path.getctime(file_path)) > timedelta(hours=24):
-                        shutil.rmtree(file_path)
-            except Exception as e:
-                logger.error(f"Failed to delete {file_path}: {e}")
-
-
-
-@cache.memoize(timeout=300)
-def apply_watermark(image, watermark, fill_pct, opacity_pct):
-    """Apply centered watermark with caching"""
+def apply_watermark(image, watermark, fill_pct, opacity_pct, position='center', pattern='single'):
+    """Apply a positioned or tiled watermark using the package implementation"""
     try:
-        img = image.convert("RGBA")
-        watermark = watermark.convert("RGBA")
-
-        wm_width = int((fill_pct / 100.0) * img.width)
-        aspect_ratio = watermark.width / watermark.height
-        wm_height = int(wm_width / aspect_ratio)
-        watermark = watermark.resize((wm_width, wm_height), Image.Resampling.LANCZOS)
-
-        alpha = watermark.split()[3]
-        alpha = ImageEnhance.Brightness(alpha).enhance(opacity_pct / 100.0)
-        watermark.putalpha(alpha)
-
-        # Center the watermark
-        pos = ((img.width - wm_width) // 2, (img.height - wm_height) // 2)
-        img.paste(watermark, pos, watermark)
-
-        return img
+        return watermark_utils.apply_watermark(
+            image, watermark, fill_pct, opacity_pct, position=position, pattern=pattern
+        )
     except Exception as e:
         logger.error(f"Error applying watermark: {e}")
         raise
@@ -279,9 +243,6 @@ def index():
     
     if request.method == 'POST':
         try:
-            # Clear old sessions
-            clear_previous_sessions()
-
             # Create new session
             session_id = str(uuid4())
             session_folder = os.path.join(UPLOAD_FOLDER, session_id)
@@ -381,6 +342,8 @@ def index():
                 progress_tracker[session_id]['done'] += 1
 
             zip_name = create_zip(session_folder)
+            expiry_index().add(session_folder, OUTPUT_TTL)
+            expiry_index().add(os.path.join(ZIP_FOLDER, zip_name), OUTPUT_TTL)
             zip_url = f"/static/zips/{zip_name}"
             progress_tracker[session_id]['zip'] = zip_url
             print(f"[DEBUG] Zip ready: {zip_url}")
@@ -428,4 +391,5 @@ def download_zip(filename):
 
 
 if __name__ == '__main__':
+    start_reaper()
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,65 @@
+"""Benchmark the Pillow and NumPy watermark compositing engines.
+
+Usage: python benchmarks/bench_composite.py [--megapixels 12 24 50] [--fill 10 30 90] [--repeat 3]
+"""
+import argparse
+import math
+import time
+from PIL import Image, ImageChops
+from watermark.blend import np
+from watermark.utils import apply_watermark, watermark_cache
+
+def synthetic_photo(megapixels):
+    width = int(math.sqrt(megapixels * 1e6 * 3 / 2))
+    height = int(width * 2 / 3)
+    return Image.effect_noise((width, height), 48).convert('RGB')
+
+def synthetic_watermark():
+    """A logo-like watermark: soft-edged artwork on a transparent canvas."""
+    artwork = Image.effect_noise((420, 150), 64).convert('RGBA')
+    artwork.putalpha(Image.linear_gradient('L').rotate(90).resize((420, 150)))
+    watermark = Image.new('RGBA', (600, 300), (0, 0, 0, 0))
+    watermark.paste(artwork, (90, 75))
+    return watermark
+
+def best_time(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--megapixels', type=float, nargs='+', default=[12, 24, 50])
+    parser.add_argument('--fill', type=float, nargs='+', default=[10, 30, 90])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if np is None:
+        parser.error('NumPy is not installed')
+
+    watermark = synthetic_watermark()
+    # Big enough to keep every prepared tile warm, as in a running batch
+    watermark_cache.max_bytes = 2 * 1024 * 1024 * 1024
+    for megapixels in args.megapixels:
+        # Timings include the RGBA conversion both engines share
+        img = synthetic_photo(megapixels)
+        for fill in args.fill:
+            timings = {}
+            results = {}
+            for engine in ('pillow', 'numpy'):
+                run = lambda: apply_watermark(img, watermark, fill, 50, digest='bench', engine=engine)
+                run()
+                timings[engine], results[engine] = best_time(run, args.repeat)
+            extrema = ImageChops.difference(results['pillow'], results['numpy']).getextrema()
+            max_diff = max(high for _, high in extrema)
+            print(
+                f"{megapixels:g} MP fill {fill:<3g}%  pillow {timings['pillow'] * 1000:8.1f} ms  "
+                f"numpy {timings['numpy'] * 1000:8.1f} ms  "
+                f"{timings['pillow'] / timings['numpy']:5.2f}x  max diff {max_diff}"
+            )
+
+if __name__ == '__main__':
+    main()
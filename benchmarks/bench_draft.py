@@ -0,0 +1,67 @@
+"""Benchmark draft-mode JPEG decoding against a full decode before downscaling.
+
+Usage: python benchmarks/bench_draft.py [--megapixels 24] [--reduce-pct 50] [--repeat 3]
+"""
+import argparse
+import math
+import time
+from io import BytesIO
+from PIL import Image, ImageChops, ImageStat
+from watermark.utils import draft_for_resize, resize_image
+
+def synthetic_jpeg(megapixels):
+    """Build a camera-sized JPEG with gradients and noise."""
+    width = int(math.sqrt(megapixels * 1e6 * 3 / 2))
+    height = int(width * 2 / 3)
+    noise = Image.effect_noise((width, height), 48).convert('RGB')
+    gradient = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    img = Image.blend(noise, gradient, 0.6)
+    buffer = BytesIO()
+    img.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+def decode_and_resize(data, reduce_pct, margin):
+    img = Image.open(BytesIO(data))
+    source_size = img.size
+    draft_for_resize(img, reduce_pct, margin)
+    img.load()
+    return resize_image(img, reduce_pct, source_size)
+
+def best_time(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def psnr(a, b):
+    diff = ImageChops.difference(a.convert('RGB'), b.convert('RGB'))
+    mse = sum(v * v for v in ImageStat.Stat(diff).rms) / 3
+    return float('inf') if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--megapixels', type=float, default=24)
+    parser.add_argument('--reduce-pct', type=float, default=50)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--margins', type=float, nargs='+', default=[4.0, 2.0, 1.0])
+    args = parser.parse_args()
+
+    data = synthetic_jpeg(args.megapixels)
+    baseline_time, baseline = best_time(
+        lambda: decode_and_resize(data, args.reduce_pct, 0), args.repeat
+    )
+    print(f"{args.megapixels:g} MP JPEG -> {args.reduce_pct:g}%")
+    print(f"full decode        {baseline_time * 1000:8.1f} ms")
+    for margin in args.margins:
+        elapsed, result = best_time(
+            lambda: decode_and_resize(data, args.reduce_pct, margin), args.repeat
+        )
+        print(
+            f"draft margin {margin:<4g}  {elapsed * 1000:8.1f} ms  "
+            f"{baseline_time / elapsed:5.2f}x  PSNR {psnr(baseline, result):6.2f} dB"
+        )
+
+if __name__ == '__main__':
+    main()
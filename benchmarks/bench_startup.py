@@ -0,0 +1,73 @@
+"""Benchmark cold start: time from launching the server to its first 200 on /.
+
+Usage: python benchmarks/bench_startup.py [--repeat 5] [--port 5000] [--script src/main.py]
+
+Each run starts a fresh interpreter in an empty working directory, so
+imports, app creation and the first request are all measured cold.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def first_ok(url, process, timeout):
+    """Poll url until it answers 200, failing if the server dies first."""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            pass
+        time.sleep(0.005)
+    raise RuntimeError(f"No 200 from {url} within {timeout}s")
+
+def cold_start(script, port, timeout):
+    env = dict(os.environ, PORT=str(port), PYTHONPATH=os.path.join(ROOT, 'src'))
+    with tempfile.TemporaryDirectory() as workdir:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, script], cwd=workdir, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            first_ok(f"http://127.0.0.1:{port}/", process, timeout)
+            return time.perf_counter() - start
+        finally:
+            process.terminate()
+            process.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--port', type=int, help='default: a free port, passed as PORT')
+    parser.add_argument('--script', default=os.path.join(ROOT, 'src', 'main.py'))
+    parser.add_argument('--timeout', type=float, default=30)
+    args = parser.parse_args()
+
+    timings = []
+    for run in range(args.repeat):
+        elapsed = cold_start(os.path.abspath(args.script), args.port or free_port(), args.timeout)
+        timings.append(elapsed)
+        print(f"run {run + 1}  {elapsed * 1000:8.1f} ms")
+    print(f"min     {min(timings) * 1000:8.1f} ms")
+    print(f"median  {statistics.median(timings) * 1000:8.1f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+"""Benchmark suite for the image pipeline.
+
+Times each pipeline stage on synthetic photo sets plus a full upload ->
+zip run through the web app, and writes the results as JSON so runs
+from different commits can be compared.
+
+Usage: python -m benchmarks.suite [--megapixels 1 4 12] [--count 5] [--output results.json]
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+import PIL
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from watermark.pipeline import ENCODING_PROFILES, OUTPUT_EXTENSIONS, available_output_formats, encode_image
+from watermark.utils import apply_watermark, create_zip, resize_image, validate_file, watermark_cache
+
+# (format, mode) combinations covering the alpha and palette branches
+VARIANTS = [
+    ('jpg', 'RGB'),
+    ('png', 'RGB'),
+    ('png', 'RGBA'),
+    ('gif', 'P')
+]
+
+SAVE_FORMATS = {'jpg': 'JPEG', 'png': 'PNG', 'gif': 'GIF'}
+
+def synthetic_photo(megapixels, mode, seed=0):
+    """Build a photo-like image: gradient plus sensor-style noise."""
+    width = int(math.sqrt(megapixels * 1e6 * 3 / 2))
+    height = int(width * 2 / 3)
+    noise = Image.effect_noise((width, height), 40 + seed % 16).convert('RGB')
+    gradient = Image.linear_gradient('L').rotate(seed * 37 % 360).resize((width, height)).convert('RGB')
+    img = Image.blend(noise, gradient, 0.6)
+    if mode == 'RGBA':
+        img.putalpha(Image.linear_gradient('L').resize((width, height)))
+    elif mode == 'P':
+        img = img.convert('P', palette=Image.ADAPTIVE)
+    return img
+
+def encode_source(img, fmt):
+    buffer = BytesIO()
+    img.save(buffer, SAVE_FORMATS[fmt])
+    return buffer.getvalue()
+
+def synthetic_watermark():
+    img = Image.new('RGBA', (400, 200), (255, 255, 255, 0))
+    img.paste((20, 20, 20, 255), (40, 40, 360, 160))
+    return img
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def summarize(name, case, latencies):
+    total = sum(latencies)
+    return {
+        'name': name,
+        'case': case,
+        'images': len(latencies),
+        'images_per_sec': len(latencies) / total if total else None,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    }
+
+def time_each(fn, inputs):
+    latencies = []
+    for item in inputs:
+        start = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def bench_stages(megapixels, count):
+    """Time validate, watermark, resize, encode and zip in isolation."""
+    results = []
+    watermark = synthetic_watermark()
+    for fmt, mode in VARIANTS:
+        case = f"{megapixels:g}MP-{fmt}-{mode}"
+        images = [synthetic_photo(megapixels, mode, seed) for seed in range(count)]
+        sources = [encode_source(img, fmt) for img in images]
+        decoded = [Image.open(BytesIO(data)) for data in sources]
+        for img in decoded:
+            img.load()
+
+        results.append(summarize('validate_file', case, time_each(
+            lambda data: validate_file(
+                FileStorage(stream=BytesIO(data), filename=f"photo.{fmt}"),
+                {fmt}, len(data)
+            ),
+            sources
+        )))
+
+        watermark_cache.clear()
+        results.append(summarize('apply_watermark', case, time_each(
+            lambda img: apply_watermark(img, watermark, 30, 50, digest='bench'),
+            decoded
+        )))
+
+        results.append(summarize('resize_image', case, time_each(
+            lambda img: resize_image(img, 60),
+            decoded
+        )))
+
+        for output_format in available_output_formats(OUTPUT_EXTENSIONS):
+            for profile in ENCODING_PROFILES:
+                results.append(summarize(f'encode_{output_format}_{profile}', case, time_each(
+                    lambda img: encode_image(img, output_format, profile),
+                    decoded
+                )))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for index, data in enumerate(sources):
+                path = os.path.join(tmp, f"{index}.{fmt}")
+                with open(path, 'wb') as f:
+                    f.write(data)
+                paths.append(path)
+            zip_path = os.path.join(tmp, 'zips', 'bench.zip')
+            start = time.perf_counter()
+            create_zip(paths, zip_path)
+            elapsed = time.perf_counter() - start
+        results.append(summarize('create_zip', case, [elapsed / len(paths)] * len(paths)))
+    return results
+
+def bench_end_to_end(megapixels, count, backend):
+    """Run a full upload -> processed zip job through the web app."""
+    from watermark.app import create_app
+    from watermark.config import Config
+
+    class BenchConfig(Config):
+        TESTING = True
+        PROCESSING_BACKEND = backend
+        RATELIMIT_ENABLED = False
+
+    app = create_app(BenchConfig)
+    client = app.test_client()
+    watermark = encode_source(synthetic_watermark(), 'png')
+    photos = [encode_source(synthetic_photo(megapixels, 'RGB', seed), 'jpg') for seed in range(count)]
+
+    start = time.perf_counter()
+    response = client.post('/', data={
+        'photos': [(BytesIO(data), f"photo{index}.jpg") for index, data in enumerate(photos)],
+        'watermark': (BytesIO(watermark), 'watermark.png'),
+        'apply_watermark': 'on',
+        'reduce_size': 'on',
+        'reduce_pct': '60',
+        'format': 'jpg'
+    }, content_type='multipart/form-data')
+    session_id = response.get_data(as_text=True).split('const sessionId = "')[1].split('"')[0]
+
+    # Per-image latency is the gap between successive completions
+    completions = []
+    done = 0
+    version = None
+    while True:
+        job = app.jobs.wait_for_change(session_id, version, timeout=60)
+        version = job['version']
+        while done < job['done']:
+            done += 1
+            completions.append(time.perf_counter())
+        if job.get('finished'):
+            break
+    elapsed = time.perf_counter() - start
+    app.engine.shutdown()
+
+    latencies = [b - a for a, b in zip([start] + completions, completions)]
+    result = summarize('process_images_background', f"{megapixels:g}MP-jpg-{backend}", latencies)
+    result['images_per_sec'] = count / elapsed
+    result['wall_time_s'] = elapsed
+    result['failed'] = job.get('failed', 0)
+    return result
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Image pipeline benchmark suite')
+    parser.add_argument('--megapixels', type=float, nargs='+', default=[1, 4, 12])
+    parser.add_argument('--count', type=int, default=5, help='images per synthetic set')
+    parser.add_argument('--backends', nargs='+', default=['thread', 'process'])
+    parser.add_argument('--skip-end-to-end', action='store_true')
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    args = parser.parse_args(argv)
+
+    results = []
+    # Keep pipeline debug prints out of the JSON on stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        for megapixels in args.megapixels:
+            results.extend(bench_stages(megapixels, args.count))
+            if not args.skip_end_to_end:
+                for backend in args.backends:
+                    results.append(bench_end_to_end(megapixels, args.count, backend))
+
+    report = json.dumps({'environment': environment(), 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    main()
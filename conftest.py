@@ -0,0 +1,20 @@
+from io import BytesIO
+from PIL import Image
+
+def make_image_bytes(size=(64, 48), fmt='PNG', color='white'):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, fmt)
+    return buffer.getvalue()
+
+def make_options(**overrides):
+    options = {
+        'watermark': make_image_bytes((16, 8), color='black'),
+        'watermark_digest': None,
+        'fill_pct': 30,
+        'opacity_pct': 50,
+        'reduce_size': True,
+        'reduce_pct': 50,
+        'output_format': 'png'
+    }
+    options.update(overrides)
+    return options
@@ -14,5 +14,12 @@ setup(
         "python-magic",
         "apscheduler",
     ],
+    extras_require={
+        "numpy": ["numpy"],
+        "avif": ["pillow-avif-plugin"],
+    },
+    entry_points={
+        "console_scripts": ["watermark=watermark.cli:main"],
+    },
     python_requires=">=3.8",
 )
\ No newline at end of file
@@ -1,6 +1,10 @@
+import os
 from watermark.app import create_app
 
-app = create_app()
-
+# Development server only; production servers load wsgi:app. Guarded so
+# spawned worker processes can re-import this module safely.
 if __name__ == '__main__':
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    app = create_app()
+    # The debugger's reloader starts the whole app twice; opt in with FLASK_DEBUG=1
+    debug = os.environ.get('FLASK_DEBUG') == '1'
+    app.run(host="0.0.0.0", port=int(os.environ.get('PORT', 5000)), debug=debug)
@@ -1,23 +1,56 @@
-"""Flask application configuration and initialization."""
+"""Flask application configuration and initialization.
+
+Startup only pays for what serving the first request needs: APScheduler
+starts a few seconds later, the job executor and process pool are
+created on first use, and Pillow's codecs and libmagic load in a
+background thread.
+"""
 import os
 import logging
+import threading
 from flask import Flask
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from flask_caching import Cache
-from concurrent.futures import ThreadPoolExecutor
-from apscheduler.schedulers.background import BackgroundScheduler
 from .config import Config
 from .routes import register_routes
 from .tasks import setup_scheduler
+from .utils import sniff_mime, watermark_cache
+from .pipeline import ProcessingEngine, warm_codecs
+from .jobs import create_job_store
+from .result_cache import ResultCache
+from .blend import resolve_engine
+from .scheduler import FairScheduler
+from .expiry import ExpiryIndex
+from . import metrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class WatermarkApp(Flask):
+    """Flask app whose unused-at-startup extensions load on first access."""
+
+    _cache = None
+
+    @property
+    def cache(self):
+        """Flask-Caching, initialized on first use."""
+        if self._cache is None:
+            from flask_caching import Cache
+            self._cache = Cache(self)
+        return self._cache
+
+def warm_up(app):
+    """Load codecs and libmagic before the first upload needs them."""
+    try:
+        warm_codecs(app.config['OUTPUT_FORMATS'])
+        sniff_mime(b'\x89PNG\r\n\x1a\n')
+    except Exception as e:
+        logger.warning(f"Codec warmup failed: {e}")
+
 def create_app(config_class=Config):
     """Create and configure the Flask application."""
-    app = Flask(__name__)
+    app = WatermarkApp(__name__)
     app.config.from_object(config_class)
 
     # Initialize extensions
@@ -27,18 +60,49 @@ def create_app(config_class=Config):
         default_limits=["200 per day", "50 per hour"],
         storage_uri="memory://"
     )
-    
-    app.cache = Cache(app)
-    app.executor = ThreadPoolExecutor(max_workers=3)
+
+    metrics.configure(app.config['METRICS_FOLDER'])
+    app.jobs = create_job_store(app.config)
+    app.expiry = ExpiryIndex(app.config['EXPIRY_INDEX'], max_bytes=app.config['DISK_QUOTA_BYTES'])
+    # Each running work unit waits on one image, so keep the process pool busy
+    job_workers = app.config['JOB_WORKERS']
+    if app.config['PROCESSING_BACKEND'] == 'process':
+        job_workers = max(job_workers, app.config['PROCESS_WORKERS'])
+    # The scheduler creates its thread pool when the first job starts
+    app.scheduler = FairScheduler(
+        None,
+        workers=job_workers,
+        max_images=app.config['QUEUE_MAX_IMAGES'],
+        max_bytes=app.config['QUEUE_MAX_BYTES'],
+        default_retry_after=app.config['QUEUE_RETRY_AFTER'],
+        on_position=lambda job_id, position: app.jobs.update(job_id, queue_position=position),
+        position_interval=app.config['QUEUE_POSITION_INTERVAL']
+    )
+    watermark_cache.max_bytes = app.config['WATERMARK_CACHE_MAX_BYTES']
+    app.config['COMPOSITE_ENGINE'] = resolve_engine(app.config['COMPOSITE_ENGINE'])
+    app.result_cache = None
+    if app.config['RESULT_CACHE_MAX_BYTES']:
+        app.result_cache = ResultCache(
+            app.config['RESULT_CACHE_FOLDER'],
+            max_bytes=app.config['RESULT_CACHE_MAX_BYTES']
+        )
+    app.engine = ProcessingEngine(
+        backend=app.config['PROCESSING_BACKEND'],
+        workers=app.config['PROCESS_WORKERS']
+    )
 
     # Configure folders
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    os.makedirs(app.config['ZIP_FOLDER'], exist_ok=True)
+    for key in ('UPLOAD_FOLDER', 'ZIP_FOLDER'):
+        app.config[key] = os.path.join(app.root_path, app.config[key])
+        os.makedirs(app.config[key], exist_ok=True)
 
     # Register routes
     register_routes(app, limiter)
 
     # Setup scheduler
-    setup_scheduler(app)
+    setup_scheduler(app, delay=app.config['SCHEDULER_START_DELAY'])
+
+    if app.config['WARMUP_CODECS']:
+        threading.Thread(target=warm_up, args=(app,), name='codec-warmup', daemon=True).start()
 
-    return app
\ No newline at end of file
+    return app
@@ -0,0 +1,135 @@
+"""Zip archive assembly for processed images."""
+import os
+import shutil
+import threading
+import zipfile
+
+# Output formats that are already compressed; deflating them again costs
+# a full CPU pass for almost no size gain.
+STORED_FORMATS = {'jpg', 'jpeg', 'png', 'gif', 'webp', 'avif'}
+
+def compression_for(filename):
+    """Pick the zip compression method for an archive member."""
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return zipfile.ZIP_STORED if ext in STORED_FORMATS else zipfile.ZIP_DEFLATED
+
+class IncrementalZip:
+    """Zip archive that takes each result as soon as it is encoded.
+
+    Entries are written to ``<zip_path>.part`` and the archive is moved
+    into place on close, so a download never sees a half-written zip.
+    Several work units of one job may add concurrently.
+    """
+
+    def __init__(self, zip_path):
+        os.makedirs(os.path.dirname(zip_path), exist_ok=True)
+        self.zip_path = zip_path
+        self.part_path = f"{zip_path}.part"
+        self.count = 0
+        self._zip = zipfile.ZipFile(self.part_path, 'w', allowZip64=True)
+        self._lock = threading.Lock()
+
+    def add(self, arcname, data):
+        """Append one encoded image to the archive."""
+        with self._lock:
+            self._zip.writestr(arcname, data, compress_type=compression_for(arcname))
+            self.count += 1
+
+    def close(self):
+        """Finish the archive and publish it at zip_path."""
+        self._zip.close()
+        os.replace(self.part_path, self.zip_path)
+        return self.zip_path
+
+    def abort(self):
+        """Discard the partial archive."""
+        self._zip.close()
+        if os.path.exists(self.part_path):
+            os.unlink(self.part_path)
+
+class OutputDirectory:
+    """Loose-file job output that is zipped on the fly at download time.
+
+    Files are written under ``<output_dir>.part`` and the directory is
+    renamed into place on close, mirroring IncrementalZip.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.part_path = f"{output_dir}.part"
+        self.count = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.part_path, exist_ok=True)
+
+    def add(self, arcname, data):
+        """Write one encoded image into the output directory."""
+        with open(os.path.join(self.part_path, arcname), 'wb') as f:
+            f.write(data)
+        with self._lock:
+            self.count += 1
+
+    def close(self):
+        """Publish the directory at output_dir."""
+        os.replace(self.part_path, self.output_dir)
+        return self.output_dir
+
+    def abort(self):
+        """Remove everything written so far."""
+        shutil.rmtree(self.part_path, ignore_errors=True)
+
+class _StreamBuffer:
+    """Unseekable write target that collects zip bytes for a generator."""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def stream_zip(files, chunk_size=64 * 1024):
+    """Yield a zip archive of (arcname, path) pairs chunk by chunk.
+
+    Nothing is written to disk. The output is unseekable, so zipfile emits
+    data descriptors after each member, and ZIP64 records are used as soon
+    as a member or the archive grows past the classic 4 GB limits.
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', allowZip64=True) as zf:
+        for arcname, path in files:
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            info.compress_type = compression_for(arcname)
+            with open(path, 'rb') as src, zf.open(info, 'w') as dest:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            data = buffer.drain()
+            if data:
+                yield data
+    yield buffer.drain()
+
+def directory_members(output_dir):
+    """List (arcname, path) pairs for the files in a job output directory."""
+    return [
+        (name, os.path.join(output_dir, name))
+        for name in sorted(os.listdir(output_dir))
+        if os.path.isfile(os.path.join(output_dir, name))
+    ]
@@ -0,0 +1,284 @@
+"""Headless batch mode: watermark a directory or glob of images.
+
+Usage: watermark INPUT... -o OUTPUT [--watermark logo.png] [--fill 30] [--opacity 50]
+                 [--reduce 60] [--format jpg] [--workers N]
+
+Runs the same pipeline as the web app on a process pool and writes the
+results to a directory, or to a zip when OUTPUT ends in .zip. Every
+finished image is recorded in a JSON lines manifest; running the same
+command again skips what the manifest marks as done.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import zipfile
+from collections import Counter
+from .archive import compression_for
+from .blend import resolve_engine
+from .config import Config
+from .pipeline import ENCODING_PROFILES, OUTPUT_EXTENSIONS, ProcessingEngine, available_output_formats
+from .utils import POSITIONS, PATTERNS, file_digest
+
+# Seconds between progress lines
+REPORT_INTERVAL = 2.0
+
+def glob_root(pattern):
+    """The leading directories of a glob pattern, up to the first wildcard."""
+    parts = pattern.split(os.sep)[:-1]
+    root = []
+    for part in parts:
+        if any(char in part for char in '*?['):
+            break
+        root.append(part)
+    if root == ['']:
+        return os.sep
+    return os.sep.join(root) or '.'
+
+def find_inputs(patterns, extensions):
+    """Expand directories (recursively) and globs into (path, relative name) pairs.
+
+    Names are relative to the directory, or to the part of a glob before
+    its first wildcard, so 'shoot/**/*.jpg' keeps the folder layout.
+    Raises ValueError when two different files would get the same name.
+    """
+    found = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, files in os.walk(pattern):
+                for name in files:
+                    path = os.path.join(root, name)
+                    found.setdefault(os.path.abspath(path), os.path.relpath(path, pattern))
+        else:
+            root = glob_root(pattern)
+            for path in glob.glob(pattern, recursive=True):
+                if os.path.isfile(path):
+                    found.setdefault(os.path.abspath(path), os.path.relpath(path, root))
+    inputs = sorted(
+        (path, name) for path, name in found.items()
+        if os.path.splitext(name)[1][1:].lower() in extensions
+    )
+    paths = {}
+    for path, name in inputs:
+        if name in paths:
+            raise ValueError(f"{paths[name]} and {path} would both be named {name}; pass their common parent instead")
+        paths[name] = path
+    return inputs
+
+def output_names(inputs, output_format):
+    """Map each relative input name to a stable output name.
+
+    Inputs that would collide (photo.jpg and photo.png) keep their
+    original extension in the name. Raises ValueError if names still clash.
+    """
+    extension = OUTPUT_EXTENSIONS[output_format]
+    stems = {}
+    for _, name in inputs:
+        stems.setdefault(os.path.splitext(name)[0], []).append(name)
+    names = {}
+    for stem, group in stems.items():
+        for name in group:
+            if len(group) > 1:
+                names[name] = f"{stem}_{os.path.splitext(name)[1][1:]}.{extension}"
+            else:
+                names[name] = f"{stem}.{extension}"
+    clashes = sorted(name for name, count in Counter(names.values()).items() if count > 1)
+    if clashes:
+        raise ValueError(f"Several inputs would be written as {', '.join(clashes)}")
+    return names
+
+class DirectoryOutput:
+    """Writes each result as a file under a directory, atomically."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self.folder, name))
+
+    def add(self, name, data):
+        path = os.path.join(self.folder, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.part", 'wb') as f:
+            f.write(data)
+        os.replace(f"{path}.part", path)
+
+    def close(self):
+        pass
+
+class ZipOutput:
+    """Appends each result to a zip; it is only complete once closed."""
+
+    def __init__(self, path, resume):
+        mode = 'a' if resume and os.path.exists(path) else 'w'
+        try:
+            self._zip = zipfile.ZipFile(path, mode, allowZip64=True)
+        except zipfile.BadZipFile:
+            raise SystemExit(f"Cannot resume {path}: the archive is incomplete; rerun with --no-resume")
+        self._names = set(self._zip.namelist())
+
+    def exists(self, name):
+        return name in self._names
+
+    def add(self, name, data):
+        self._zip.writestr(name, data, compress_type=compression_for(name))
+        self._names.add(name)
+
+    def close(self):
+        self._zip.close()
+
+def read_manifest(path):
+    """Return the source paths a previous run finished, from its manifest."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by an interrupted run
+                continue
+            if record.get('status') == 'ok':
+                done.add(record['source'])
+    return done
+
+def build_options(args):
+    """Pipeline options matching what the web form would send."""
+    options = {
+        'watermark': None,
+        'watermark_digest': None,
+        'fill_pct': args.fill,
+        'opacity_pct': args.opacity,
+        'position': args.position,
+        'pattern': args.pattern,
+        'reduce_size': args.reduce is not None,
+        'reduce_pct': args.reduce,
+        'draft_margin': Config.JPEG_DRAFT_MARGIN,
+        'resize_first': Config.RESIZE_BEFORE_WATERMARK,
+        'composite_engine': resolve_engine(Config.COMPOSITE_ENGINE),
+        'output_format': args.format,
+        'encoding_profile': args.profile,
+        'quality': {'webp': Config.WEBP_QUALITY, 'avif': Config.AVIF_QUALITY}
+    }
+    if args.watermark:
+        options['watermark'] = os.path.abspath(args.watermark)
+        options['watermark_digest'] = file_digest(args.watermark)
+    return options
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='watermark', description=__doc__.splitlines()[0])
+    parser.add_argument('inputs', nargs='+', help='input directories or glob patterns')
+    parser.add_argument('-o', '--output', required=True, help='output directory, or a .zip file')
+    parser.add_argument('-w', '--watermark', help='watermark image; omit to only resize and convert')
+    parser.add_argument('--fill', type=float, default=30, help='watermark width as %% of the image width')
+    parser.add_argument('--opacity', type=float, default=50, help='watermark opacity %%')
+    parser.add_argument('--position', choices=POSITIONS, default='center')
+    parser.add_argument('--pattern', choices=PATTERNS, default='single')
+    parser.add_argument('--reduce', type=float, metavar='PCT', help='resize to PCT %% of the original size')
+    parser.add_argument('--format', choices=available_output_formats(list(OUTPUT_EXTENSIONS)), default='jpg')
+    parser.add_argument('--profile', choices=sorted(ENCODING_PROFILES), default=Config.ENCODING_PROFILE)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='worker processes')
+    parser.add_argument('--manifest', help='progress manifest (default: beside or inside the output)')
+    parser.add_argument('--no-resume', action='store_true', help='process everything again')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    is_zip = args.output.lower().endswith('.zip')
+    manifest_path = args.manifest or (
+        f"{args.output}.manifest.jsonl" if is_zip else os.path.join(args.output, '.manifest.jsonl')
+    )
+
+    try:
+        inputs = find_inputs(args.inputs, Config.ALLOWED_EXTENSIONS)
+        names = output_names(inputs, args.format)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    if not inputs:
+        print("No images found", file=sys.stderr)
+        return 1
+    options = build_options(args)
+
+    output = ZipOutput(args.output, not args.no_resume) if is_zip else DirectoryOutput(args.output)
+    done = set() if args.no_resume else read_manifest(manifest_path)
+    # The manifest may outlive its output, so trust only what is still there
+    pending = [
+        (path, name) for path, name in inputs
+        if path not in done or not output.exists(names[name])
+    ]
+    skipped = len(inputs) - len(pending)
+    if skipped:
+        print(f"Resuming: {skipped} of {len(inputs)} images already done")
+
+    # One worker gains nothing from a pool; the thread backend also
+    # overlaps encoding with decoding the next image
+    engine = ProcessingEngine(backend='process' if args.workers > 1 else 'thread', workers=args.workers)
+    # Small batches keep Ctrl-C from waiting on the whole backlog
+    batch_size = max(args.workers, 1) * 16
+
+    processed = failed = output_bytes = 0
+    start = last_report = time.monotonic()
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    manifest = open(manifest_path, 'w' if args.no_resume else 'a')
+    try:
+        for offset in range(0, len(pending), batch_size):
+            batch = [
+                {'filename': name, 'path': path, 'size': os.path.getsize(path)}
+                for path, name in pending[offset:offset + batch_size]
+            ]
+            for file_data, result, error in engine.run(batch, options):
+                # Keyed by absolute path, which unlike the name is always unique
+                record = {
+                    'source': file_data['path'],
+                    'name': file_data['filename'],
+                    'output': names[file_data['filename']]
+                }
+                if error is None:
+                    output.add(record['output'], result[1])
+                    output_bytes += len(result[1])
+                    processed += 1
+                    record['status'] = 'ok'
+                else:
+                    failed += 1
+                    record.update(status='failed', error=str(error))
+                    print(f"Failed: {file_data['filename']}: {error}", file=sys.stderr)
+                manifest.write(json.dumps(record) + '\n')
+                manifest.flush()
+
+                now = time.monotonic()
+                if now - last_report >= REPORT_INTERVAL:
+                    last_report = now
+                    finished = processed + failed
+                    rate = finished / (now - start)
+                    eta = (len(pending) - finished) / rate if rate else 0
+                    print(
+                        f"{finished}/{len(pending)} images, {rate:.1f} img/s, ETA {format_duration(eta)}",
+                        file=sys.stderr
+                    )
+    except KeyboardInterrupt:
+        print("Interrupted; run the same command again to resume", file=sys.stderr)
+        return 130
+    finally:
+        manifest.close()
+        output.close()
+        engine.shutdown()
+        elapsed = time.monotonic() - start
+        rate = (processed + failed) / elapsed if elapsed else 0
+        print(
+            f"{processed} processed, {failed} failed, {skipped} skipped in {format_duration(elapsed)} "
+            f"({rate:.1f} img/s, {output_bytes / 1024 / 1024:.1f} MB written)"
+        )
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,6 @@
 """Application configuration."""
 import os
+import tempfile
 
 class Config:
     """Base configuration."""
@@ -33,6 +34,16 @@ class Config:
             'watermark_image': 'Select Watermark Image',
             'watermark_fill': 'Watermark Fill Percentage',
             'opacity': 'Opacity',
+            'position': 'Position',
+            'pattern': 'Pattern',
+            'center': 'Center',
+            'top_left': 'Top Left',
+            'top_right': 'Top Right',
+            'bottom_left': 'Bottom Left',
+            'bottom_right': 'Bottom Right',
+            'single': 'Single',
+            'grid': 'Grid',
+            'diagonal': 'Diagonal',
             'reduce_size': 'Reduce Image Size',
             'reduce_size_percent': 'Size Reduction Percentage',
             'output_format': 'Output Format',
@@ -40,8 +51,17 @@ class Config:
             'jpg_smaller': 'JPEG (Smaller file size)',
             'png_lossless': 'PNG (Lossless quality)',
             'gif': 'GIF',
+            'webp': 'WebP (Smallest files)',
+            'webp_lossless': 'WebP Lossless',
+            'avif': 'AVIF (Smallest, newer browsers)',
+            'encoding_profile': 'Encoding',
+            'profile_fast': 'Fast (larger files)',
+            'profile_balanced': 'Balanced',
+            'profile_smallest': 'Smallest files (slower)',
             'error_no_file': 'Please select at least one file',
             'error_file_too_large': 'One or more files are too large (max 20MB per file)',
+            'error_queue_full': 'The server is busy. Please try again in a moment.',
+            'queue_position': 'Waiting in queue, position',
             'error_total_size': 'Total upload size exceeds 100MB limit',
             'error_loading': 'Error loading files',
             'error_processing': 'Error processing files',
@@ -83,6 +103,16 @@ class Config:
             'watermark_image': 'Selecionar Imagem de Marca D\'água',
             'watermark_fill': 'Percentual de Preenchimento',
             'opacity': 'Opacidade',
+            'position': 'Posição',
+            'pattern': 'Padrão',
+            'center': 'Centro',
+            'top_left': 'Superior Esquerdo',
+            'top_right': 'Superior Direito',
+            'bottom_left': 'Inferior Esquerdo',
+            'bottom_right': 'Inferior Direito',
+            'single': 'Único',
+            'grid': 'Grade',
+            'diagonal': 'Diagonal',
             'reduce_size': 'Reduzir Tamanho da Imagem',
             'reduce_size_percent': 'Percentual de Redução',
             'output_format': 'Formato de Saída',
@@ -90,8 +120,17 @@ class Config:
             'jpg_smaller': 'JPEG (Menor tamanho)',
             'png_lossless': 'PNG (Qualidade sem perdas)',
             'gif': 'GIF',
+            'webp': 'WebP (Menores arquivos)',
+            'webp_lossless': 'WebP sem perdas',
+            'avif': 'AVIF (Menores, navegadores recentes)',
+            'encoding_profile': 'Codificação',
+            'profile_fast': 'Rápida (arquivos maiores)',
+            'profile_balanced': 'Equilibrada',
+            'profile_smallest': 'Arquivos menores (mais lenta)',
             'error_no_file': 'Selecione pelo menos um arquivo',
             'error_file_too_large': 'Um ou mais arquivos são muito grandes (máx 20MB por arquivo)',
+            'error_queue_full': 'O servidor está ocupado. Tente novamente em instantes.',
+            'queue_position': 'Aguardando na fila, posição',
             'error_total_size': 'Tamanho total do upload excede o limite de 100MB',
             'error_loading': 'Erro ao carregar arquivos',
             'error_processing': 'Erro ao processar arquivos',
@@ -116,15 +155,118 @@ class Config:
         }
     }
     
-    # Configure folders
-    UPLOAD_FOLDER = os.path.join("static", "output")
-    ZIP_FOLDER = os.path.join("static", "zips")
+    # Configure folders; relative paths are under the package directory
+    UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', os.path.join("static", "output"))
+    ZIP_FOLDER = os.environ.get('ZIP_FOLDER', os.path.join("static", "zips"))
+    
+    # Uploads are spooled here until their job finishes
+    SPOOL_FOLDER = os.environ.get('SPOOL_FOLDER', os.path.join(tempfile.gettempdir(), 'watermark-spool'))
     
     # File configurations
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+
+    # Output formats offered per upload; 'avif' is dropped at startup when
+    # the Pillow build cannot write it (Pillow 11.2+ or pillow-avif-plugin)
+    OUTPUT_FORMATS = ['jpg', 'png', 'gif', 'webp', 'webp-lossless', 'avif']
+
+    # Lossy WebP/AVIF quality (0-100); encoder effort follows the profile
+    WEBP_QUALITY = int(os.environ.get('WEBP_QUALITY', 80))
+    AVIF_QUALITY = int(os.environ.get('AVIF_QUALITY', 60))
     
     # ✅ INCREASED: Individual file size limit
     MAX_FILE_SIZE = 50 * 1024 * 1024  # 20MB per individual file (was 16MB)
     
     # Optional: Set maximum number of files per upload
     MAX_FILES_PER_UPLOAD = 100  # Reasonable limit to prevent abuse
+
+    # Chunk size suggested to clients of the resumable /uploads API; each
+    # chunk is one PUT, so it also bounds what a dropped connection loses
+    UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+
+    # A chunked upload that receives no chunk for this many seconds is
+    # committed for the client: its incomplete files count as failed
+    UPLOAD_IDLE_TIMEOUT = int(os.environ.get('UPLOAD_IDLE_TIMEOUT', 3600))
+
+    # Job progress store: 'memory' (single process), 'sqlite' (several
+    # workers on one node) or 'redis' (JOB_STORE_URL is a redis:// URL)
+    JOB_STORE = os.environ.get('JOB_STORE', 'memory')
+    JOB_STORE_URL = os.environ.get('JOB_STORE_URL', os.path.join(tempfile.gettempdir(), 'watermark-jobs.sqlite3'))
+    JOB_TTL = int(os.environ.get('JOB_TTL', 24 * 3600))
+
+    # Images processed at once (at least PROCESS_WORKERS with the process
+    # backend); further work units wait in per-client queues and are
+    # started round-robin across clients
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 3))
+
+    # Waiting jobs beyond these totals are refused with 503 Retry-After
+    QUEUE_MAX_IMAGES = int(os.environ.get('QUEUE_MAX_IMAGES', 500))
+    QUEUE_MAX_BYTES = int(os.environ.get('QUEUE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+    # Retry-After seconds until a job has finished to estimate from
+    QUEUE_RETRY_AFTER = 30
+    # Seconds between queue position writes to waiting jobs; every start
+    # moves each job behind it, so they are batched rather than written each time
+    QUEUE_POSITION_INTERVAL = float(os.environ.get('QUEUE_POSITION_INTERVAL', 1.0))
+
+    # Fair-share key: 'remote_addr' or 'session' (one queue per browser)
+    SCHEDULER_CLIENT_KEY = os.environ.get('SCHEDULER_CLIENT_KEY', 'remote_addr')
+
+    # Per-process metric snapshots merged by /metrics; every web and pool
+    # worker process of one deployment must share it (empty disables)
+    METRICS_FOLDER = os.environ.get('METRICS_FOLDER', os.path.join(tempfile.gettempdir(), 'watermark-metrics')) or None
+
+    # Secret that lets an admin profile a job with cProfile by sending it in
+    # an X-Profile-Token header; the stats are then served at
+    # /profile/<session_id>. Unset disables profiling entirely.
+    PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+
+    # Seconds between keepalive comments on an idle progress event stream
+    PROGRESS_STREAM_KEEPALIVE = 15
+
+    # Prepared watermark tiles and full-frame pattern layers shared across
+    # jobs (LRU, evicted by size); a 12 MP layer takes about 48 MB
+    WATERMARK_CACHE_MAX_BYTES = 128 * 1024 * 1024
+
+    # Finished downloads and leftover spools are indexed by expiry time and
+    # deleted by a reaper every REAPER_INTERVAL seconds. Past
+    # DISK_QUOTA_BYTES of indexed downloads (0 disables), the ones closest
+    # to expiry go early.
+    EXPIRY_INDEX = os.environ.get('EXPIRY_INDEX', os.path.join(tempfile.gettempdir(), 'watermark-expiry.sqlite3'))
+    OUTPUT_TTL = int(os.environ.get('OUTPUT_TTL', 24 * 3600))
+    DISK_QUOTA_BYTES = int(os.environ.get('DISK_QUOTA_BYTES', 0))
+    REAPER_INTERVAL = 60
+
+    # Startup: seconds before the maintenance scheduler starts, and whether
+    # to load Pillow codecs and libmagic in the background right away
+    # rather than on the first upload
+    SCHEDULER_START_DELAY = float(os.environ.get('SCHEDULER_START_DELAY', 5))
+    WARMUP_CODECS = os.environ.get('WARMUP_CODECS', '1') == '1'
+
+    # On-disk cache of encoded outputs keyed by source and settings, off
+    # unless RESULT_CACHE_MAX_BYTES is set (e.g. 1073741824 for 1 GB)
+    RESULT_CACHE_FOLDER = os.environ.get('RESULT_CACHE_FOLDER', os.path.join(tempfile.gettempdir(), 'watermark-results'))
+    RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 0))
+
+    # Image processing backend: 'thread' processes a batch inline in the job
+    # thread, 'process' fans each image out to a process pool
+    PROCESSING_BACKEND = os.environ.get('PROCESSING_BACKEND', 'thread')
+    PROCESS_WORKERS = int(os.environ.get('PROCESS_WORKERS', 0)) or os.cpu_count()
+
+    # Download delivery: 'archive' builds static/zips/<id>.zip as images
+    # finish, 'stream' keeps loose files and zips them on the fly per download
+    ZIP_DELIVERY = os.environ.get('ZIP_DELIVERY', 'archive')
+
+    # When reducing size, decode JPEGs at the smallest DCT scale that still
+    # leaves this many times the output size for the final resample
+    # (higher is closer to a full decode, 0 always decodes at full size)
+    JPEG_DRAFT_MARGIN = float(os.environ.get('JPEG_DRAFT_MARGIN', 2.0))
+
+    # Encoder profile used when the form does not pick one: 'fast',
+    # 'balanced' or 'smallest' (see pipeline.ENCODING_PROFILES)
+    ENCODING_PROFILE = os.environ.get('ENCODING_PROFILE', 'balanced')
+
+    # Watermark compositing for single placements: 'pillow' (Image.paste)
+    # or 'numpy' (premultiplied blend of the watermark region; needs numpy)
+    COMPOSITE_ENGINE = os.environ.get('COMPOSITE_ENGINE', 'pillow')
+
+    # Resize before compositing the watermark instead of after
+    RESIZE_BEFORE_WATERMARK = os.environ.get('RESIZE_BEFORE_WATERMARK', '1') == '1'
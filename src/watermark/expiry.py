@@ -0,0 +1,157 @@
+"""Expiry index of job artifacts on disk, reaped without directory scans."""
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+def artifact_size(path):
+    """Bytes used by a file, or by the files of one job's directory."""
+    if os.path.isdir(path):
+        total = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def remove_artifact(path):
+    """Delete a file or directory; a missing path counts as removed."""
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+class ExpiryIndex:
+    """SQLite table of (path, expires_at, bytes) for job artifacts.
+
+    Jobs register what they leave on disk when they finish; ``reap``
+    deletes only the rows that are due, oldest first, through the
+    expires_at index. With a quota, ``reap`` also evicts the artifacts
+    closest to expiry early until the indexed total fits. Only artifacts
+    with a size are evicted early: files of jobs still running are added
+    with size=0 and wait for their TTL. Several processes may share one
+    index file.
+    """
+
+    def __init__(self, path, max_bytes=0):
+        self.path = path
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS artifacts ('
+                'path TEXT PRIMARY KEY, expires_at REAL NOT NULL, bytes INTEGER NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS artifacts_expires_at ON artifacts (expires_at)')
+
+    @contextmanager
+    def _connection(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def add(self, path, ttl, size=None):
+        """Schedule path for deletion ttl seconds from now.
+
+        size defaults to the bytes on disk; pass 0 for something still in
+        use, which keeps the quota from evicting it.
+        """
+        if size is None:
+            size = artifact_size(path)
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO artifacts (path, expires_at, bytes) VALUES (?, ?, ?)',
+                (os.path.abspath(path), time.time() + ttl, size)
+            )
+
+    def adopt(self, paths, ttl, size=None):
+        """Index the paths not indexed yet, leaving existing rows alone.
+
+        Takes the same size as ``add``; returns the number of paths added.
+        """
+        paths = [os.path.abspath(path) for path in paths]
+        with self._connection() as conn:
+            known = {path for path, in conn.execute('SELECT path FROM artifacts')}
+        expires_at = time.time() + ttl
+        rows = [
+            (path, expires_at, artifact_size(path) if size is None else size)
+            for path in paths if path not in known
+        ]
+        with self._connection() as conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO artifacts (path, expires_at, bytes) VALUES (?, ?, ?)', rows
+            )
+        return len(rows)
+
+    def total_bytes(self):
+        """Bytes held by every indexed artifact."""
+        with self._connection() as conn:
+            return conn.execute('SELECT COALESCE(SUM(bytes), 0) FROM artifacts').fetchone()[0]
+
+    def reap(self, now=None):
+        """Delete due artifacts, then evict early while over the quota.
+
+        Returns the number of artifacts removed.
+        """
+        now = time.time() if now is None else now
+        with self._connection() as conn:
+            due = conn.execute(
+                'SELECT path FROM artifacts WHERE expires_at <= ? ORDER BY expires_at', (now,)
+            ).fetchall()
+        removed = self._remove([path for path, in due])
+        if removed:
+            logger.info(f"Deleted {removed} expired artifacts")
+
+        if self.max_bytes:
+            total = self.total_bytes()
+            if total > self.max_bytes:
+                with self._connection() as conn:
+                    # The newest artifact is never evicted to make room for itself
+                    candidates = conn.execute(
+                        'SELECT path, bytes FROM artifacts WHERE bytes > 0 '
+                        'AND expires_at < (SELECT MAX(expires_at) FROM artifacts WHERE bytes > 0) '
+                        'ORDER BY expires_at'
+                    ).fetchall()
+                evict = []
+                for path, size in candidates:
+                    if total <= self.max_bytes:
+                        break
+                    evict.append(path)
+                    total -= size
+                evicted = self._remove(evict)
+                logger.info(f"Disk quota exceeded; evicted {evicted} artifacts early")
+                removed += evicted
+        return removed
+
+    def _remove(self, paths):
+        removed = []
+        for path in paths:
+            try:
+                remove_artifact(path)
+            except OSError as e:
+                # Left in the index to be retried on the next pass
+                logger.error(f"Failed to delete {path}: {e}")
+                continue
+            removed.append(path)
+        if removed:
+            with self._connection() as conn:
+                conn.executemany('DELETE FROM artifacts WHERE path = ?', [(path,) for path in removed])
+        return len(removed)
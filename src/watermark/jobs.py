@@ -0,0 +1,421 @@
+"""Job progress storage shared between the worker and the progress routes."""
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+class JobStore(ABC):
+    """Interface for job state backends.
+
+    A job is a flat dict of JSON-serializable fields. Counters such as
+    ``done`` and ``failed`` must be updated through ``increment`` so that
+    concurrent workers never lose an update. Every write refreshes the
+    job's TTL and bumps its ``version`` field.
+
+    Per-image records are kept beside the job rather than in it, so
+    reading progress stays cheap however many images a job has. They
+    share the job's lifetime but adding one does not bump its version.
+    """
+
+    # Server-side poll interval for backends that cannot push changes
+    poll_interval = 0.5
+
+    def __init__(self, ttl=24 * 3600):
+        self.ttl = ttl
+
+    def wait_for_change(self, job_id, version, timeout):
+        """Return the job once its version differs from version.
+
+        Returns the unchanged job after timeout, or None if it is gone.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job.get('version') != version:
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return job
+            time.sleep(min(self.poll_interval, remaining))
+
+    @abstractmethod
+    def create(self, job_id, **fields):
+        """Store a new job, replacing any job with the same id."""
+
+    @abstractmethod
+    def get(self, job_id):
+        """Return the job's fields, or None if it does not exist."""
+
+    @abstractmethod
+    def update(self, job_id, **fields):
+        """Set fields of an existing job; a missing job is left alone."""
+
+    @abstractmethod
+    def increment(self, job_id, field, amount=1):
+        """Add to a counter and return its new value, or None if the job is gone."""
+
+    @abstractmethod
+    def accumulate(self, job_id, amounts, **fields):
+        """Add amounts to counters and set fields in one atomic write.
+
+        Returns the counters' new values, or None if the job is gone.
+        """
+
+    @abstractmethod
+    def add_record(self, job_id, record):
+        """Keep a record beside an existing job; a missing job is left alone."""
+
+    @abstractmethod
+    def records(self, job_id):
+        """Return the job's records in the order they were added."""
+
+    @abstractmethod
+    def delete(self, job_id):
+        """Remove a job and its records."""
+
+class MemoryJobStore(JobStore):
+    """In-process store; only valid with a single web worker process."""
+
+    def __init__(self, ttl=24 * 3600):
+        super().__init__(ttl)
+        self._jobs = {}
+        self._records = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def create(self, job_id, **fields):
+        with self._lock:
+            self._purge_expired()
+            self._jobs[job_id] = dict(fields, version=0)
+            self._records[job_id] = []
+            self._touch(job_id)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._get(job_id)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+                self._touch(job_id)
+
+    def increment(self, job_id, field, amount=1):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job[field] = job.get(field, 0) + amount
+            self._touch(job_id)
+            return job[field]
+
+    def accumulate(self, job_id, amounts, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            for field, amount in amounts.items():
+                job[field] = job.get(field, 0) + amount
+            job.update(fields)
+            self._touch(job_id)
+            return {field: job[field] for field in amounts}
+
+    def add_record(self, job_id, record):
+        with self._lock:
+            if job_id in self._records:
+                self._records[job_id].append(record)
+
+    def records(self, job_id):
+        with self._lock:
+            if self._get(job_id) is None:
+                return []
+            return list(self._records[job_id])
+
+    def delete(self, job_id):
+        with self._lock:
+            self._drop(job_id)
+            self._changed.notify_all()
+
+    def wait_for_change(self, job_id, version, timeout):
+        # Writers notify the condition, so waiting costs nothing until a change
+        with self._changed:
+            self._changed.wait_for(
+                lambda: (self._get(job_id) or {}).get('version', -1) != version,
+                timeout=timeout
+            )
+            return self._get(job_id)
+
+    def _get(self, job_id):
+        if self._expires.get(job_id, 0) < time.time():
+            self._drop(job_id)
+            return None
+        return dict(self._jobs[job_id])
+
+    def _touch(self, job_id):
+        self._jobs[job_id]['version'] = self._jobs[job_id].get('version', 0) + 1
+        self._expires[job_id] = time.time() + self.ttl
+        self._changed.notify_all()
+
+    def _drop(self, job_id):
+        self._jobs.pop(job_id, None)
+        self._records.pop(job_id, None)
+        self._expires.pop(job_id, None)
+
+    def _purge_expired(self):
+        now = time.time()
+        for job_id in [j for j, expires in self._expires.items() if expires < now]:
+            self._drop(job_id)
+
+class SQLiteJobStore(JobStore):
+    """SQLite-backed store for several worker processes on one node."""
+
+    BUMP_VERSION = "'$.version', COALESCE(json_extract(data, '$.version'), 0) + 1"
+
+    def __init__(self, path, ttl=24 * 3600):
+        super().__init__(ttl)
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_expires_at ON jobs (expires_at)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS job_records ('
+                'seq INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL, data TEXT NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS job_records_job_id ON job_records (job_id)')
+
+    @contextmanager
+    def _connection(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def create(self, job_id, **fields):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                'DELETE FROM job_records WHERE job_id IN (SELECT id FROM jobs WHERE expires_at < ?) OR job_id = ?',
+                (now, job_id)
+            )
+            conn.execute('DELETE FROM jobs WHERE expires_at < ?', (now,))
+            conn.execute(
+                'INSERT OR REPLACE INTO jobs (id, data, expires_at) VALUES (?, ?, ?)',
+                (job_id, json.dumps(dict(fields, version=0)), now + self.ttl)
+            )
+
+    def get(self, job_id):
+        with self._connection() as conn:
+            row = conn.execute(
+                'SELECT data FROM jobs WHERE id = ? AND expires_at >= ?',
+                (job_id, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, job_id, **fields):
+        if not fields:
+            return
+        # json_set applies every field in a single atomic UPDATE
+        paths = ', '.join('?, json(?)' for _ in fields)
+        params = []
+        for key, value in fields.items():
+            params.extend([f'$.{key}', json.dumps(value)])
+        with self._connection() as conn:
+            conn.execute(
+                f'UPDATE jobs SET data = json_set(data, {paths}, {self.BUMP_VERSION}), '
+                'expires_at = ? WHERE id = ?',
+                (*params, time.time() + self.ttl, job_id)
+            )
+
+    def increment(self, job_id, field, amount=1):
+        path = f'$.{field}'
+        with self._connection() as conn:
+            # Write lock up front so the read-back sees our own increment
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(
+                    'UPDATE jobs SET data = json_set(data, ?, '
+                    f'COALESCE(json_extract(data, ?), 0) + ?, {self.BUMP_VERSION}), '
+                    'expires_at = ? WHERE id = ?',
+                    (path, path, amount, time.time() + self.ttl, job_id)
+                )
+                row = conn.execute(
+                    'SELECT json_extract(data, ?) FROM jobs WHERE id = ?', (path, job_id)
+                ).fetchone()
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return row[0] if row else None
+
+    def accumulate(self, job_id, amounts, **fields):
+        paths = []
+        params = []
+        for field, amount in amounts.items():
+            paths.append('?, COALESCE(json_extract(data, ?), 0) + ?')
+            params.extend([f'$.{field}', f'$.{field}', amount])
+        for key, value in fields.items():
+            paths.append('?, json(?)')
+            params.extend([f'$.{key}', json.dumps(value)])
+        with self._connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                updated = conn.execute(
+                    f"UPDATE jobs SET data = json_set(data, {', '.join(paths)}, {self.BUMP_VERSION}), "
+                    'expires_at = ? WHERE id = ? AND expires_at >= ?',
+                    (*params, time.time() + self.ttl, job_id, time.time())
+                ).rowcount
+                row = conn.execute('SELECT data FROM jobs WHERE id = ?', (job_id,)).fetchone()
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        if not updated:
+            return None
+        job = json.loads(row[0])
+        return {field: job[field] for field in amounts}
+
+    def add_record(self, job_id, record):
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT INTO job_records (job_id, data) '
+                'SELECT id, ? FROM jobs WHERE id = ? AND expires_at >= ?',
+                (json.dumps(record), job_id, time.time())
+            )
+
+    def records(self, job_id):
+        with self._connection() as conn:
+            rows = conn.execute(
+                'SELECT job_records.data FROM job_records JOIN jobs ON jobs.id = job_records.job_id '
+                'WHERE job_id = ? AND expires_at >= ? ORDER BY seq',
+                (job_id, time.time())
+            ).fetchall()
+        return [json.loads(data) for data, in rows]
+
+    def delete(self, job_id):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+            conn.execute('DELETE FROM job_records WHERE job_id = ?', (job_id,))
+
+class RedisJobStore(JobStore):
+    """Redis-backed store; jobs are hashes of JSON-encoded fields.
+
+    Each write and its version bump and TTL refresh go in one MULTI/EXEC
+    transaction, so readers never see new data under an old version and
+    no key is left without a TTL. Works with any client exposing the
+    redis-py hash and pipeline API, which lets tests use a local stand-in.
+    """
+
+    def __init__(self, client, ttl=24 * 3600, prefix='watermark:job:'):
+        # Redis expiries are whole seconds
+        super().__init__(max(1, int(ttl)))
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, ttl=24 * 3600):
+        import redis
+        return cls(redis.Redis.from_url(url), ttl=ttl)
+
+    def _key(self, job_id):
+        return f'{self.prefix}{job_id}'
+
+    def _records_key(self, job_id):
+        return f'{self.prefix}{job_id}:records'
+
+    def create(self, job_id, **fields):
+        key = self._key(job_id)
+        fields = dict(fields, version=0)
+        with self.client.pipeline(transaction=True) as pipe:
+            pipe.delete(key, self._records_key(job_id))
+            pipe.hset(key, mapping={k: json.dumps(v) for k, v in fields.items()})
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+
+    def get(self, job_id):
+        data = self.client.hgetall(self._key(job_id))
+        if not data:
+            return None
+        return {
+            (k.decode() if isinstance(k, bytes) else k): json.loads(v)
+            for k, v in data.items()
+        }
+
+    def update(self, job_id, **fields):
+        key = self._key(job_id)
+        # A job that expired or was deleted is not brought back
+        if not fields or not self.client.exists(key):
+            return
+        with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={k: json.dumps(v) for k, v in fields.items()})
+            pipe.hincrby(key, 'version', 1)
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+
+    def increment(self, job_id, field, amount=1):
+        key = self._key(job_id)
+        if not self.client.exists(key):
+            return None
+        with self.client.pipeline(transaction=True) as pipe:
+            pipe.hincrby(key, field, amount)
+            pipe.hincrby(key, 'version', 1)
+            pipe.expire(key, self.ttl)
+            value = pipe.execute()[0]
+        return int(value)
+
+    def accumulate(self, job_id, amounts, **fields):
+        key = self._key(job_id)
+        if not self.client.exists(key):
+            return None
+        with self.client.pipeline(transaction=True) as pipe:
+            for field, amount in amounts.items():
+                if isinstance(amount, float):
+                    pipe.hincrbyfloat(key, field, amount)
+                else:
+                    pipe.hincrby(key, field, amount)
+            if fields:
+                pipe.hset(key, mapping={k: json.dumps(v) for k, v in fields.items()})
+            pipe.hincrby(key, 'version', 1)
+            pipe.expire(key, self.ttl)
+            pipe.expire(self._records_key(job_id), self.ttl)
+            values = pipe.execute()[:len(amounts)]
+        return {field: type(amount)(value) for (field, amount), value in zip(amounts.items(), values)}
+
+    def add_record(self, job_id, record):
+        key = self._key(job_id)
+        if not self.client.exists(key):
+            return
+        records_key = self._records_key(job_id)
+        with self.client.pipeline(transaction=True) as pipe:
+            pipe.rpush(records_key, json.dumps(record))
+            pipe.expire(records_key, self.ttl)
+            pipe.execute()
+
+    def records(self, job_id):
+        return [json.loads(data) for data in self.client.lrange(self._records_key(job_id), 0, -1)]
+
+    def delete(self, job_id):
+        self.client.delete(self._key(job_id), self._records_key(job_id))
+
+def create_job_store(config):
+    """Build the job store selected by JOB_STORE."""
+    backend = config['JOB_STORE']
+    ttl = config['JOB_TTL']
+    if backend == 'memory':
+        return MemoryJobStore(ttl=ttl)
+    if backend == 'sqlite':
+        return SQLiteJobStore(config['JOB_STORE_URL'], ttl=ttl)
+    if backend == 'redis':
+        return RedisJobStore.from_url(config['JOB_STORE_URL'], ttl=ttl)
+    raise ValueError(f"Unknown job store: {backend}")
@@ -0,0 +1,252 @@
+"""Pipeline metrics shared across processes, exposed in Prometheus text format.
+
+Every process (web workers and processing pool workers alike) keeps its
+own counters in memory and snapshots them to ``<folder>/<pid>.json``.
+The /metrics route merges all snapshots: counters and histograms are
+summed over every process that ever wrote one, gauges only over the
+processes still alive. Snapshots of exited processes are folded into
+``archive.json`` and deleted, so the folder stays as small as the set
+of live processes and a reused pid never overwrites a predecessor's
+totals. Pool workers get the folder through their pool initializer.
+"""
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+JOB_SECONDS_BUCKETS = (1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+MEGAPIXEL_BUCKETS = (0.5, 1, 2, 4, 8, 12, 16, 24, 32, 50, 100)
+BYTES_BUCKETS = (1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2.5e7, 5e7)
+
+# name -> (type, help, buckets)
+METRICS = {
+    'watermark_stage_seconds': ('histogram', 'Time spent per image in each pipeline stage', SECONDS_BUCKETS),
+    'watermark_input_megapixels': ('histogram', 'Decoded size of input images', MEGAPIXEL_BUCKETS),
+    'watermark_input_bytes': ('histogram', 'Encoded size of input images', BYTES_BUCKETS),
+    'watermark_job_seconds': ('histogram', 'Job latency from upload to finished', JOB_SECONDS_BUCKETS),
+    'watermark_images_total': ('counter', 'Images handled, by outcome', None),
+    'watermark_failures_total': ('counter', 'Pipeline failures, by stage', None),
+    'watermark_queue_images': ('gauge', 'Images waiting for a worker', None),
+    'watermark_queue_bytes': ('gauge', 'Upload bytes waiting for a worker', None),
+    'watermark_active_workers': ('gauge', 'Work units currently running', None),
+    'watermark_worker_slots': ('gauge', 'Work units that may run at once', None)
+}
+
+def _series(name, labels):
+    label_text = ','.join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    return f'{name}\t{label_text}'
+
+class Registry:
+    """Per-process metric values plus the snapshot files of all processes."""
+
+    # Minimum seconds between snapshot writes from the hot path
+    flush_interval = 1.0
+
+    def __init__(self, folder=None):
+        self.folder = folder
+        self._lock = threading.Lock()
+        self._values = {'histogram': {}, 'counter': {}, 'gauge': {}}
+        self._dirty = False
+        self._last_flush = 0.0
+        self._flushed_pid = None
+
+    @property
+    def enabled(self):
+        return self.folder is not None
+
+    def observe(self, name, value, **labels):
+        """Record one observation in a histogram."""
+        if not self.enabled:
+            return
+        buckets = METRICS[name][2]
+        key = _series(name, labels)
+        with self._lock:
+            series = self._values['histogram'].get(key)
+            if series is None:
+                # One count per bucket and +Inf, then the sum
+                series = self._values['histogram'][key] = [0] * (len(buckets) + 1) + [0.0]
+            index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+            series[index] += 1
+            series[-1] += value
+            self._dirty = True
+
+    def inc(self, name, amount=1, **labels):
+        """Add to a counter."""
+        if not self.enabled:
+            return
+        key = _series(name, labels)
+        with self._lock:
+            counters = self._values['counter']
+            counters[key] = counters.get(key, 0) + amount
+            self._dirty = True
+
+    def set(self, name, value, **labels):
+        """Set a gauge."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._values['gauge'][_series(name, labels)] = value
+            self._dirty = True
+
+    @contextmanager
+    def timed(self, stage, timings=None):
+        """Time a pipeline stage, counting a failure if it raises.
+
+        The duration is also added to timings[stage] when a dict is given,
+        which is how a job collects its own per-image breakdown.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc('watermark_failures_total', stage=stage)
+            raise
+        elapsed = time.perf_counter() - start
+        self.observe('watermark_stage_seconds', elapsed, stage=stage)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0) + elapsed
+
+    def flush(self, force=False):
+        """Write this process's snapshot if it changed since the last write."""
+        if not self.enabled:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if not self._dirty or (not force and now - self._last_flush < self.flush_interval):
+                return
+            pid = os.getpid()
+            snapshot = json.dumps({'pid': pid, 'values': self._values})
+            self._dirty = False
+            self._last_flush = now
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, f'{pid}.json')
+        if self._flushed_pid != pid:
+            # A snapshot already under our pid belongs to an exited process
+            if os.path.exists(path):
+                self._archive([path])
+            self._flushed_pid = pid
+        _write_json(self.folder, path, snapshot)
+
+    def collect(self):
+        """Merge the snapshots of every process into one set of values.
+
+        Snapshots of processes that have exited are archived on the way.
+        """
+        self.flush(force=True)
+        snapshots = []
+        dead = []
+        for entry in os.scandir(self.folder):
+            if not entry.name.endswith('.json') or entry.name == ARCHIVE_NAME:
+                continue
+            snapshot = _read_json(entry.path)
+            if snapshot is None:
+                continue
+            if _alive(snapshot['pid']):
+                snapshots.append(snapshot)
+            else:
+                dead.append(entry.path)
+        if dead:
+            self._archive(dead)
+        archive = _read_json(os.path.join(self.folder, ARCHIVE_NAME))
+        if archive is not None:
+            snapshots.append(archive)
+        merged = _empty_values()
+        for snapshot in snapshots:
+            _merge(merged, snapshot['values'])
+        return merged
+
+    def _archive(self, paths):
+        """Fold the counters and histograms of exited processes into the archive."""
+        archive_path = os.path.join(self.folder, ARCHIVE_NAME)
+        # One archiver at a time across processes, or totals could be lost
+        with open(os.path.join(self.folder, 'archive.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive = _read_json(archive_path) or {'pid': None, 'values': _empty_values()}
+            folded = []
+            for path in paths:
+                snapshot = _read_json(path)
+                # Gone, or rewritten by a new process that reused the pid
+                if snapshot is None or (snapshot['pid'] != os.getpid() and _alive(snapshot['pid'])):
+                    continue
+                snapshot['values']['gauge'] = {}
+                _merge(archive['values'], snapshot['values'])
+                folded.append(path)
+            if folded:
+                _write_json(self.folder, archive_path, json.dumps(archive))
+            for path in folded:
+                os.remove(path)
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        merged = self.collect()
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, value in sorted(merged[kind].items()):
+                series, labels = key.split('\t')
+                if series != name:
+                    continue
+                if kind != 'histogram':
+                    lines.append(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}')
+                    continue
+                prefix = f'{labels},' if labels else ''
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ['+Inf'], value[:-1]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+                label_suffix = f'{{{labels}}}' if labels else ''
+                lines.append(f'{name}_sum{label_suffix} {value[-1]}')
+                lines.append(f'{name}_count{label_suffix} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+# Snapshot holding the summed counters of every process that has exited
+ARCHIVE_NAME = 'archive.json'
+
+def _empty_values():
+    return {'histogram': {}, 'counter': {}, 'gauge': {}}
+
+def _merge(merged, values):
+    for kind, series in values.items():
+        for key, value in series.items():
+            if kind == 'histogram':
+                total = merged[kind].setdefault(key, [0] * len(value))
+                merged[kind][key] = [a + b for a, b in zip(total, value)]
+            else:
+                merged[kind][key] = merged[kind].get(key, 0) + value
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_json(folder, path, text):
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+# Shared by everything in this process; create_app and the processing
+# pool initializer point it at a folder
+registry = Registry()
+
+def configure(folder):
+    """Enable metrics in this process, writing snapshots to folder (None disables)."""
+    registry.folder = folder
+    if folder is not None:
+        os.makedirs(folder, exist_ok=True)
@@ -0,0 +1,577 @@
+"""Per-image processing pipeline and execution backends."""
+import os
+import shutil
+import logging
+import functools
+import tempfile
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from io import BytesIO
+from uuid import uuid4
+from PIL import Image, ImageChops, ImageSequence
+from .utils import apply_watermark, draft_for_resize, file_digest, resize_image, watermark_digest
+from .result_cache import result_key
+from .metrics import configure as configure_metrics, registry as metrics
+from .profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+def file_source(file_data):
+    """Return the spooled path of an upload, or its bytes if held in memory."""
+    return file_data.get('path') or file_data['content']
+
+def source_digest(file_data):
+    """Hash an upload's bytes, whether spooled or held in memory."""
+    if file_data.get('path'):
+        return file_digest(file_data['path'])
+    return watermark_digest(file_data['content'])
+
+def open_source(source):
+    """Open an image from in-memory bytes or a file path."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Image.open(BytesIO(source))
+    return Image.open(source)
+
+def output_filename(filename, output_format):
+    """Build a safe, unique output filename for an uploaded file."""
+    base_name = os.path.splitext(filename)[0]
+    safe_name = "".join(c for c in base_name if c.isalnum() or c in (' ', '-', '_')).strip()
+    safe_name = safe_name.replace(' ', '_')
+    extension = OUTPUT_EXTENSIONS.get(output_format, output_format)
+    return f"{safe_name}_{str(uuid4())[:8]}.{extension}"
+
+# Encoder settings per speed/size trade-off. PNG compression and GIF
+# quantization dominate encode time on large images; 'smallest' matches
+# the settings used before profiles existed, plus progressive JPEG.
+# For lossless WebP, quality is compression effort rather than fidelity.
+ENCODING_PROFILES = {
+    'fast': {
+        'jpg': {'quality': 85, 'optimize': False, 'progressive': False, 'subsampling': '4:2:0'},
+        'png': {'compress_level': 1},
+        'gif': {'optimize': False},
+        'gif_quantize': Image.Quantize.FASTOCTREE,
+        'webp': {'method': 0},
+        'webp-lossless': {'method': 0, 'quality': 0},
+        'avif': {'speed': 10}
+    },
+    'balanced': {
+        'jpg': {'quality': 85, 'optimize': True, 'progressive': False, 'subsampling': '4:2:0'},
+        'png': {'compress_level': 3},
+        'gif': {'optimize': True},
+        'gif_quantize': Image.Quantize.FASTOCTREE,
+        'webp': {'method': 4},
+        'webp-lossless': {'method': 1, 'quality': 25},
+        'avif': {'speed': 6}
+    },
+    'smallest': {
+        'jpg': {'quality': 85, 'optimize': True, 'progressive': True, 'subsampling': '4:2:0'},
+        'png': {'optimize': True},
+        'gif': {'optimize': True},
+        'gif_quantize': Image.Quantize.MEDIANCUT,
+        'webp': {'method': 6},
+        'webp-lossless': {'method': 4, 'quality': 75},
+        'avif': {'speed': 2}
+    }
+}
+
+# Output format -> file extension; lossless WebP shares the .webp extension
+OUTPUT_EXTENSIONS = {
+    'jpg': 'jpg',
+    'png': 'png',
+    'gif': 'gif',
+    'webp': 'webp',
+    'webp-lossless': 'webp',
+    'avif': 'avif'
+}
+
+# Default lossy quality for WebP and AVIF when the caller sets none
+DEFAULT_QUALITY = {'webp': 80, 'avif': 60}
+
+@functools.lru_cache(maxsize=None)
+def avif_supported():
+    """Whether this Pillow build can write AVIF."""
+    try:
+        # Older Pillow releases get AVIF from this plugin, registered on import
+        import pillow_avif  # noqa: F401
+    except ImportError:
+        pass
+    Image.init()
+    return 'AVIF' in Image.SAVE
+
+def available_output_formats(formats):
+    """Drop output formats this Pillow build cannot write."""
+    return [fmt for fmt in formats if fmt != 'avif' or avif_supported()]
+
+def warm_codecs(formats):
+    """Load Pillow's plugins and round-trip a tiny image through each format.
+
+    Run in the background at startup, so the first upload does not pay
+    for plugin imports and codec setup.
+    """
+    img = Image.new('RGBA', (16, 16), (200, 100, 50, 128))
+    for output_format in available_output_formats(formats):
+        try:
+            Image.open(BytesIO(encode_image(img, output_format))).load()
+        except Exception as e:
+            logger.warning(f"Could not warm up the {output_format} codec: {e}")
+
+def keep_alpha(img):
+    """Convert for an alpha-capable encoder, dropping alpha when all opaque."""
+    if img.mode == 'P' or 'A' in img.getbands():
+        img = img.convert('RGBA')
+        if img.getchannel('A').getextrema() != (255, 255):
+            return img
+    return img.convert('RGB')
+
+def quantize_for_gif(img, method):
+    """Reduce an image to a 256 colour palette with the given quantizer."""
+    if img.mode == 'P':
+        return img
+    img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+    if img.mode == 'RGBA' and method != Image.Quantize.FASTOCTREE:
+        # Image.quantize only accepts RGBA for the octree quantizers
+        return img.convert('P', palette=Image.ADAPTIVE)
+    return img.quantize(256, method=method)
+
+def color_swatch(colors, size):
+    """An image of the given size striped diagonally with colors.
+
+    Watermarked, it holds the watermark blended over every colour.
+    """
+    width, height = size
+    row = Image.new('RGB', (width + height, 1))
+    row.putdata([colors[index % len(colors)] for index in range(width + height)])
+    swatch = Image.new('RGB', size)
+    for y in range(height):
+        swatch.paste(row.crop((y, 0, y + width, 1)), (0, y))
+    return swatch
+
+def gif_palette(colors, region, method, transparent):
+    """Build the palette shared by every frame of an animation.
+
+    The source's colours and the watermarked region (None without a
+    watermark) weigh equally, so the blended colours the watermark adds
+    are not crowded out. Only real colours are in it, at most 255 with
+    transparency so one index is left for ``map_to_palette`` to add.
+    """
+    side = 256
+    swatch = Image.new('RGB', (len(colors), 1))
+    swatch.putdata(colors)
+    sample = Image.new('RGB', (side * 2, side))
+    sample.paste(swatch.resize((side, side), Image.Resampling.NEAREST))
+    if region is not None:
+        sample.paste(region.convert('RGB').resize((side, side), Image.Resampling.NEAREST), (side, 0))
+    else:
+        sample = sample.crop((0, 0, side, side))
+
+    count = 255 if transparent else 256
+    palette = sample.quantize(count, method=method).getpalette()[:count * 3]
+    # Pillow's GIF writer remaps frames slowly when palette entries repeat
+    entries = list(dict.fromkeys(tuple(palette[index:index + 3]) for index in range(0, len(palette), 3)))
+    palette_image = Image.new('P', (1, 1))
+    palette_image.putpalette([channel for color in entries for channel in color])
+    return palette_image
+
+def transparent_index(palette):
+    """Index of the transparent slot appended after a shared palette's colours."""
+    return len(palette.getpalette()) // 3
+
+def map_to_palette(img, palette, transparent):
+    """Map a frame onto a shared palette without dithering.
+
+    Dithering would make unchanged areas differ between frames, which
+    defeats the GIF writer's delta encoding. With transparency, mostly
+    clear pixels go to an extra slot after the palette's colours, which
+    the quantizer never picks for an opaque pixel.
+    """
+    frame = img.convert('RGB').quantize(palette=palette, dither=Image.Dither.NONE)
+    if transparent:
+        colors = palette.getpalette()
+        # The slot's colour is never shown; it copies a real one
+        frame.putpalette(colors + colors[:3])
+        clear = img.getchannel('A').point(lambda alpha: 255 if alpha < 128 else 0)
+        frame.paste(transparent_index(palette), mask=clear)
+    return frame
+
+def difference_bbox(a, b):
+    """Bounding box of the pixels that differ in any band of two RGBA images."""
+    red, green, blue, alpha = ImageChops.difference(a, b).split()
+    return ImageChops.lighter(ImageChops.lighter(red, green), ImageChops.lighter(blue, alpha)).getbbox()
+
+class Animation:
+    """Paletted frames of a watermarked animated GIF, ready to be written."""
+
+    def __init__(self, frames, durations, disposals, loop=None, transparency=None):
+        self.frames = frames
+        self.durations = durations
+        self.disposals = disposals
+        self.loop = loop
+        # Palette index of transparent pixels, if any
+        self.transparency = transparency
+
+    @property
+    def size(self):
+        return self.frames[0].size
+
+    def save(self, buffer, **params):
+        # Pillow only takes a list of disposals when it writes several frames
+        disposal = self.disposals if len(set(self.disposals)) > 1 else self.disposals[0]
+        # Writing the shared palette as the global one spares every frame a
+        # local colour table, and keeps Pillow from optimizing each frame's
+        # palette, which would lose track of the transparent index
+        params.pop('optimize', None)
+        params.update(
+            save_all=True,
+            append_images=self.frames[1:],
+            duration=self.durations,
+            disposal=disposal,
+            palette=bytes(self.frames[0].getpalette())
+        )
+        if self.loop is not None:
+            params['loop'] = self.loop
+        if self.transparency is not None:
+            params['transparency'] = self.transparency
+        self.frames[0].save(buffer, 'GIF', **params)
+
+def encode_image(img, output_format, profile='balanced', quality=None):
+    """Encode an image in the requested output format and return the bytes.
+
+    quality overrides the lossy WebP/AVIF quality per format, e.g.
+    {'webp': 75}. Formats with transparency keep the alpha channel.
+    """
+    settings = ENCODING_PROFILES[profile]
+    quality = dict(DEFAULT_QUALITY, **(quality or {}))
+    buffer = BytesIO()
+    if output_format == 'jpg':
+        if img.mode in ('RGBA', 'LA', 'P'):
+            # Create white background for transparency
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            if img.mode == 'P':
+                img = img.convert('RGBA')
+            background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
+            img = background
+        else:
+            img = img.convert('RGB')
+        img.save(buffer, 'JPEG', **settings['jpg'])
+    elif output_format == 'png':
+        img.save(buffer, 'PNG', **settings['png'])
+    elif output_format == 'gif' and isinstance(img, Animation):
+        img.save(buffer, **settings['gif'])
+    elif output_format == 'gif':
+        img = quantize_for_gif(img, settings['gif_quantize'])
+        img.save(buffer, 'GIF', **settings['gif'])
+    elif output_format == 'webp':
+        keep_alpha(img).save(buffer, 'WEBP', quality=quality['webp'], **settings['webp'])
+    elif output_format == 'webp-lossless':
+        keep_alpha(img).save(buffer, 'WEBP', lossless=True, **settings['webp-lossless'])
+    elif output_format == 'avif':
+        keep_alpha(img).save(buffer, 'AVIF', quality=quality['avif'], **settings['avif'])
+    else:
+        raise ValueError(f"Unsupported output format: {output_format}")
+    return buffer.getvalue()
+
+def source_size_bytes(source):
+    """Encoded size of an image given as bytes or a file path."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return len(source)
+    return os.path.getsize(source)
+
+def render_image(source, options, timings=None):
+    """Decode, watermark and resize one image, ready for encoding.
+
+    Stage durations are added to the timings dict, if given.
+    """
+    with metrics.timed('decode', timings):
+        img = open_source(source)
+        source_size = img.size
+
+        # Decode JPEGs at a reduced scale when the output is downscaled anyway
+        if options.get('reduce_size'):
+            draft_for_resize(img, options['reduce_pct'], options.get('draft_margin', 0))
+        img.load()
+    metrics.observe('watermark_input_megapixels', source_size[0] * source_size[1] / 1e6)
+    metrics.observe('watermark_input_bytes', source_size_bytes(source))
+
+    if options['output_format'] == 'gif' and getattr(img, 'is_animated', False):
+        return render_animation(img, options, timings)
+
+    # Fill % is relative to the image width, so resizing first and then
+    # compositing a watermark prepared for the final size looks the same
+    # while the RGBA conversion and paste touch far fewer pixels.
+    resize_first = options.get('reduce_size') and options.get('resize_first')
+    if resize_first:
+        with metrics.timed('resize', timings):
+            img = resize_image(img, options['reduce_pct'], source_size)
+
+    # Apply watermark if requested
+    if options.get('watermark') is not None:
+        with metrics.timed('watermark', timings):
+            watermark = open_source(options['watermark'])
+            img = apply_watermark(
+                img, watermark, options['fill_pct'], options['opacity_pct'],
+                digest=options.get('watermark_digest'),
+                position=options.get('position', 'center'),
+                pattern=options.get('pattern', 'single'),
+                engine=options.get('composite_engine', 'pillow')
+            )
+
+    # Resize if requested
+    if options.get('reduce_size') and not resize_first:
+        with metrics.timed('resize', timings):
+            img = resize_image(img, options['reduce_pct'], source_size)
+    return img
+
+def render_animation(img, options, timings=None):
+    """Watermark and resize every frame of an animated GIF.
+
+    Frames are decoded one at a time, so at most two full-colour frames
+    are held. A first, decode-only pass collects the colours of all
+    frames; the watermark is composited once over a swatch of them and
+    every rendered frame is mapped onto one palette built from the
+    colours and that region, instead of being quantized from scratch.
+    A frame identical to the one before it is not rendered at all; it
+    only extends that frame's duration. Durations, disposal methods and
+    the loop count are kept.
+    """
+    watermark = None
+    if options.get('watermark') is not None:
+        watermark = open_source(options['watermark'])
+    method = ENCODING_PROFILES[options.get('encoding_profile', 'balanced')]['gif_quantize']
+    transparent = 'transparency' in img.info or img.mode in ('RGBA', 'LA', 'PA')
+    source_size = img.size
+
+    def watermarked(frame):
+        with metrics.timed('watermark', timings):
+            return apply_watermark(
+                frame, watermark, options['fill_pct'], options['opacity_pct'],
+                digest=options.get('watermark_digest'),
+                position=options.get('position', 'center'),
+                pattern=options.get('pattern', 'single'),
+                engine=options.get('composite_engine', 'pillow')
+            )
+
+    with metrics.timed('decode', timings):
+        colors = set()
+        for frame in ImageSequence.Iterator(img):
+            # None once past 65536 colours, which no real GIF reaches
+            colors.update(color for _, color in frame.convert('RGB').getcolors(65536) or ())
+        colors = sorted(colors) or [(0, 0, 0)]
+
+    frames = []
+    durations = []
+    disposals = []
+    palette = None
+    previous = None
+    for frame in ImageSequence.Iterator(img):
+        with metrics.timed('decode', timings):
+            current = frame.convert('RGBA')
+        duration = frame.info.get('duration', 0)
+        if previous is not None and not difference_bbox(current, previous):
+            durations[-1] += duration
+            continue
+        previous = current
+
+        # Resizing first is cheaper and looks the same; fill % is relative to the width
+        if options.get('reduce_size'):
+            with metrics.timed('resize', timings):
+                current = resize_image(current, options['reduce_pct'], source_size)
+        if palette is None:
+            region = None
+            if watermark is not None:
+                swatch = color_swatch(colors, current.size).convert('RGBA')
+                marked = watermarked(swatch)
+                bbox = difference_bbox(swatch, marked)
+                region = marked.crop(bbox) if bbox else None
+            with metrics.timed('encode', timings):
+                palette = gif_palette(colors, region, method, transparent)
+        if watermark is not None:
+            current = watermarked(current)
+        with metrics.timed('encode', timings):
+            frames.append(map_to_palette(current, palette, transparent))
+        durations.append(duration)
+        disposals.append(getattr(frame, 'disposal_method', 0))
+    return Animation(
+        frames, durations, disposals, loop=img.info.get('loop'),
+        transparency=transparent_index(palette) if transparent else None
+    )
+
+def encode_output(img, filename, options, timings=None):
+    """Encode a rendered image; returns (output name, bytes)."""
+    output_format = options['output_format']
+    with metrics.timed('encode', timings):
+        encoded = encode_image(
+            img, output_format, options.get('encoding_profile', 'balanced'), options.get('quality')
+        )
+    return output_filename(filename, output_format), encoded
+
+def process_image(source, filename, options, timings=None):
+    """Watermark, resize and encode one image; returns (output name, bytes).
+
+    Runs in the job thread or in a worker process, so it only takes
+    picklable arguments. The watermark travels in options as a source.
+    """
+    try:
+        return encode_output(render_image(source, options, timings), filename, options, timings)
+    finally:
+        # Pool workers may sit idle for long, so they write out every image
+        metrics.flush(force=multiprocessing.parent_process() is not None)
+
+def process_image_timed(source, filename, options):
+    """process_image for pool workers; returns (result, stage timings).
+
+    Profiled into options['profile_dir'] when the job is being profiled.
+    """
+    timings = {}
+    with profiled(options.get('profile_dir')):
+        result = process_image(source, filename, options, timings)
+    return result, timings
+
+class ProcessingEngine:
+    """Runs the per-image pipeline inline or fanned out over worker processes."""
+
+    BACKENDS = ('thread', 'process')
+
+    def __init__(self, backend='thread', workers=None):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown processing backend: {backend}")
+        self.backend = backend
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = None
+
+    @property
+    def pool(self):
+        """Process pool shared by all jobs, created on first use."""
+        if self._pool is None:
+            # Spawn rather than fork: the web process is multi-threaded
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=configure_metrics,
+                initargs=(metrics.folder,)
+            )
+        return self._pool
+
+    def run(self, image_files, options, cache=None):
+        """Process a batch, yielding (file_data, result, error) as images finish.
+
+        With a ResultCache, previously produced outputs are returned without
+        running the pipeline (file_data['cached'] is set) and new outputs
+        are stored for next time. Seconds spent in each stage are left in
+        file_data['timings'].
+        """
+        pending = image_files
+        if cache is not None:
+            pending = []
+            for file_data in image_files:
+                file_data['cache_key'] = result_key(source_digest(file_data), options)
+                data = cache.get(file_data['cache_key'])
+                if data is None:
+                    pending.append(file_data)
+                    continue
+                file_data['cached'] = True
+                filename = output_filename(file_data['filename'], options['output_format'])
+                yield file_data, (filename, data), None
+
+        for file_data, result, error in self._run(pending, options):
+            if cache is not None and error is None:
+                try:
+                    cache.put(file_data['cache_key'], result[1])
+                except OSError as e:
+                    logger.warning(f"Could not cache result for {file_data['filename']}: {e}")
+            yield file_data, result, error
+
+    def process(self, file_data, options, cache=None):
+        """Process a single image; returns (output name, bytes) or raises."""
+        for _, result, error in self.run([file_data], options, cache=cache):
+            if error is not None:
+                raise error
+            return result
+
+    def _run(self, image_files, options):
+        if self.backend == 'process':
+            yield from self._run_process(image_files, options)
+            return
+
+        if len(image_files) == 1:
+            # Web jobs always come through here, one image per work unit:
+            # their decodes and encodes overlap across the scheduler's
+            # workers instead, so no encoder thread is started
+            file_data = image_files[0]
+            timings = file_data['timings'] = {}
+            try:
+                yield file_data, process_image(file_source(file_data), file_data['filename'], options, timings), None
+            except Exception as e:
+                yield file_data, None, e
+            return
+
+        # Batches (the CLI) overlap encoding one image with decoding the
+        # next: both release the GIL inside Pillow. One encode in flight
+        # bounds memory to two decoded images per batch.
+        encoder = ThreadPoolExecutor(max_workers=1, thread_name_prefix='encoder')
+        pending = deque()
+        try:
+            for file_data in image_files:
+                timings = file_data['timings'] = {}
+                try:
+                    img = render_image(file_source(file_data), options, timings)
+                except Exception as e:
+                    yield file_data, None, e
+                    continue
+                pending.append((file_data, encoder.submit(
+                    encode_output, img, file_data['filename'], options, timings
+                )))
+                while len(pending) > 1 or (pending and pending[0][1].done()):
+                    yield self._encoded(*pending.popleft())
+            while pending:
+                yield self._encoded(*pending.popleft())
+        finally:
+            encoder.shutdown(wait=True)
+
+    @staticmethod
+    def _encoded(file_data, future):
+        try:
+            return file_data, future.result(), None
+        except Exception as e:
+            return file_data, None, e
+
+    def _run_process(self, image_files, options):
+        # Workers get file paths: spooled uploads are passed as they are and
+        # in-memory ones are staged, so image bytes never go through the
+        # pool pipe as pickled copies.
+        staging_dir = tempfile.mkdtemp(prefix='watermark-')
+        try:
+            options = dict(options)
+            if options.get('watermark') is not None:
+                options['watermark'] = self._stage(staging_dir, 'watermark', options['watermark'])
+
+            futures = {}
+            for index, file_data in enumerate(image_files):
+                path = self._stage(staging_dir, str(index), file_source(file_data))
+                future = self.pool.submit(process_image_timed, path, file_data['filename'], options)
+                futures[future] = file_data
+
+            for future in as_completed(futures):
+                file_data = futures[future]
+                try:
+                    result, file_data['timings'] = future.result()
+                    yield file_data, result, None
+                except Exception as e:
+                    yield file_data, None, e
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    @staticmethod
+    def _stage(staging_dir, name, content):
+        if isinstance(content, str):
+            return content
+        path = os.path.join(staging_dir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def shutdown(self):
+        """Stop the worker processes, if any were started."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
@@ -0,0 +1,61 @@
+"""On-demand cProfile of single jobs.
+
+A job is profiled one image at a time: every work unit, and every pool
+worker call when the process backend is used, dumps its own stats file
+into the job's profile folder, and the files are merged into one .prof
+once the job finishes. Jobs without a profile folder skip all of it.
+
+Only one profiler runs per process: from Python 3.12 a profiler hooks
+every thread through sys.monitoring and a second one cannot be enabled
+while the first is active. The scheduler runs a profiled job's units one
+at a time; a block that finds the profiler busy anyway (another profiled
+job) runs unprofiled. Work of other jobs running meanwhile may still
+show up in the stats on 3.12.
+"""
+import cProfile
+import glob
+import hmac
+import os
+import pstats
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# Held while a profiler is enabled in this process
+_profile_lock = threading.Lock()
+
+@contextmanager
+def profiled(profile_dir):
+    """Profile the block into a new .prof file in profile_dir, if given.
+
+    Never waits: if another block is being profiled, this one is not.
+    """
+    if profile_dir is None or not _profile_lock.acquire(blocking=False):
+        yield
+        return
+    try:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            fd, path = tempfile.mkstemp(dir=profile_dir, suffix='.prof')
+            os.close(fd)
+            profiler.dump_stats(path)
+    finally:
+        _profile_lock.release()
+
+def merge_profiles(profile_dir, path):
+    """Combine the stats files in profile_dir into path; False if there are none."""
+    files = sorted(glob.glob(os.path.join(profile_dir, '*.prof')))
+    if not files:
+        return False
+    pstats.Stats(*files).dump_stats(path)
+    return True
+
+def token_matches(expected, given):
+    """Constant-time check of a profiling token; never matches when unset."""
+    if not expected or not given:
+        return False
+    return hmac.compare_digest(expected.encode(), given.encode())
@@ -0,0 +1,124 @@
+"""Content-addressed on-disk cache of encoded pipeline outputs."""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Options that change the encoded bytes and therefore belong in the key
+KEY_OPTIONS = (
+    'watermark_digest', 'fill_pct', 'opacity_pct', 'position', 'pattern',
+    'reduce_pct', 'output_format', 'encoding_profile', 'quality', 'resize_first',
+    'draft_margin'
+)
+
+def result_key(source_digest, options):
+    """Key an output by the source bytes and every setting that shapes it."""
+    settings = {name: options.get(name) for name in KEY_OPTIONS}
+    if options.get('watermark') is None:
+        settings.update(
+            watermark_digest=None, fill_pct=None, opacity_pct=None, position=None, pattern=None
+        )
+    if not options.get('reduce_size'):
+        settings.update(reduce_pct=None, resize_first=None, draft_margin=None)
+    payload = json.dumps([source_digest, settings], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class ResultCache:
+    """Encoded outputs stored as <folder>/<key[:2]>/<key>, capped by size.
+
+    Hits refresh the file's mtime, so pruning oldest-mtime-first is LRU.
+    Several processes may share one folder; writes are atomic renames.
+    """
+
+    def __init__(self, folder, max_bytes=1024 * 1024 * 1024):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._written = 0
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.folder, key[:2], key)
+
+    def get(self, key):
+        """Return the cached bytes for key, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """Store an encoded output and prune if the cap may be exceeded."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        # Only rescan once enough has been written to possibly hit the cap
+        with self._lock:
+            self._written += len(data)
+            should_prune = self._written > self.max_bytes // 10
+            if should_prune:
+                self._written = 0
+        if should_prune:
+            self.prune()
+
+    def prune(self):
+        """Evict least recently used entries until the cache fits max_bytes."""
+        entries = []
+        total = 0
+        for shard in os.scandir(self.folder):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        if removed:
+            logger.info(f"Result cache pruned {removed} entries, {total} bytes remain")
+        return removed
+
+    def stats(self):
+        """Return hit/miss counts and the hit ratio for this process."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else None
+            }
@@ -1,25 +1,311 @@
 """Application routes and views."""
-from flask import render_template, request, jsonify, session, redirect, url_for, send_from_directory, current_app
+from flask import render_template, request, jsonify, session, redirect, url_for, send_from_directory, current_app, Response
+from werkzeug.utils import safe_join
 from uuid import uuid4
-from datetime import datetime
-from PIL import Image
-from io import BytesIO
 import os
+import json
+import time
+import shutil
 import logging
+from werkzeug.datastructures import FileStorage
 from .utils import (
+    allowed_file,
     validate_file,
-    apply_watermark,
-    resize_image,
-    create_zip
+    upload_size,
+    spool_upload,
+    watermark_cache,
+    file_digest,
+    POSITIONS,
+    PATTERNS
 )
+from .archive import IncrementalZip, OutputDirectory, stream_zip, directory_members
+from .pipeline import ENCODING_PROFILES, available_output_formats
+from .scheduler import QueueFull
+from .uploads import ChunkedUpload, OffsetMismatch
+from .metrics import registry as metrics
+from .profiling import profiled, merge_profiles, token_matches
 
 logger = logging.getLogger(__name__)
 
-# Global progress tracker - shared across all requests
-progress_tracker = {}
+# Progress fields whose change triggers a Server-Sent Event
+STREAMED_FIELDS = ('queue_position', 'done', 'failed', 'current_file', 'zip', 'error', 'finished')
+
+# Stages reported in a job's timing breakdown, in pipeline order
+TIMED_STAGES = ('decode', 'resize', 'watermark', 'encode', 'zip')
+
+def image_timing(index, file_data, started, finished, output_size):
+    """Build the timing record kept beside the job for one image."""
+    timings = file_data.get('timings') or {}
+    return {
+        'index': index,
+        'file': file_data['filename'],
+        'started': started,
+        'seconds': round(finished - started, 6),
+        'stages': {stage: round(timings[stage], 6) for stage in TIMED_STAGES if stage in timings},
+        'input_bytes': file_data.get('size'),
+        'output_bytes': output_size,
+        'cached': bool(file_data.get('cached')),
+        'failed': output_size is None
+    }
+
+def timing_summary(progress):
+    """Total seconds per stage plus throughput and ETA from finished images.
+
+    Reads only the job's running totals, so it costs the same whatever
+    the number of images.
+    """
+    images_per_second = None
+    eta_seconds = None
+    first_start = progress.get('first_started')
+    if progress['done'] and first_start is not None:
+        # Measured from the first image that left the queue, so waiting
+        # behind other clients does not count against throughput
+        end = progress.get('last_finished') if progress.get('finished') else time.time()
+        if end and end > first_start:
+            images_per_second = progress['done'] / (end - first_start)
+            remaining = progress['total'] - progress['done']
+            eta_seconds = remaining / images_per_second
+    if progress.get('finished'):
+        eta_seconds = 0
+
+    return {
+        'stage_seconds': {stage: round(progress.get(f'seconds_{stage}', 0.0), 4) for stage in TIMED_STAGES},
+        'images_per_second': round(images_per_second, 3) if images_per_second else None,
+        'eta_seconds': round(eta_seconds, 1) if eta_seconds is not None else None
+    }
+
+def progress_payload(progress, records=None):
+    """Build the public progress document for a job.
+
+    Given the job's timing records, they are included in upload order.
+    """
+    # Calculate elapsed time
+    elapsed_time = None
+    if progress.get('start_time'):
+        elapsed_time = time.time() - progress['start_time']
+    
+    payload = {
+        "total": progress['total'],
+        "queue_position": progress.get('queue_position'),
+        "done": progress['done'],
+        "failed": progress.get('failed', 0),
+        "cached": progress.get('cached', 0),
+        "zip": progress.get('zip'),
+        "current_file": progress.get('current_file'),
+        "elapsed_time": elapsed_time,
+        "error": progress.get('error'),
+        "finished": progress.get('finished', False)
+    }
+    payload.update(timing_summary(progress))
+    if records is not None:
+        payload['images'] = sorted(records, key=lambda record: record['index'])
+    return payload
 
 def register_routes(app, limiter):
     """Register all application routes."""
+
+    # Chunked uploads in progress in this process: session_id -> (upload, process_image_unit, client)
+    uploads = {}
+
+    def open_job_output(session_id):
+        """Open the result sink for a job according to ZIP_DELIVERY."""
+        if app.config['ZIP_DELIVERY'] == 'stream':
+            return OutputDirectory(os.path.join(app.config['UPLOAD_FOLDER'], session_id))
+        return IncrementalZip(os.path.join(app.config['ZIP_FOLDER'], f"{session_id}.zip"))
+
+    def client_key():
+        """Identify the client whose jobs share one fair-share queue."""
+        if app.config['SCHEDULER_CLIENT_KEY'] == 'session':
+            if 'client_id' not in session:
+                session['client_id'] = str(uuid4())
+            return session['client_id']
+        return request.remote_addr
+
+    def profile_path(session_id):
+        """Where a profiled job's merged stats are saved, beside its zip."""
+        return os.path.join(app.config['ZIP_FOLDER'], f"{session_id}.prof")
+
+    def uploaded_watermark():
+        """The request's watermark file, or None; raises ValueError if too large."""
+        watermark_file = request.files.get('watermark')
+        if watermark_file is None or not watermark_file.filename:
+            return None
+        # Only check file size for watermark, accept any file type
+        if upload_size(watermark_file) > app.config['MAX_FILE_SIZE']:
+            raise ValueError(f"Watermark file too large. Maximum size: {app.config['MAX_FILE_SIZE']/1024/1024}MB")
+        return watermark_file
+
+    def job_options(form, watermark_path):
+        """Pipeline options from the upload form's fields."""
+        fill_pct = float(form.get('fill_pct', 30))
+        opacity_pct = float(form.get('opacity_pct', 50))
+        position = form.get('position', 'center')
+        pattern = form.get('pattern', 'single')
+        reduce_size_flag = 'reduce_size' in form
+        reduce_pct = float(form.get('reduce_pct', 60))
+        output_format = form.get('format', 'jpg').lower()
+        encoding_profile = form.get('profile', app.config['ENCODING_PROFILE'])
+        
+        if output_format not in available_output_formats(app.config['OUTPUT_FORMATS']):
+            output_format = 'jpg'
+        if position not in POSITIONS:
+            position = 'center'
+        if pattern not in PATTERNS:
+            pattern = 'single'
+        if encoding_profile not in ENCODING_PROFILES:
+            encoding_profile = app.config['ENCODING_PROFILE']
+        
+        options = {
+            'watermark': None,
+            'watermark_digest': None,
+            'fill_pct': fill_pct,
+            'opacity_pct': opacity_pct,
+            'position': position,
+            'pattern': pattern,
+            'reduce_size': reduce_size_flag,
+            'reduce_pct': reduce_pct,
+            'draft_margin': app.config['JPEG_DRAFT_MARGIN'],
+            'resize_first': app.config['RESIZE_BEFORE_WATERMARK'],
+            'composite_engine': app.config['COMPOSITE_ENGINE'],
+            'output_format': output_format,
+            'encoding_profile': encoding_profile,
+            'quality': {
+                'webp': app.config['WEBP_QUALITY'],
+                'avif': app.config['AVIF_QUALITY']
+            }
+        }
+        if 'apply_watermark' in form and watermark_path:
+            options['watermark'] = watermark_path
+            options['watermark_digest'] = file_digest(watermark_path)
+        return options
+
+    def start_job(session_id, total, options, spool_dir, on_finished=None):
+        """Create a job's progress record and output for total images.
+
+        Returns (process_image_unit, abort_job). process_image_unit(index,
+        file_data) handles one image, and the call that completes the
+        batch finalizes the download; file_data with an 'error' is counted
+        as failed without processing. abort_job undoes a job that could
+        not be queued.
+        """
+        # Admins may profile one job; cached results would hide the pipeline
+        profile_dir = None
+        result_cache = app.result_cache
+        if token_matches(app.config['PROFILE_TOKEN'], request.headers.get('X-Profile-Token')):
+            profile_dir = os.path.join(spool_dir, 'profile')
+            os.makedirs(profile_dir)
+            options['profile_dir'] = profile_dir
+            result_cache = None
+            # One profiler per process, so the job's images go one at a time
+            app.scheduler.limit(session_id, 1)
+            logger.info(f"Profiling job {session_id}")
+        
+        # Initialize progress tracker
+        start_time = time.time()
+        app.jobs.create(
+            session_id,
+            total=total,
+            done=0,
+            zip=None,
+            current_file=None,
+            start_time=start_time,
+            queue_position=None,
+            failed=0,
+            cached=0,
+            started=0,
+            first_started=None,
+            last_finished=None,
+            finished=False
+        )
+        
+        # Results go straight to their destination as they are encoded
+        output = open_job_output(session_id)
+        # Whatever a job that never finishes leaves behind is reaped too;
+        # with size=0 the disk quota never evicts them while in use
+        for path in (spool_dir, output.part_path):
+            app.expiry.add(path, app.config['JOB_TTL'], size=0)
+        
+        # Each image is its own work unit so other jobs can interleave;
+        # the unit that completes the batch finalizes the download
+        def process_image_unit(index, file_data):
+            """Process one image of the batch and record the outcome"""
+            started = time.time()
+            counts = app.jobs.accumulate(session_id, {'started': 1}, current_file=file_data['filename'])
+            if counts is not None and counts['started'] == 1:
+                app.jobs.update(session_id, first_started=started)
+            output_size = None
+            try:
+                if file_data.get('error'):
+                    raise ValueError(file_data['error'])
+                with profiled(profile_dir):
+                    filename, data = app.engine.process(file_data, options, cache=result_cache)
+                    output_size = len(data)
+                    with metrics.timed('zip', file_data.setdefault('timings', {})):
+                        output.add(filename, data)
+                if file_data.get('cached'):
+                    app.jobs.increment(session_id, 'cached')
+                metrics.inc('watermark_images_total', outcome='cached' if file_data.get('cached') else 'processed')
+                logger.info(f"Successfully processed: {file_data['filename']}")
+            except Exception as e:
+                logger.error(f"Error processing {file_data['filename']}: {str(e)}")
+                app.jobs.increment(session_id, 'failed')
+                metrics.inc('watermark_images_total', outcome='failed')
+            finally:
+                finished = time.time()
+                record = image_timing(index, file_data, started, finished, output_size)
+                app.jobs.add_record(session_id, record)
+                # Stage totals are counters too, so progress never reads the records
+                amounts = {f'seconds_{stage}': seconds for stage, seconds in record['stages'].items()}
+                amounts['done'] = 1
+                counts = app.jobs.accumulate(session_id, amounts, last_finished=finished)
+                # The atomic counter picks exactly one unit to finalize
+                if counts is not None and counts['done'] == total:
+                    finalize_job()
+        
+        def finalize_job():
+            """Publish the download once every image has been handled"""
+            try:
+                if output.count:
+                    location = output.close()
+                    app.expiry.add(location, app.config['OUTPUT_TTL'])
+                    app.jobs.update(session_id, zip=f"/download/{session_id}")
+                    logger.info(f"Download ready: {location}")
+                else:
+                    output.abort()
+                    logger.error("No files were successfully processed")
+                
+                if options['watermark'] is not None and app.engine.backend == 'thread':
+                    logger.info(f"Watermark cache stats: {watermark_cache.stats()}")
+                if app.result_cache is not None:
+                    logger.info(f"Result cache stats: {app.result_cache.stats()}")
+                if profile_dir is not None and merge_profiles(profile_dir, profile_path(session_id)):
+                    app.expiry.add(profile_path(session_id), app.config['OUTPUT_TTL'])
+                    logger.info(f"Profile saved: {profile_path(session_id)}")
+                # Make room right away rather than at the next reaper run
+                if app.expiry.max_bytes:
+                    app.expiry.reap()
+            except Exception as e:
+                logger.error(f"Error finalizing job {session_id}: {str(e)}")
+                app.jobs.update(session_id, error=str(e))
+                output.abort()
+            finally:
+                if profile_dir is not None:
+                    app.scheduler.limit(session_id, None)
+                if on_finished is not None:
+                    on_finished()
+                app.jobs.update(session_id, finished=True)
+                shutil.rmtree(spool_dir, ignore_errors=True)
+                metrics.observe('watermark_job_seconds', time.time() - start_time)
+                metrics.flush()
+
+        def abort_job():
+            """Drop a job that was never queued"""
+            app.scheduler.limit(session_id, None)
+            output.abort()
+            app.jobs.delete(session_id)
+            shutil.rmtree(spool_dir, ignore_errors=True)
+
+        return process_image_unit, abort_job
     
     @app.route('/language/<lang>', methods=['GET', 'POST'])
     def set_language(lang):
@@ -41,7 +327,11 @@ def register_routes(app, limiter):
         translations = app.config['TRANSLATIONS'][session['language']]
         
         if request.method == 'GET':
-            return render_template('index.html', translations=translations)
+            return render_template(
+                'index.html',
+                translations=translations,
+                output_formats=available_output_formats(app.config['OUTPUT_FORMATS'])
+            )
         
         if request.method == 'POST':
             try:
@@ -63,136 +353,41 @@ def register_routes(app, limiter):
                 # Generate a session ID for this batch
                 session_id = str(uuid4())
                 
-                # Store files in memory for background processing
+                # Check the watermark before spooling anything
+                try:
+                    watermark_file = uploaded_watermark()
+                except Exception as e:
+                    return jsonify({"error": f"Watermark error: {str(e)}"}), 400
+                
+                # Spool uploads to disk; workers open them lazily from there
+                spool_dir = os.path.join(app.config['SPOOL_FOLDER'], session_id)
                 image_files = []
-                for file in files:
-                    content = file.read()
-                    file.seek(0)
+                for index, file in enumerate(files):
                     image_files.append({
                         'filename': file.filename,
-                        'content': content
+                        'size': upload_size(file),
+                        'path': spool_upload(file, spool_dir, f"{index:05d}")
                     })
                 
-                # Process watermark if provided - ACCEPT ANY FILE TYPE
-                watermark_bytes = None
-                if 'watermark' in request.files and request.files['watermark'].filename:
-                    try:
-                        watermark_file = request.files['watermark']
-                        # Only check file size for watermark, accept any file type
-                        content = watermark_file.read()
-                        if len(content) > app.config['MAX_FILE_SIZE']:
-                            raise ValueError(f"Watermark file too large. Maximum size: {app.config['MAX_FILE_SIZE']/1024/1024}MB")
-                        watermark_bytes = content
-                    except Exception as e:
-                        return jsonify({"error": f"Watermark error: {str(e)}"}), 400
-                
-                # Get form parameters
-                apply_watermark_flag = 'apply_watermark' in request.form
-                fill_pct = float(request.form.get('fill_pct', 30))
-                opacity_pct = float(request.form.get('opacity_pct', 50))
-                reduce_size_flag = 'reduce_size' in request.form
-                reduce_pct = float(request.form.get('reduce_pct', 60))
-                output_format = request.form.get('format', 'jpg').lower()
-                
-                if output_format not in app.config['ALLOWED_EXTENSIONS']:
-                    output_format = 'jpg'
+                watermark_path = None
+                if watermark_file is not None:
+                    watermark_path = spool_upload(watermark_file, spool_dir, 'watermark')
                 
-                # Initialize progress tracker
-                progress_tracker[session_id] = {
-                    'total': len(image_files),
-                    'done': 0,
-                    'zip': None,
-                    'current_file': None,
-                    'start_time': datetime.now(),
-                    'failed': 0
-                }
+                options = job_options(request.form, watermark_path)
+                process_image_unit, abort_job = start_job(session_id, len(image_files), options, spool_dir)
                 
-                # Define background processing function
-                def process_images_background():
-                    """Background task to process images"""
-                    try:
-                        # Create session output directory
-                        output_dir = os.path.join(app.root_path, 'static', 'output', session_id)
-                        zip_dir = os.path.join(app.root_path, 'static', 'zips')
-                        os.makedirs(output_dir, exist_ok=True)
-                        os.makedirs(zip_dir, exist_ok=True)
-                        
-                        output_files = []
-                        
-                        # Load watermark once if needed
-                        watermark = None
-                        if apply_watermark_flag and watermark_bytes:
-                            watermark = Image.open(BytesIO(watermark_bytes))
-                        
-                        # Process each image
-                        for file_data in image_files:
-                            try:
-                                # Update current file being processed
-                                progress_tracker[session_id]['current_file'] = file_data['filename']
-                                
-                                # Open image
-                                img = Image.open(BytesIO(file_data['content']))
-                                
-                                # Apply watermark if requested
-                                if watermark:
-                                    img = apply_watermark(img, watermark, fill_pct, opacity_pct)
-                                
-                                # Resize if requested
-                                if reduce_size_flag:
-                                    img = resize_image(img, reduce_pct)
-                                
-                                # Generate output filename
-                                base_name = os.path.splitext(file_data['filename'])[0]
-                                safe_name = "".join(c for c in base_name if c.isalnum() or c in (' ', '-', '_')).strip()
-                                safe_name = safe_name.replace(' ', '_')
-                                filename = f"{safe_name}_{str(uuid4())[:8]}.{output_format}"
-                                filepath = os.path.join(output_dir, filename)
-                                
-                                # Save image
-                                if output_format == 'jpg':
-                                    if img.mode in ('RGBA', 'LA', 'P'):
-                                        # Create white background for transparency
-                                        background = Image.new('RGB', img.size, (255, 255, 255))
-                                        if img.mode == 'P':
-                                            img = img.convert('RGBA')
-                                        background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                                        img = background
-                                    else:
-                                        img = img.convert('RGB')
-                                    img.save(filepath, 'JPEG', quality=85, optimize=True)
-                                elif output_format == 'png':
-                                    img.save(filepath, 'PNG', optimize=True)
-                                elif output_format == 'gif':
-                                    # Convert to palette mode for GIF
-                                    if img.mode != 'P':
-                                        img = img.convert('P', palette=Image.ADAPTIVE)
-                                    img.save(filepath, 'GIF', optimize=True)
-                                
-                                output_files.append(filepath)
-                                logger.info(f"Successfully processed: {file_data['filename']}")
-                                
-                            except Exception as e:
-                                logger.error(f"Error processing {file_data['filename']}: {str(e)}")
-                                progress_tracker[session_id]['failed'] += 1
-                            finally:
-                                # Update progress
-                                progress_tracker[session_id]['done'] += 1
-                        
-                        # Create zip file
-                        if output_files:
-                            zip_path = os.path.join(zip_dir, f"{session_id}.zip")
-                            create_zip(output_files, zip_path)
-                            progress_tracker[session_id]['zip'] = f"/download/{session_id}"
-                            logger.info(f"Zip file created: {zip_path}")
-                        else:
-                            logger.error("No files were successfully processed")
-                            
-                    except Exception as e:
-                        logger.error(f"Error in background processing: {str(e)}")
-                        progress_tracker[session_id]['error'] = str(e)
-                
-                # Submit background task
-                app.executor.submit(process_images_background)
+                # Queue the units behind other clients' work
+                try:
+                    app.scheduler.submit_all(client_key(), session_id, [
+                        (lambda index=index, file_data=file_data: process_image_unit(index, file_data), 1, file_data['size'])
+                        for index, file_data in enumerate(image_files)
+                    ])
+                except QueueFull as e:
+                    logger.warning(f"Rejected job {session_id}: {e}")
+                    abort_job()
+                    response = jsonify({"error": translations['error_queue_full']})
+                    response.headers['Retry-After'] = str(e.retry_after)
+                    return response, 503
                 
                 # Return progress page immediately
                 return render_template(
@@ -206,40 +401,302 @@ def register_routes(app, limiter):
                 logger.error(f"Error in index route: {str(e)}")
                 return jsonify({"error": translations.get("unexpected_error", "An error occurred")}), 500
 
+    def parse_declared_files(text):
+        """Validate the JSON list of {name, size} a chunked upload declares."""
+        try:
+            files = json.loads(text or '[]')
+            files = [{'name': str(file['name']), 'size': int(file['size'])} for file in files]
+        except (ValueError, TypeError, KeyError):
+            raise ValueError("files must be a JSON list of {\"name\": ..., \"size\": ...}")
+        if not files:
+            raise ValueError("No files declared")
+        if len(files) > app.config['MAX_FILES_PER_UPLOAD']:
+            raise ValueError(f"Too many files. Maximum: {app.config['MAX_FILES_PER_UPLOAD']}")
+        for file in files:
+            if not allowed_file(file['name'], app.config['ALLOWED_EXTENSIONS']):
+                raise ValueError(f"File type not allowed: {file['name']}")
+            if not 0 < file['size'] <= app.config['MAX_FILE_SIZE']:
+                raise ValueError(f"Invalid size for {file['name']}. Maximum size: {app.config['MAX_FILE_SIZE']/1024/1024}MB")
+        return files
+
+    def find_upload(session_id):
+        """Return (upload, process_image_unit, client) of a live chunked upload, or None."""
+        entry = uploads.get(session_id)
+        if entry is not None and app.jobs.get(session_id) is None:
+            # Expired; the reaper removes its spooled chunks
+            uploads.pop(session_id, None)
+            return None
+        return entry
+
+    def queue_failed_files(client, session_id, process_image_unit, failed):
+        """Queue units recording (index, file_data, error) files as failed.
+
+        They go through the scheduler like any unit, so the one that
+        completes the job finalizes it on a worker, not in the caller.
+        """
+        tasks = []
+        for index, file_data, error in failed:
+            file_data['error'] = error
+            tasks.append((lambda index=index, file_data=file_data: process_image_unit(index, file_data), 0, 0))
+        if tasks:
+            app.scheduler.submit_all(client, session_id, tasks)
+
+    def queue_upload_file(client, session_id, upload, process_image_unit, index):
+        """Validate a fully received file and queue it, at most once.
+
+        Returns the error of a file that fails validation, which counts as
+        failed, or None. Raises QueueFull and leaves the file to be queued
+        by a later request.
+        """
+        file_data = upload.claim(index)
+        if file_data is None:
+            return None
+        try:
+            with open(file_data['path'], 'rb') as f:
+                validate_file(
+                    FileStorage(f, filename=file_data['filename']),
+                    app.config['ALLOWED_EXTENSIONS'],
+                    app.config['MAX_FILE_SIZE']
+                )
+        except ValueError as e:
+            queue_failed_files(client, session_id, process_image_unit, [(index, file_data, str(e))])
+            return str(e)
+        try:
+            app.scheduler.submit(
+                client, session_id,
+                lambda: process_image_unit(index, file_data),
+                size=file_data['size']
+            )
+        except QueueFull:
+            upload.release(index)
+            raise
+        return None
+
+    def finish_upload(session_id, upload, process_image_unit, client):
+        """Queue the complete files, then fail the incomplete ones.
+
+        Raises QueueFull, leaving the upload open, while complete files
+        find no room in the queue.
+        """
+        # Complete files still waiting for room in the queue go first
+        for index in range(len(upload.files)):
+            queue_upload_file(client, session_id, upload, process_image_unit, index)
+        abandoned = upload.commit()
+        queue_failed_files(client, session_id, process_image_unit, [
+            (index, file_data, "Upload incomplete") for index, file_data in abandoned
+        ])
+
+    def commit_idle_uploads():
+        """Commit uploads that have gone UPLOAD_IDLE_TIMEOUT without a chunk.
+
+        Otherwise a client that never commits keeps its job unfinished
+        until JOB_TTL. Run periodically by the background scheduler.
+        """
+        cutoff = time.monotonic() - app.config['UPLOAD_IDLE_TIMEOUT']
+        for session_id, entry in list(uploads.items()):
+            upload = entry[0]
+            if upload.committed or upload.last_active > cutoff:
+                continue
+            if find_upload(session_id) is None:
+                continue
+            try:
+                finish_upload(session_id, *entry)
+                logger.info(f"Committed idle upload {session_id}")
+            except QueueFull:
+                # Tried again on the next run
+                logger.warning(f"Idle upload {session_id} is waiting for room in the queue")
+
+    app.commit_idle_uploads = commit_idle_uploads
+
+    def queue_full_response(error, **fields):
+        response = jsonify({"error": str(error), **fields})
+        response.headers['Retry-After'] = str(error.retry_after)
+        return response, 503
+
+    @app.route('/uploads', methods=['POST'])
+    def create_upload():
+        """Start a job whose files follow in resumable chunks.
+
+        Takes the form fields of the upload page, with a 'files' field
+        listing each file's name and size in place of the photos.
+        """
+        try:
+            files = parse_declared_files(request.form.get('files'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        try:
+            watermark_file = uploaded_watermark()
+        except Exception as e:
+            return jsonify({"error": f"Watermark error: {str(e)}"}), 400
+
+        # Abandoned uploads stay listed until their job expires
+        for stale in [key for key in uploads if app.jobs.get(key) is None]:
+            uploads.pop(stale, None)
+
+        session_id = str(uuid4())
+        spool_dir = os.path.join(app.config['SPOOL_FOLDER'], session_id)
+        upload = ChunkedUpload(spool_dir, files)
+        watermark_path = None
+        if watermark_file is not None:
+            watermark_path = spool_upload(watermark_file, spool_dir, 'watermark')
+        options = job_options(request.form, watermark_path)
+        process_image_unit, _ = start_job(
+            session_id, len(files), options, spool_dir,
+            on_finished=lambda: uploads.pop(session_id, None)
+        )
+        uploads[session_id] = (upload, process_image_unit, client_key())
+        return jsonify({
+            "job_id": session_id,
+            "chunk_size": app.config['UPLOAD_CHUNK_SIZE'],
+            "files": upload.status(),
+            "progress": url_for('get_progress', session_id=session_id)
+        }), 201
+
+    @app.route('/uploads/<session_id>')
+    @limiter.exempt  # Polled by clients resuming an upload
+    def upload_status(session_id):
+        """How much of each file has arrived"""
+        entry = find_upload(session_id)
+        if entry is None:
+            return jsonify({"error": "Upload not found"}), 404
+        upload = entry[0]
+        return jsonify({"job_id": session_id, "committed": upload.committed, "files": upload.status()})
+
+    @app.route('/uploads/<session_id>/files/<int:index>', methods=['PUT'])
+    @limiter.exempt  # One request per chunk
+    def upload_chunk(session_id, index):
+        """Append the request body to a file at ?offset=, the bytes it already holds.
+
+        The file is queued for processing as soon as its last byte lands,
+        while the rest of the batch is still uploading.
+        """
+        entry = find_upload(session_id)
+        if entry is None:
+            return jsonify({"error": "Upload not found"}), 404
+        upload, process_image_unit, client = entry
+        if index >= len(upload.files):
+            return jsonify({"error": "File not found"}), 404
+        try:
+            offset = int(request.args.get('offset', 0))
+            received = upload.write(index, offset, request.stream)
+        except OffsetMismatch as e:
+            return jsonify({"error": str(e), "received": e.received}), 409
+        except ValueError as e:
+            return jsonify({"error": str(e), "received": upload.received(index)}), 400
+
+        if received == upload.files[index]['size']:
+            try:
+                error = queue_upload_file(client, session_id, upload, process_image_unit, index)
+            except QueueFull as e:
+                # Resend an empty chunk at the final offset to queue it later
+                logger.warning(f"Deferred file {index} of job {session_id}: {e}")
+                return queue_full_response(e, received=received)
+            if error is not None:
+                return jsonify({"error": error, "received": received}), 400
+        return jsonify({"received": received})
+
+    @app.route('/uploads/<session_id>/commit', methods=['POST'])
+    def commit_upload(session_id):
+        """Finish a chunked upload; files that never completed count as failed"""
+        entry = find_upload(session_id)
+        if entry is None:
+            return jsonify({"error": "Upload not found"}), 404
+        try:
+            finish_upload(session_id, *entry)
+        except QueueFull as e:
+            return queue_full_response(e)
+        progress = app.jobs.get(session_id)
+        if progress is None:
+            return jsonify({"error": "Upload not found"}), 404
+        return jsonify(progress_payload(progress)), 202
+
     @app.route('/progress/<session_id>')
     @limiter.exempt  # Exempt this endpoint from rate limiting
     def get_progress(session_id):
         """Get progress for a specific session"""
         try:
-            if session_id not in progress_tracker:
+            progress = app.jobs.get(session_id)
+            if progress is None:
                 return jsonify({"status": "not_found"}), 404
             
-            progress = progress_tracker[session_id]
-            
-            # Calculate elapsed time
-            elapsed_time = None
-            if progress.get('start_time'):
-                elapsed_time = (datetime.now() - progress['start_time']).total_seconds()
-            
-            return jsonify({
-                "total": progress['total'],
-                "done": progress['done'],
-                "failed": progress.get('failed', 0),
-                "zip": progress.get('zip'),
-                "current_file": progress.get('current_file'),
-                "elapsed_time": elapsed_time,
-                "error": progress.get('error')
-            })
+            records = None
+            if request.args.get('detail') in ('1', 'true'):
+                records = app.jobs.records(session_id)
+            return jsonify(progress_payload(progress, records))
         except Exception as e:
             logger.error(f"Error getting progress: {str(e)}")
             return jsonify({"error": "Error checking progress"}), 500
 
+    @app.route('/progress/<session_id>/stream')
+    @limiter.exempt  # Long-lived; one request per open progress page
+    def stream_progress(session_id):
+        """Push progress as Server-Sent Events whenever the job changes"""
+        def events():
+            version = None
+            last_sent = None
+            while True:
+                progress = app.jobs.wait_for_change(
+                    session_id, version, app.config['PROGRESS_STREAM_KEEPALIVE']
+                )
+                if progress is None:
+                    yield f"event: not_found\ndata: {json.dumps({'status': 'not_found'})}\n\n"
+                    return
+                if progress['version'] == version:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                version = progress['version']
+                
+                payload = progress_payload(progress)
+                state = tuple(payload[key] for key in STREAMED_FIELDS)
+                if state != last_sent:
+                    last_sent = state
+                    yield f"data: {json.dumps(payload)}\n\n"
+                if payload['finished']:
+                    return
+        
+        return Response(
+            events(),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    @app.route('/metrics')
+    @limiter.exempt  # Scraped every few seconds
+    def get_metrics():
+        """Pipeline metrics of every process, in Prometheus text format"""
+        if not metrics.enabled:
+            return jsonify({"error": "Metrics are disabled"}), 404
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/profile/<session_id>')
+    @limiter.exempt
+    def download_profile(session_id):
+        """Download the cProfile stats of a profiled job (admin only)"""
+        token = request.headers.get('X-Profile-Token') or request.args.get('token')
+        if not token_matches(app.config['PROFILE_TOKEN'], token):
+            return jsonify({"error": "Not found"}), 404
+        # send_from_directory rejects unsafe names and answers 404 if missing
+        return send_from_directory(
+            os.path.dirname(profile_path(session_id)),
+            f"{session_id}.prof",
+            as_attachment=True
+        )
+
     @app.route('/download/<session_id>')
     def download_file(session_id):
         """Download the processed zip file"""
         try:
-            zip_dir = os.path.join(app.root_path, 'static', 'zips')
-            zip_path = os.path.join(zip_dir, f"{session_id}.zip")
+            zip_path = os.path.join(app.config['ZIP_FOLDER'], f"{session_id}.zip")
+            output_dir = safe_join(app.config['UPLOAD_FOLDER'], session_id)
+            
+            # Stream mode: build the zip on the fly from the loose outputs
+            if output_dir and os.path.isdir(output_dir) and not os.path.exists(zip_path):
+                return Response(
+                    stream_zip(directory_members(output_dir)),
+                    mimetype='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename=processed_images.zip'}
+                )
             
             if not os.path.exists(zip_path):
                 if 'language' not in session:
@@ -248,7 +705,7 @@ def register_routes(app, limiter):
                 return jsonify({"error": translations.get("error", "File not found")}), 404
             
             return send_from_directory(
-                zip_dir,
+                app.config['ZIP_FOLDER'],
                 f"{session_id}.zip",
                 as_attachment=True,
                 download_name="processed_images.zip"
@@ -0,0 +1,261 @@
+"""Fair-share scheduling of processing work onto the shared executor."""
+import bisect
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from .metrics import registry as metrics
+
+logger = logging.getLogger(__name__)
+
+class QueueFull(Exception):
+    """Raised when admitting a job would exceed the queue limits."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Processing queue is full; retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class FairScheduler:
+    """Round-robin queue per client in front of a fixed pool of workers.
+
+    At most ``workers`` tasks are handed to the executor at a time, so
+    the executor's own FIFO never builds up. Waiting tasks sit in one
+    queue per client and are started one client at a time in turn, so
+    a client with a hundred queued photos delays another client's work
+    by at most one task per worker. The waiting queue is capped by
+    image count and bytes; work is always admitted into an empty queue.
+
+    ``on_position(job_id, position)`` is called whenever the place in
+    line of a job's first waiting task changes, and with None once any
+    of its tasks has started. With ``position_interval``, positions are
+    published at most that often, the latest ones after the interval.
+
+    ``limit(job_id, n)`` caps how many tasks of one job run at once;
+    its other tasks wait without holding a worker, while other jobs'
+    tasks start ahead of them.
+
+    Without an executor, a thread pool of ``workers`` threads is created
+    when the first task starts.
+    """
+
+    def __init__(self, executor, workers, max_images=500, max_bytes=2 * 1024 ** 3,
+                 default_retry_after=30, on_position=None, position_interval=0):
+        self._executor = executor
+        self.workers = workers
+        self.max_images = max_images
+        self.max_bytes = max_bytes
+        self.default_retry_after = default_retry_after
+        self.on_position = on_position
+        self.position_interval = position_interval
+        self.running = 0
+        self.queued_images = 0
+        self.queued_bytes = 0
+        self._queues = OrderedDict()
+        self._positions = {}
+        self._outstanding = {}
+        self._started_jobs = set()
+        self._job_limits = {}
+        self._job_running = {}
+        self._image_seconds = None
+        self._last_publish = 0.0
+        self._publish_timer = None
+        self._lock = threading.Lock()
+        # Serializes callbacks so a stale position never lands after a newer one
+        self._publish_lock = threading.Lock()
+        self._executor_lock = threading.Lock()
+
+    @property
+    def executor(self):
+        """Executor the tasks run on, created on first use if not given."""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def submit(self, client, job_id, fn, images=1, size=0):
+        """Queue fn for client, or raise QueueFull if over the limits."""
+        self.submit_all(client, job_id, [(fn, images, size)])
+
+    def submit_all(self, client, job_id, tasks):
+        """Queue (fn, images, size) tasks of one job, all or none.
+
+        Tasks without images or bytes, such as recording a failed upload,
+        are always admitted.
+        """
+        images = sum(task[1] for task in tasks)
+        size = sum(task[2] for task in tasks)
+        with self._lock:
+            if (images or size) and self.queued_images and (
+                self.queued_images + images > self.max_images
+                or self.queued_bytes + size > self.max_bytes
+            ):
+                raise QueueFull(self._retry_after())
+            queue = self._queues.setdefault(client, deque())
+            queue.extend((job_id, fn, task_images, task_size) for fn, task_images, task_size in tasks)
+            self.queued_images += images
+            self.queued_bytes += size
+            self._outstanding[job_id] = self._outstanding.get(job_id, 0) + len(tasks)
+            started = self._take_ready()
+            self._report()
+        self._start(started)
+        self._publish_positions()
+
+    def limit(self, job_id, max_running):
+        """Run at most max_running tasks of job_id at a time; None lifts the cap."""
+        with self._lock:
+            if max_running is None:
+                self._job_limits.pop(job_id, None)
+                started = self._take_ready()
+            else:
+                self._job_limits[job_id] = max_running
+                started = []
+        self._start(started)
+
+    def position(self, job_id):
+        """Return a waiting job's place in line, or None if not waiting."""
+        with self._lock:
+            return self._order().get(job_id)
+
+    def stats(self):
+        """Return queue depth and worker usage."""
+        with self._lock:
+            return {
+                'running': self.running,
+                'workers': self.workers,
+                'queued_tasks': sum(len(queue) for queue in self._queues.values()),
+                'queued_images': self.queued_images,
+                'queued_bytes': self.queued_bytes,
+                'clients': len(self._queues)
+            }
+
+    def _take_ready(self):
+        # Caller holds the lock
+        started = []
+        while self.running < self.workers:
+            task = self._next_task()
+            if task is None:
+                break
+            self.queued_images -= task[2]
+            self.queued_bytes -= task[3]
+            self.running += 1
+            self._job_running[task[0]] = self._job_running.get(task[0], 0) + 1
+            self._started_jobs.add(task[0])
+            started.append(task)
+        return started
+
+    def _next_task(self):
+        # Caller holds the lock; the first task in client order whose job is
+        # under its limit, rotating that client to the back
+        for client, queue in self._queues.items():
+            for index, task in enumerate(queue):
+                limit = self._job_limits.get(task[0])
+                if limit is None or self._job_running.get(task[0], 0) < limit:
+                    del queue[index]
+                    if queue:
+                        self._queues.move_to_end(client)
+                    else:
+                        del self._queues[client]
+                    return task
+        return None
+
+    def _start(self, tasks):
+        for task in tasks:
+            self.executor.submit(self._run, task)
+
+    def _run(self, task):
+        job_id, fn, images, _ = task
+        start = time.monotonic()
+        try:
+            fn()
+        except Exception as e:
+            logger.error(f"Scheduled job {job_id} failed: {e}")
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self.running -= 1
+                self._job_running[job_id] -= 1
+                if not self._job_running[job_id]:
+                    del self._job_running[job_id]
+                self._outstanding[job_id] -= 1
+                if not self._outstanding[job_id]:
+                    del self._outstanding[job_id]
+                    self._started_jobs.discard(job_id)
+                per_image = elapsed / max(images, 1)
+                if self._image_seconds is None:
+                    self._image_seconds = per_image
+                else:
+                    self._image_seconds = 0.8 * self._image_seconds + 0.2 * per_image
+                started = self._take_ready()
+                self._report()
+            self._start(started)
+            self._publish_positions()
+
+    def _order(self):
+        # Caller holds the lock; ranks each job by its first waiting task,
+        # skipping jobs that already started. In the round-robin, the task
+        # at index i of a queue comes after min(len, i) tasks of every
+        # queue, plus one more of each earlier queue longer than i.
+        lengths = [len(queue) for queue in self._queues.values()]
+        sorted_lengths = sorted(lengths)
+        totals = [0]
+        for length in sorted_lengths:
+            totals.append(totals[-1] + length)
+        order = {}
+        for position, queue in enumerate(self._queues.values()):
+            for index, task in enumerate(queue):
+                job_id = task[0]
+                if job_id in order or job_id in self._started_jobs:
+                    continue
+                shorter = bisect.bisect_left(sorted_lengths, index)
+                ahead = totals[shorter] + index * (len(lengths) - shorter)
+                ahead += sum(1 for length in lengths[:position] if length > index)
+                order[job_id] = ahead + 1
+        return order
+
+    def _report(self):
+        # Caller holds the lock
+        metrics.set('watermark_queue_images', self.queued_images)
+        metrics.set('watermark_queue_bytes', self.queued_bytes)
+        metrics.set('watermark_active_workers', self.running)
+        metrics.set('watermark_worker_slots', self.workers)
+
+    def _retry_after(self):
+        # Caller holds the lock; time for the workers to drain the queue
+        if self._image_seconds is None:
+            return self.default_retry_after
+        return max(1, math.ceil(self._image_seconds * self.queued_images / self.workers))
+
+    def _publish_positions(self):
+        if self.on_position is None:
+            return
+        with self._lock:
+            if self._publish_timer is not None:
+                # A publish is already due and will see this change
+                return
+            wait = self._last_publish + self.position_interval - time.monotonic()
+            if wait > 0:
+                self._publish_timer = threading.Timer(wait, self._publish_now)
+                self._publish_timer.daemon = True
+                self._publish_timer.start()
+                return
+        self._publish_now()
+
+    def _publish_now(self):
+        # Only jobs whose rank changed since the last publish are written
+        with self._publish_lock:
+            with self._lock:
+                self._publish_timer = None
+                self._last_publish = time.monotonic()
+                order = self._order()
+                changed = {job_id: pos for job_id, pos in order.items() if self._positions.get(job_id) != pos}
+                started = [job_id for job_id in self._positions if job_id not in order]
+                self._positions = order
+            for job_id in started:
+                changed[job_id] = None
+            for job_id, position in changed.items():
+                try:
+                    self.on_position(job_id, position)
+                except Exception as e:
+                    logger.error(f"Could not publish queue position for {job_id}: {e}")
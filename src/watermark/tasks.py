@@ -1,65 +1,100 @@
 """Task scheduling and background jobs."""
-from datetime import datetime, timedelta
 import logging
 import os
-import shutil
+import threading
 
 logger = logging.getLogger(__name__)
 
-def clear_previous_sessions(upload_folder, zip_folder):
-    """Clean up old files and folders."""
-    logger.info("Starting cleanup of previous sessions")
-    
-    for folder in [upload_folder, zip_folder]:
-        if not os.path.exists(folder):
+def index_leftovers(app):
+    """Index artifacts on disk that the expiry index does not know about.
+
+    Outputs written before the index existed, or by a process that died
+    before registering them, would otherwise never be reaped. Finished
+    outputs and zips get OUTPUT_TTL; spools and ``.part`` files may belong
+    to a job still running in another process, so they get JOB_TTL and
+    size=0 like the ones running jobs register.
+    """
+    finished = []
+    in_flight = []
+    for folder in (app.config['UPLOAD_FOLDER'], app.config['ZIP_FOLDER'], app.config['SPOOL_FOLDER']):
+        try:
+            entries = list(os.scandir(folder))
+        except FileNotFoundError:
             continue
-            
-        for filename in os.listdir(folder):
-            file_path = os.path.join(folder, filename)
-            try:
-                if os.path.isfile(file_path) or os.path.islink(file_path):
-                    # Check if file is older than 24 hours
-                    file_age = datetime.now() - datetime.fromtimestamp(os.path.getctime(file_path))
-                    if file_age > timedelta(hours=24):
-                        os.unlink(file_path)
-                        logger.info(f"Deleted old file: {file_path}")
-                elif os.path.isdir(file_path):
-                    # Check if directory is older than 24 hours
-                    dir_age = datetime.now() - datetime.fromtimestamp(os.path.getctime(file_path))
-                    if dir_age > timedelta(hours=24):
-                        shutil.rmtree(file_path)
-                        logger.info(f"Deleted old directory: {file_path}")
-            except Exception as e:
-                logger.error(f"Failed to delete {file_path}: {e}")
+        for entry in entries:
+            if folder == app.config['SPOOL_FOLDER'] or entry.name.endswith('.part'):
+                in_flight.append(entry.path)
+            else:
+                finished.append(entry.path)
+    added = app.expiry.adopt(finished, app.config['OUTPUT_TTL'])
+    added += app.expiry.adopt(in_flight, app.config['JOB_TTL'], size=0)
+    if added:
+        logger.info(f"Indexed {added} leftover artifacts for expiry")
+
+def setup_scheduler(app, delay=0):
+    """Initialize and start the background scheduler, after delay seconds if given.
+
+    Importing APScheduler takes longer than the rest of startup, and
+    nothing it runs is due in the first minute, so the app starts it
+    off the path to the first request.
+    """
+    if delay:
+        timer = threading.Timer(delay, setup_scheduler, (app,))
+        timer.daemon = True
+        timer.start()
+        return
 
-def setup_scheduler(app):
-    """Initialize and start the background scheduler."""
     from apscheduler.schedulers.background import BackgroundScheduler
     
+    try:
+        index_leftovers(app)
+    except Exception as e:
+        logger.error(f"Indexing leftover artifacts failed: {e}")
+    
     scheduler = BackgroundScheduler()
     
-    def scheduled_cleanup():
-        """Wrapper to pass app context to cleanup function"""
-        with app.app_context():
-            upload_folder = os.path.join(app.root_path, 'static', 'output')
-            zip_folder = os.path.join(app.root_path, 'static', 'zips')
-            clear_previous_sessions(upload_folder, zip_folder)
+    def reap_expired():
+        """Delete job artifacts that are due or over the disk quota"""
+        try:
+            app.expiry.reap()
+        except Exception as e:
+            logger.error(f"Expiry reaper failed: {e}")
+    
+    def commit_idle_uploads():
+        """Chunked uploads a client abandoned without committing"""
+        try:
+            app.commit_idle_uploads()
+        except Exception as e:
+            logger.error(f"Committing idle uploads failed: {e}")
     
-    # Run cleanup every 24 hours
+    def prune_result_cache():
+        """The result cache is size-capped rather than age-limited"""
+        if app.result_cache is not None:
+            app.result_cache.prune()
+    
+    # Only rows that are due are read, so reaping often is cheap
     scheduler.add_job(
-        func=scheduled_cleanup,
+        func=reap_expired,
         trigger="interval",
-        hours=24,
-        id='cleanup_old_files',
+        seconds=app.config['REAPER_INTERVAL'],
+        id='reap_expired',
         replace_existing=True
     )
     
-    # Also run cleanup on startup (after 1 minute)
     scheduler.add_job(
-        func=scheduled_cleanup,
-        trigger="date",
-        run_date=datetime.now() + timedelta(minutes=1),
-        id='cleanup_on_startup'
+        func=commit_idle_uploads,
+        trigger="interval",
+        seconds=app.config['REAPER_INTERVAL'],
+        id='commit_idle_uploads',
+        replace_existing=True
+    )
+    
+    scheduler.add_job(
+        func=prune_result_cache,
+        trigger="interval",
+        hours=24,
+        id='prune_result_cache',
+        replace_existing=True
     )
     
     scheduler.start()
@@ -0,0 +1,108 @@
+"""Resumable uploads: a job's files arrive in chunks, file by file."""
+import os
+import threading
+import time
+
+# Bytes copied from the request body per write
+COPY_BUFFER_SIZE = 64 * 1024
+
+class OffsetMismatch(Exception):
+    """Raised when a chunk does not start where the received data ends."""
+
+    def __init__(self, received):
+        super().__init__(f"Chunk must start at offset {received}")
+        self.received = received
+
+class ChunkedUpload:
+    """The declared files of one job, spooled as their chunks arrive.
+
+    The bytes on disk are the record of what arrived, so a client whose
+    connection dropped mid-chunk asks for ``received`` and resumes from
+    there. A file is complete once it holds its declared size; ``claim``
+    then hands it out for processing exactly once, and ``commit`` hands
+    out the files that will never complete. ``last_active`` is the
+    monotonic time of the latest chunk, for timing out abandoned uploads.
+    """
+
+    def __init__(self, spool_dir, files):
+        self.spool_dir = spool_dir
+        self.files = [
+            {'filename': file['name'], 'size': file['size'], 'path': os.path.join(spool_dir, f"{index:05d}")}
+            for index, file in enumerate(files)
+        ]
+        self.committed = False
+        self.last_active = time.monotonic()
+        self._claimed = set()
+        self._lock = threading.Lock()
+        self._file_locks = [threading.Lock() for _ in self.files]
+        os.makedirs(spool_dir, exist_ok=True)
+
+    def received(self, index):
+        """Bytes of a file on disk so far."""
+        try:
+            return os.path.getsize(self.files[index]['path'])
+        except FileNotFoundError:
+            return 0
+
+    def write(self, index, offset, stream):
+        """Append a chunk read from stream at offset; return the bytes received.
+
+        Whatever arrived before a dropped connection is kept.
+        """
+        file_data = self.files[index]
+        self.last_active = time.monotonic()
+        with self._file_locks[index]:
+            if self.committed:
+                raise ValueError("Upload already committed")
+            received = self.received(index)
+            if offset != received:
+                raise OffsetMismatch(received)
+            with open(file_data['path'], 'ab') as f:
+                while True:
+                    chunk = stream.read(COPY_BUFFER_SIZE)
+                    if not chunk:
+                        break
+                    if received + len(chunk) > file_data['size']:
+                        raise ValueError(f"Chunk runs past the declared size of {file_data['size']} bytes")
+                    f.write(chunk)
+                    received += len(chunk)
+                    self.last_active = time.monotonic()
+            return received
+
+    def claim(self, index):
+        """Return a complete file's data the first time it is claimed, else None."""
+        with self._lock:
+            if index in self._claimed or self.received(index) < self.files[index]['size']:
+                return None
+            self._claimed.add(index)
+            return self.files[index]
+
+    def release(self, index):
+        """Let a claimed file be claimed again, e.g. after it could not be queued."""
+        with self._lock:
+            self._claimed.discard(index)
+
+    def commit(self):
+        """Stop accepting chunks; claim and return the (index, file) pairs left incomplete."""
+        with self._lock:
+            self.committed = True
+            abandoned = [
+                index for index, file_data in enumerate(self.files)
+                if index not in self._claimed and self.received(index) < file_data['size']
+            ]
+            self._claimed.update(abandoned)
+        return [(index, self.files[index]) for index in abandoned]
+
+    def status(self):
+        """Per-file progress for a client deciding what to send next."""
+        status = []
+        for index, file_data in enumerate(self.files):
+            received = self.received(index)
+            status.append({
+                'index': index,
+                'name': file_data['filename'],
+                'size': file_data['size'],
+                'received': received,
+                'complete': received == file_data['size']
+            })
+        return status
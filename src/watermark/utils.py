@@ -1,61 +1,295 @@
 """Utility functions for image processing and file handling."""
 import os
+import hashlib
+import logging
+import threading
 import zipfile
+from collections import OrderedDict
 from uuid import uuid4
 from PIL import Image, ImageEnhance
 from io import BytesIO
-import magic
+from .archive import compression_for
+from . import blend
+
+logger = logging.getLogger(__name__)
 
 def allowed_file(filename, allowed_extensions):
     """Check if the file extension is allowed."""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
+# libmagic only needs the file header to identify image types
+MIME_SNIFF_BYTES = 2048
+
+def upload_size(file):
+    """Return the size of an uploaded file without reading it into memory."""
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(0)
+    return size
+
+def sniff_mime(head):
+    """Identify a file type from its first bytes with libmagic."""
+    # Loading libmagic and its database is slow, so wait for the first upload
+    import magic
+    return magic.from_buffer(head, mime=True)
+
 def validate_file(file, allowed_extensions, max_size):
     """Validate uploaded file."""
     if not file:
         raise ValueError("No file provided")
     if not allowed_file(file.filename, allowed_extensions):
         raise ValueError(f"File type not allowed. Allowed types: {', '.join(allowed_extensions)}")
-    content = file.read()
-    file.seek(0)  # Reset file pointer
-    if len(content) > max_size:
+    if upload_size(file) > max_size:
         raise ValueError(f"File too large. Maximum size: {max_size/1024/1024}MB")
-    mime = magic.from_buffer(content, mime=True)
+    head = file.read(MIME_SNIFF_BYTES)
+    file.seek(0)  # Reset file pointer
+    mime = sniff_mime(head)
     if not mime.startswith('image/'):
         raise ValueError(f"Invalid file type: {mime}")
     return True
 
-def apply_watermark(image, watermark, fill_pct, opacity_pct):
-    """Apply centered watermark with caching."""
+def spool_upload(file, spool_dir, name):
+    """Copy an upload to the spool directory in chunks and return its path."""
+    os.makedirs(spool_dir, exist_ok=True)
+    path = os.path.join(spool_dir, name)
+    file.seek(0)
+    file.save(path)
+    return path
+
+class WatermarkCache:
+    """Bounded LRU cache of prepared watermark tiles, evicted by byte size."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached tile for key, or None on a miss."""
+        with self._lock:
+            tile = self._entries.get(key)
+            if tile is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return tile
+
+    def put(self, key, tile):
+        """Store a tile, evicting least recently used entries over the limit."""
+        size = self._size(tile)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._size(self._entries.pop(key))
+            self._entries[key] = tile
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= self._size(evicted)
+
+    def clear(self):
+        """Drop every cached tile and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return hit/miss counts and current usage."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes
+            }
+
+    @staticmethod
+    def _size(tile):
+        # Prepared tiles are PIL images or, for the NumPy engine, arrays
+        if hasattr(tile, 'nbytes'):
+            return tile.nbytes
+        return tile.width * tile.height * len(tile.getbands())
+
+# Shared across jobs; sized from config in create_app
+watermark_cache = WatermarkCache()
+
+def watermark_digest(content):
+    """Return the content hash used to key prepared watermarks."""
+    return hashlib.sha256(content).hexdigest()
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """Return the sha256 of a file on disk, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def prepare_watermark(watermark, size, opacity_pct):
+    """Convert, resize and fade the watermark to the given size."""
+    watermark = watermark.convert("RGBA")
+    watermark = watermark.resize(size, Image.Resampling.LANCZOS)
+
+    alpha = watermark.split()[3]
+    alpha = ImageEnhance.Brightness(alpha).enhance(opacity_pct / 100.0)
+    watermark.putalpha(alpha)
+    return watermark
+
+# Placement of a single watermark, and the tiling patterns
+POSITIONS = ('center', 'top-left', 'top-right', 'bottom-left', 'bottom-right')
+PATTERNS = ('single', 'grid', 'diagonal')
+
+# Gap around single corner placements, as a percentage of the shorter side
+EDGE_MARGIN_PCT = 2
+
+# Gap between tiles, as a fraction of the tile size
+TILE_SPACING = 0.5
+
+def single_position(image_size, tile_size, position):
+    """Top-left corner for a single watermark at the named position."""
+    width, height = image_size
+    wm_width, wm_height = tile_size
+    margin = int(min(width, height) * EDGE_MARGIN_PCT / 100)
+    x = {
+        'left': margin,
+        'right': width - wm_width - margin
+    }.get(position.rsplit('-', 1)[-1], (width - wm_width) // 2)
+    y = {
+        'top': margin,
+        'bottom': height - wm_height - margin
+    }.get(position.split('-', 1)[0], (height - wm_height) // 2)
+    return x, y
+
+def repeat_image(image, size):
+    """Tile image across size by doubling the filled area on each paste."""
+    width, height = size
+    strip = Image.new(image.mode, (width, image.height), (0, 0, 0, 0))
+    strip.paste(image, (0, 0))
+    filled = image.width
+    while filled < width:
+        strip.paste(strip.crop((0, 0, filled, image.height)), (filled, 0))
+        filled *= 2
+
+    layer = Image.new(image.mode, (width, height), (0, 0, 0, 0))
+    layer.paste(strip, (0, 0))
+    filled = image.height
+    while filled < height:
+        layer.paste(layer.crop((0, 0, width, filled)), (0, filled))
+        filled *= 2
+    return layer
+
+def build_pattern_layer(tile, image_size, pattern):
+    """Precomposite a full-frame RGBA overlay of tile repeated as pattern.
+
+    Grid repeats the tile in rows and columns; diagonal tilts it 45
+    degrees and offsets every other row by half a cell. Building takes a
+    logarithmic number of pastes, and the result is applied to each image
+    with a single alpha_composite however dense the tiling is.
+    """
+    if pattern == 'diagonal':
+        tile = tile.rotate(45, resample=Image.Resampling.BICUBIC, expand=True)
+
+    gap_x = max(1, int(tile.width * TILE_SPACING))
+    gap_y = max(1, int(tile.height * TILE_SPACING))
+    cell = Image.new('RGBA', (tile.width + gap_x, tile.height + gap_y), (0, 0, 0, 0))
+    cell.paste(tile, (gap_x // 2, gap_y // 2))
+
+    if pattern == 'diagonal':
+        block = Image.new('RGBA', (cell.width, cell.height * 2), (0, 0, 0, 0))
+        block.paste(cell, (0, 0))
+        block.paste(cell, (cell.width // 2 - cell.width, cell.height))
+        block.paste(cell, (cell.width // 2, cell.height))
+        cell = block
+
+    # Oversize by one cell and crop so the pattern sits centered
+    width, height = image_size
+    layer = repeat_image(cell, (width + cell.width, height + cell.height))
+    left = (cell.width - width % cell.width) // 2
+    top = (cell.height - height % cell.height) // 2
+    return layer.crop((left, top, left + width, top + height))
+
+def cached_watermark(key, build):
+    """Return the cached prepared image for key, building it on a miss."""
+    if key is None:
+        return build()
+    prepared = watermark_cache.get(key)
+    if prepared is None:
+        prepared = build()
+        watermark_cache.put(key, prepared)
+    return prepared
+
+def apply_watermark(image, watermark, fill_pct, opacity_pct, digest=None,
+                    position='center', pattern='single', engine='pillow'):
+    """Apply a positioned or tiled watermark.
+
+    Prepared tiles and pattern layers are reused across calls when a
+    digest of the watermark is given. With engine='numpy' (and NumPy
+    installed) single placements are blended with blend.blend_region.
+    """
     try:
         img = image.convert("RGBA")
-        watermark = watermark.convert("RGBA")
 
         wm_width = int((fill_pct / 100.0) * img.width)
         aspect_ratio = watermark.width / watermark.height
         wm_height = int(wm_width / aspect_ratio)
-        watermark = watermark.resize((wm_width, wm_height), Image.Resampling.LANCZOS)
+        size = (wm_width, wm_height)
+        if wm_width < 1 or wm_height < 1:
+            return img
 
-        alpha = watermark.split()[3]
-        alpha = ImageEnhance.Brightness(alpha).enhance(opacity_pct / 100.0)
-        watermark.putalpha(alpha)
+        tile_key = None if digest is None else (digest, size, opacity_pct)
+        tile = cached_watermark(tile_key, lambda: prepare_watermark(watermark, size, opacity_pct))
 
-        # Center the watermark
-        pos = ((img.width - wm_width) // 2, (img.height - wm_height) // 2)
-        img.paste(watermark, pos, watermark)
+        if pattern not in ('grid', 'diagonal'):
+            pos = single_position(img.size, size, position)
+            if engine == 'numpy' and blend.np is not None:
+                packed_key = None if tile_key is None else tile_key + ('premultiplied',)
+                packed = cached_watermark(packed_key, lambda: blend.PackedTile(tile))
+                return blend.blend_region(img, packed, pos)
+            img.paste(tile, pos, tile)
+            return img
+
+        layer_key = None if digest is None else (digest, size, opacity_pct, pattern, img.size)
+        layer = cached_watermark(layer_key, lambda: build_pattern_layer(tile, img.size, pattern))
+        img.alpha_composite(layer)
 
         return img
     except Exception as e:
         raise Exception(f"Error applying watermark: {e}")
 
-def resize_image(image, scale_pct):
-    """Resize image by percentage."""
-    if scale_pct == 100:
-        print("[DEBUG] Skipping resize (100%)")
+def draft_for_resize(image, scale_pct, margin=2.0):
+    """Let a JPEG decode at a reduced DCT scale ahead of a downscale.
+
+    libjpeg can decode at 1/2, 1/4 or 1/8 scale for a fraction of the
+    cost of a full decode. The chosen scale still leaves at least
+    ``margin`` times the final size for the resize that follows, so
+    quality loss stays within that tolerance. A margin of 0 disables it.
+    """
+    if image.format != 'JPEG' or not margin or scale_pct >= 100:
+        return image
+    target = (
+        max(1, int(image.width * scale_pct / 100 * margin)),
+        max(1, int(image.height * scale_pct / 100 * margin))
+    )
+    image.draft(None, target)
+    return image
+
+def resize_image(image, scale_pct, source_size=None):
+    """Resize image by percentage of its source size."""
+    source_width, source_height = source_size or image.size
+    width = int(source_width * scale_pct / 100)
+    height = int(source_height * scale_pct / 100)
+    if (width, height) == image.size:
+        logger.debug("Skipping resize (100%)")
         return image
-    width = int(image.width * scale_pct / 100)
-    height = int(image.height * scale_pct / 100)
-    print(f"[DEBUG] Resizing image to {width}x{height}")
+    logger.debug(f"Resizing image to {width}x{height}")
     return image.resize((width, height), Image.Resampling.LANCZOS)
 
 def create_zip(file_list, zip_path):
@@ -65,4 +299,4 @@ def create_zip(file_list, zip_path):
     with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
         for file_path in file_list:
             arcname = os.path.basename(file_path)
-            zipf.write(file_path, arcname)
\ No newline at end of file
+            zipf.write(file_path, arcname, compress_type=compression_for(arcname))
\ No newline at end of file
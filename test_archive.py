@@ -0,0 +1,48 @@
+import io
+import os
+import zipfile
+from watermark.archive import (
+    IncrementalZip,
+    OutputDirectory,
+    compression_for,
+    directory_members,
+    stream_zip
+)
+
+def test_compression_for_already_compressed_formats():
+    assert compression_for('photo.jpg') == zipfile.ZIP_STORED
+    assert compression_for('photo.PNG') == zipfile.ZIP_STORED
+    assert compression_for('notes.txt') == zipfile.ZIP_DEFLATED
+
+def test_incremental_zip_publishes_on_close(tmp_path):
+    zip_path = str(tmp_path / 'zips' / 'job.zip')
+    archive = IncrementalZip(zip_path)
+    archive.add('a.jpg', b'a' * 100)
+    archive.add('b.png', b'b' * 100)
+    assert not os.path.exists(zip_path)
+    archive.close()
+    with zipfile.ZipFile(zip_path) as zf:
+        assert zf.namelist() == ['a.jpg', 'b.png']
+        assert all(info.compress_type == zipfile.ZIP_STORED for info in zf.infolist())
+    assert not os.path.exists(archive.part_path)
+
+def test_incremental_zip_abort_removes_partial_archive(tmp_path):
+    zip_path = str(tmp_path / 'job.zip')
+    archive = IncrementalZip(zip_path)
+    archive.add('a.jpg', b'data')
+    archive.abort()
+    assert not os.path.exists(zip_path)
+    assert not os.path.exists(archive.part_path)
+
+def test_stream_zip_matches_written_files(tmp_path):
+    output = OutputDirectory(str(tmp_path / 'job'))
+    output.add('a.jpg', os.urandom(200 * 1024))
+    output.add('b.txt', b'hello' * 1000)
+    output_dir = output.close()
+
+    data = b''.join(stream_zip(directory_members(output_dir), chunk_size=4096))
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == ['a.jpg', 'b.txt']
+        assert zf.read('b.txt') == b'hello' * 1000
+        assert zf.getinfo('a.jpg').compress_type == zipfile.ZIP_STORED
@@ -0,0 +1,49 @@
+import pytest
+from PIL import Image, ImageChops
+from watermark import blend
+from watermark.utils import apply_watermark, watermark_cache
+
+np = pytest.importorskip('numpy')
+
+@pytest.fixture(autouse=True)
+def reset_watermark_cache():
+    watermark_cache.clear()
+    yield
+    watermark_cache.clear()
+
+def make_photo(size=(160, 120)):
+    return Image.effect_noise(size, 64).convert('RGB')
+
+def make_watermark():
+    # Soft alpha ramp on a transparent border exercises rounding and cropping
+    artwork = Image.effect_noise((30, 14), 80).convert('RGBA')
+    artwork.putalpha(Image.linear_gradient('L').resize((30, 14)))
+    watermark = Image.new('RGBA', (40, 20), (0, 0, 0, 0))
+    watermark.paste(artwork, (5, 3))
+    return watermark
+
+@pytest.mark.parametrize('position', ['center', 'top-left', 'bottom-right'])
+@pytest.mark.parametrize('fill_pct', [20, 100])
+def test_numpy_engine_matches_pillow(position, fill_pct):
+    img = make_photo()
+    watermark = make_watermark()
+    expected = apply_watermark(img, watermark, fill_pct, 60, position=position)
+    for digest in (None, 'wm'):
+        actual = apply_watermark(img, watermark, fill_pct, 60, digest=digest, position=position, engine='numpy')
+        extrema = ImageChops.difference(expected, actual).getextrema()
+        assert max(high for _, high in extrema) <= 1
+
+def test_packed_tile_skips_transparent_border():
+    packed = blend.PackedTile(make_watermark())
+    assert packed.offset == (5, 3)
+    assert packed.array.shape == (14, 30, 5)
+    empty = blend.PackedTile(Image.new('RGBA', (10, 10), (0, 0, 0, 0)))
+    img = Image.new('RGBA', (20, 20), 'white')
+    assert blend.blend_region(img, empty, (5, 5)).tobytes() == Image.new('RGBA', (20, 20), 'white').tobytes()
+
+def test_resolve_engine_falls_back_without_numpy(monkeypatch):
+    assert blend.resolve_engine('numpy') == 'numpy'
+    monkeypatch.setattr(blend, 'np', None)
+    assert blend.resolve_engine('numpy') == 'pillow'
+    with pytest.raises(ValueError):
+        blend.resolve_engine('opencv')
@@ -0,0 +1,54 @@
+import json
+import zipfile
+from io import BytesIO
+from PIL import Image
+from watermark.cli import main
+
+def make_inputs(folder):
+    (folder / 'sub').mkdir(parents=True)
+    Image.new('RGB', (64, 48), 'white').save(folder / 'a.jpg')
+    Image.new('RGB', (64, 48), 'white').save(folder / 'a.png')
+    Image.new('RGB', (64, 48), 'white').save(folder / 'sub' / 'b.png')
+    (folder / 'notes.txt').write_text('not an image')
+    Image.new('RGBA', (16, 8), 'black').save(folder.parent / 'logo.png')
+
+def test_cli_writes_directory_and_resumes(tmp_path, capsys):
+    make_inputs(tmp_path / 'in')
+    out = tmp_path / 'out'
+    args = [str(tmp_path / 'in'), '-o', str(out), '-w', str(tmp_path / 'logo.png'),
+            '--reduce', '50', '--format', 'png', '--workers', '1']
+    assert main(args) == 0
+    assert sorted(str(p.relative_to(out)) for p in out.rglob('*.png')) == ['a_jpg.png', 'a_png.png', 'sub/b.png']
+    assert Image.open(out / 'sub' / 'b.png').size == (32, 24)
+    records = [json.loads(line) for line in (out / '.manifest.jsonl').read_text().splitlines()]
+    assert sorted(record['name'] for record in records) == ['a.jpg', 'a.png', 'sub/b.png']
+
+    # A lost output is redone; everything else is skipped
+    (out / 'a_png.png').unlink()
+    capsys.readouterr()
+    assert main(args) == 0
+    assert '1 processed, 0 failed, 2 skipped' in capsys.readouterr().out
+    assert (out / 'a_png.png').exists()
+
+def test_cli_writes_zip(tmp_path):
+    make_inputs(tmp_path / 'in')
+    archive = tmp_path / 'out.zip'
+    assert main([str(tmp_path / 'in' / '*.png'), '-o', str(archive), '--format', 'jpg', '--workers', '1']) == 0
+    with zipfile.ZipFile(archive) as zf:
+        assert zf.namelist() == ['a.jpg']
+        assert Image.open(BytesIO(zf.read('a.jpg'))).size == (64, 48)
+    assert (tmp_path / 'out.zip.manifest.jsonl').exists()
+
+def test_cli_names_globs_from_their_root_and_refuses_clashes(tmp_path, capsys):
+    for folder in ('a', 'b'):
+        (tmp_path / 'shoot' / folder).mkdir(parents=True)
+        Image.new('RGB', (16, 16), 'white').save(tmp_path / 'shoot' / folder / 'x.jpg')
+    out = tmp_path / 'out'
+    assert main([str(tmp_path / 'shoot' / '**' / '*.jpg'), '-o', str(out), '--workers', '1']) == 0
+    assert sorted(str(p.relative_to(out)) for p in out.rglob('*.jpg')) == ['a/x.jpg', 'b/x.jpg']
+
+    capsys.readouterr()
+    patterns = [str(tmp_path / 'shoot' / folder / '*.jpg') for folder in ('a', 'b')]
+    assert main(patterns + ['-o', str(tmp_path / 'flat'), '--workers', '1']) == 1
+    assert 'would both be named x.jpg' in capsys.readouterr().err
+    assert not (tmp_path / 'flat').exists()
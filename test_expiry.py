@@ -0,0 +1,88 @@
+import os
+import time
+from types import SimpleNamespace
+from watermark.expiry import ExpiryIndex
+from watermark.tasks import index_leftovers
+
+def make_file(path, size):
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    return str(path)
+
+def test_reap_deletes_only_due_artifacts(tmp_path):
+    index = ExpiryIndex(str(tmp_path / 'expiry.sqlite3'))
+    old = make_file(tmp_path / 'old.zip', 10)
+    output_dir = tmp_path / 'job'
+    output_dir.mkdir()
+    make_file(output_dir / 'a.jpg', 10)
+    fresh = make_file(tmp_path / 'fresh.zip', 10)
+    index.add(old, ttl=-1)
+    index.add(str(output_dir), ttl=-1)
+    index.add(fresh, ttl=3600)
+    assert index.total_bytes() == 30
+
+    assert index.reap() == 2
+    assert not os.path.exists(old) and not output_dir.exists()
+    assert os.path.exists(fresh)
+    assert index.total_bytes() == 10
+
+def test_missing_artifacts_leave_the_index(tmp_path):
+    index = ExpiryIndex(str(tmp_path / 'expiry.sqlite3'))
+    index.add(str(tmp_path / 'gone'), ttl=-1, size=0)
+    assert index.reap() == 1
+    assert index.reap() == 0
+
+def test_quota_evicts_closest_to_expiry_first(tmp_path):
+    index = ExpiryIndex(str(tmp_path / 'expiry.sqlite3'), max_bytes=25)
+    paths = [make_file(tmp_path / f'{name}.zip', 10) for name in ('a', 'b', 'c')]
+    for ttl, path in zip((100, 200, 300), paths):
+        index.add(path, ttl=ttl)
+
+    assert index.reap() == 1
+    assert [os.path.exists(path) for path in paths] == [False, True, True]
+    assert index.total_bytes() == 20
+
+def test_quota_never_evicts_the_newest_artifact(tmp_path):
+    index = ExpiryIndex(str(tmp_path / 'expiry.sqlite3'), max_bytes=5)
+    path = make_file(tmp_path / 'big.zip', 10)
+    index.add(path, ttl=100)
+    assert index.reap() == 0
+    assert os.path.exists(path)
+
+def test_quota_leaves_running_jobs_alone(tmp_path):
+    index = ExpiryIndex(str(tmp_path / 'expiry.sqlite3'), max_bytes=15)
+    spool = tmp_path / 'spool'
+    spool.mkdir()
+    make_file(spool / '00000', 10)
+    part = make_file(tmp_path / 'running.zip.part', 10)
+    # In-flight files are registered before the finished outputs
+    index.add(str(spool), ttl=50, size=0)
+    index.add(part, ttl=50, size=0)
+    done = [make_file(tmp_path / f'{name}.zip', 10) for name in ('a', 'b')]
+    for ttl, path in zip((100, 200), done):
+        index.add(path, ttl=ttl)
+
+    assert index.reap() == 1
+    assert spool.exists() and os.path.exists(part)
+    assert [os.path.exists(path) for path in done] == [False, True]
+
+def test_startup_sweep_indexes_leftovers_once(tmp_path):
+    config = {'OUTPUT_TTL': 3600, 'JOB_TTL': 600}
+    for key in ('UPLOAD_FOLDER', 'ZIP_FOLDER', 'SPOOL_FOLDER'):
+        config[key] = str(tmp_path / key.lower())
+        os.makedirs(config[key])
+    app = SimpleNamespace(config=config, expiry=ExpiryIndex(str(tmp_path / 'expiry.sqlite3')))
+    known = make_file(tmp_path / 'zip_folder' / 'known.zip', 10)
+    app.expiry.add(known, ttl=-1)
+    make_file(tmp_path / 'zip_folder' / 'old.zip', 20)
+    make_file(tmp_path / 'zip_folder' / 'running.zip.part', 40)
+    os.makedirs(tmp_path / 'spool_folder' / 'crashed')
+    make_file(tmp_path / 'spool_folder' / 'crashed' / '00000', 80)
+
+    index_leftovers(app)
+    # Only the finished zip counts toward the quota; in-flight files wait for JOB_TTL
+    assert app.expiry.total_bytes() == 30
+    assert app.expiry.reap() == 1
+    assert app.expiry.reap(now=time.time() + 1200) == 2
+    index_leftovers(app)
+    assert app.expiry.total_bytes() == 20
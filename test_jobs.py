@@ -0,0 +1,199 @@
+import threading
+import time
+import pytest
+from watermark.jobs import MemoryJobStore, RedisJobStore, SQLiteJobStore
+
+class FakeRedis:
+    """Local stand-in for the subset of the redis-py API the store uses."""
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        # Reentrant so a pipeline can run its queued calls under it
+        self.lock = threading.RLock()
+
+    def _alive(self, key):
+        if key in self.expires and self.expires[key] < time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def hset(self, key, mapping):
+        with self.lock:
+            self._alive(key)
+            self.data.setdefault(key, {}).update({k: str(v).encode() for k, v in mapping.items()})
+
+    def hgetall(self, key):
+        with self.lock:
+            return {k.encode(): v for k, v in self.data[key].items()} if self._alive(key) else {}
+
+    def hincrby(self, key, field, amount):
+        with self.lock:
+            self._alive(key)
+            fields = self.data.setdefault(key, {})
+            value = int(fields.get(field, b'0')) + amount
+            fields[field] = str(value).encode()
+            return value
+
+    def hincrbyfloat(self, key, field, amount):
+        with self.lock:
+            self._alive(key)
+            fields = self.data.setdefault(key, {})
+            value = float(fields.get(field, b'0')) + amount
+            fields[field] = repr(value).encode()
+            return repr(value).encode()
+
+    def rpush(self, key, value):
+        with self.lock:
+            self._alive(key)
+            items = self.data.setdefault(key, [])
+            items.append(value.encode())
+            return len(items)
+
+    def lrange(self, key, start, end):
+        with self.lock:
+            return list(self.data[key]) if self._alive(key) else []
+
+    def expire(self, key, ttl):
+        with self.lock:
+            if not self._alive(key):
+                return False
+            self.expires[key] = time.time() + ttl
+            return True
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.data.pop(key, None)
+                self.expires.pop(key, None)
+
+    def exists(self, key):
+        with self.lock:
+            return int(self._alive(key))
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+class FakePipeline:
+    """Queues calls and runs them together under the client's lock."""
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        return lambda *args, **kwargs: self.calls.append((method, args, kwargs))
+
+    def execute(self):
+        with self.client.lock:
+            results = [method(*args, **kwargs) for method, args, kwargs in self.calls]
+        self.calls = []
+        return results
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def make_store(request, tmp_path):
+    def factory(ttl=60):
+        if request.param == 'memory':
+            return MemoryJobStore(ttl=ttl)
+        if request.param == 'sqlite':
+            return SQLiteJobStore(str(tmp_path / 'jobs.sqlite3'), ttl=ttl)
+        return RedisJobStore(FakeRedis(), ttl=ttl)
+    return factory
+
+def test_job_store_roundtrip(make_store):
+    store = make_store()
+    store.create('job', total=3, done=0, failed=0, zip=None, current_file=None)
+    store.update('job', current_file='a.jpg', zip='/download/job')
+    assert store.increment('job', 'done') == 1
+    assert store.increment('job', 'done') == 2
+    job = store.get('job')
+    assert job['total'] == 3
+    assert job['done'] == 2
+    assert job['zip'] == '/download/job'
+    assert job['current_file'] == 'a.jpg'
+    store.delete('job')
+    assert store.get('job') is None
+
+def test_job_store_missing_job(make_store):
+    store = make_store()
+    assert store.get('missing') is None
+    assert store.increment('missing', 'done') is None
+    store.update('missing', done=1)
+    assert store.get('missing') is None
+
+def test_job_store_accumulates_and_keeps_records_apart(make_store):
+    store = make_store()
+    store.create('job', done=0)
+    assert store.accumulate('job', {'done': 1, 'seconds_decode': 0.25}, current_file='a.jpg') == {
+        'done': 1, 'seconds_decode': 0.25
+    }
+    assert store.accumulate('job', {'done': 1, 'seconds_decode': 0.5})['seconds_decode'] == 0.75
+    store.add_record('job', {'index': 1})
+    store.add_record('job', {'index': 0})
+    job = store.get('job')
+    assert (job['done'], job['current_file']) == (2, 'a.jpg')
+    assert 'records' not in job
+    assert store.records('job') == [{'index': 1}, {'index': 0}]
+    # A job created again under the same id starts without records
+    store.create('job', done=0)
+    assert store.records('job') == []
+    store.delete('job')
+    assert store.accumulate('job', {'done': 1}) is None
+    store.add_record('job', {'index': 2})
+    assert store.records('job') == []
+
+def test_job_store_expires_jobs(make_store):
+    store = make_store(ttl=0.2)
+    store.create('job', done=0)
+    time.sleep(1.1)
+    assert store.get('job') is None
+
+def test_job_store_counters_are_atomic(make_store):
+    store = make_store()
+    store.create('job', done=0)
+
+    def work():
+        for _ in range(25):
+            store.increment('job', 'done')
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store.get('job')['done'] == 100
+
+def test_job_store_wait_for_change(make_store):
+    store = make_store()
+    store.poll_interval = 0.05
+    store.create('job', done=0)
+    version = store.get('job')['version']
+
+    assert store.wait_for_change('job', version, timeout=0.1)['version'] == version
+
+    timer = threading.Timer(0.1, store.increment, args=('job', 'done'))
+    timer.start()
+    job = store.wait_for_change('job', version, timeout=5)
+    timer.join()
+    assert job['done'] == 1
+    assert job['version'] != version
+
+def test_redis_writes_bump_version_and_ttl_together():
+    client = FakeRedis()
+    store = RedisJobStore(client, ttl=60)
+    store.create('job', done=0)
+    store.update('job', current_file='a.jpg')
+    assert store.increment('job', 'done') == 1
+    assert store.get('job')['version'] == 2
+    assert 'watermark:job:job' in client.expires
+    store.delete('job')
+    store.update('job', current_file='b.jpg')
+    assert store.increment('job', 'done') is None
+    assert client.data == {}
@@ -0,0 +1,72 @@
+import json
+import os
+import pytest
+from watermark.metrics import Registry
+
+def test_disabled_registry_records_nothing():
+    registry = Registry()
+    registry.inc('watermark_images_total', outcome='processed')
+    with registry.timed('decode'):
+        pass
+    assert not registry.enabled
+    assert registry._values == {'histogram': {}, 'counter': {}, 'gauge': {}}
+
+def test_render_histogram_counter_and_failures(tmp_path):
+    registry = Registry(str(tmp_path))
+    registry.observe('watermark_input_megapixels', 3)
+    registry.observe('watermark_input_megapixels', 200)
+    registry.inc('watermark_images_total', outcome='processed')
+    with pytest.raises(ValueError):
+        with registry.timed('decode'):
+            raise ValueError('broken')
+    text = registry.render()
+    assert 'watermark_input_megapixels_bucket{le="2"} 0' in text
+    assert 'watermark_input_megapixels_bucket{le="4"} 1' in text
+    assert 'watermark_input_megapixels_bucket{le="+Inf"} 2' in text
+    assert 'watermark_input_megapixels_count 2' in text
+    assert 'watermark_input_megapixels_sum 203' in text
+    assert 'watermark_images_total{outcome="processed"} 1' in text
+    assert 'watermark_failures_total{stage="decode"} 1' in text
+    assert '# TYPE watermark_stage_seconds histogram' in text
+
+def test_snapshots_of_other_processes_are_merged(tmp_path):
+    registry = Registry(str(tmp_path))
+    registry.inc('watermark_images_total', outcome='processed')
+    registry.set('watermark_active_workers', 2)
+    # A pool worker that has exited: its counters still count, its gauges do not
+    dead = {'pid': 2 ** 22 + 1, 'values': {
+        'histogram': {},
+        'counter': {'watermark_images_total\toutcome="processed"': 4},
+        'gauge': {'watermark_active_workers\t': 5}
+    }}
+    (tmp_path / 'dead.json').write_text(json.dumps(dead))
+    text = registry.render()
+    assert 'watermark_images_total{outcome="processed"} 5' in text
+    assert 'watermark_active_workers 2' in text
+
+def test_exited_processes_are_archived_once(tmp_path):
+    registry = Registry(str(tmp_path))
+    registry.inc('watermark_images_total', outcome='processed')
+    dead = {'pid': 2 ** 22 + 1, 'values': {
+        'histogram': {},
+        'counter': {'watermark_images_total\toutcome="processed"': 4},
+        'gauge': {}
+    }}
+    (tmp_path / f"{dead['pid']}.json").write_text(json.dumps(dead))
+    assert 'watermark_images_total{outcome="processed"} 5' in registry.render()
+    assert not (tmp_path / f"{dead['pid']}.json").exists()
+    # Rendering again does not count the archived process twice
+    assert 'watermark_images_total{outcome="processed"} 5' in registry.render()
+
+def test_reused_pid_keeps_the_previous_totals(tmp_path):
+    registry = Registry(str(tmp_path))
+    previous = {'pid': os.getpid(), 'values': {
+        'histogram': {},
+        'counter': {'watermark_images_total\toutcome="processed"': 7},
+        'gauge': {'watermark_active_workers\t': 3}
+    }}
+    (tmp_path / f'{os.getpid()}.json').write_text(json.dumps(previous))
+    registry.inc('watermark_images_total', outcome='processed')
+    text = registry.render()
+    assert 'watermark_images_total{outcome="processed"} 8' in text
+    assert 'watermark_active_workers 3' not in text
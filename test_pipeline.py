@@ -0,0 +1,174 @@
+import pytest
+from io import BytesIO
+from PIL import Image, ImageChops, ImageOps, ImageStat
+from conftest import make_image_bytes, make_options
+from watermark.pipeline import (
+    ENCODING_PROFILES,
+    ProcessingEngine,
+    avif_supported,
+    encode_image,
+    output_filename,
+    process_image
+)
+
+def test_process_image_encodes_output():
+    filename, data = process_image(make_image_bytes(), 'my photo.jpg', make_options())
+    assert filename.startswith('my_photo_') and filename.endswith('.png')
+    assert Image.open(BytesIO(data)).size == (32, 24)
+
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+def test_engine_backends_process_every_image(backend):
+    engine = ProcessingEngine(backend=backend, workers=2)
+    image_files = [
+        {'filename': 'a.png', 'content': make_image_bytes()},
+        {'filename': 'b.png', 'content': b'not an image'},
+        {'filename': 'c.png', 'content': make_image_bytes()}
+    ]
+    try:
+        results = list(engine.run(image_files, make_options()))
+    finally:
+        engine.shutdown()
+    assert sorted(f['filename'] for f, _, _ in results) == ['a.png', 'b.png', 'c.png']
+    errors = [f['filename'] for f, _, error in results if error is not None]
+    assert errors == ['b.png']
+
+def test_engine_rejects_unknown_backend():
+    with pytest.raises(ValueError):
+        ProcessingEngine(backend='gpu')
+
+def test_draft_decode_keeps_requested_output_size():
+    source = make_image_bytes((801, 601), fmt='JPEG')
+    options = make_options(output_format='jpg', reduce_pct=20, draft_margin=1.0)
+    _, data = process_image(source, 'big.jpg', options)
+    assert Image.open(BytesIO(data)).size == (160, 120)
+
+def test_resize_first_matches_watermark_then_resize():
+    source = make_image_bytes((400, 300), color='white')
+    results = {}
+    for resize_first in (False, True):
+        _, data = process_image(source, 'a.png', make_options(reduce_pct=50, resize_first=resize_first))
+        results[resize_first] = Image.open(BytesIO(data)).convert('L')
+    assert results[True].size == results[False].size == (200, 150)
+    # Same placement and darkness; only resampling at the edges differs
+    inverted = {key: ImageOps.invert(img) for key, img in results.items()}
+    for a, b in zip(inverted[True].getbbox(), inverted[False].getbbox()):
+        assert abs(a - b) <= 4
+    diff = ImageStat.Stat(ImageChops.difference(results[True], results[False]))
+    assert diff.mean[0] < 2
+
+@pytest.mark.parametrize('profile', sorted(ENCODING_PROFILES))
+@pytest.mark.parametrize('output_format', ['jpg', 'png', 'gif'])
+def test_encoding_profiles_produce_decodable_output(profile, output_format):
+    img = Image.new('RGBA', (40, 30), (10, 120, 200, 128))
+    data = encode_image(img, output_format, profile)
+    decoded = Image.open(BytesIO(data))
+    assert decoded.size == (40, 30)
+    assert decoded.format == {'jpg': 'JPEG', 'png': 'PNG', 'gif': 'GIF'}[output_format]
+
+def test_thread_engine_overlaps_encoding_without_losing_images():
+    engine = ProcessingEngine(backend='thread')
+    image_files = [{'filename': f'{index}.png', 'content': make_image_bytes()} for index in range(5)]
+    image_files[2]['content'] = b'not an image'
+    results = list(engine.run(image_files, make_options(encoding_profile='fast')))
+    assert sorted(f['filename'] for f, _, _ in results) == [f'{index}.png' for index in range(5)]
+    assert [f['filename'] for f, _, error in results if error is not None] == ['2.png']
+    for _, result, error in results:
+        if error is None:
+            assert Image.open(BytesIO(result[1])).size == (32, 24)
+
+def test_webp_keeps_alpha_instead_of_flattening():
+    img = Image.new('RGBA', (40, 30), (10, 120, 200, 128))
+    lossless = Image.open(BytesIO(encode_image(img, 'webp-lossless')))
+    assert lossless.mode == 'RGBA'
+    assert lossless.tobytes() == img.tobytes()
+    lossy = Image.open(BytesIO(encode_image(img, 'webp', quality={'webp': 50})))
+    assert lossy.mode == 'RGBA'
+    # Fully opaque images drop the alpha plane
+    opaque = Image.open(BytesIO(encode_image(Image.new('RGBA', (40, 30), 'red'), 'webp')))
+    assert opaque.mode == 'RGB'
+
+@pytest.mark.skipif(not avif_supported(), reason='Pillow build cannot write AVIF')
+def test_avif_output():
+    img = Image.new('RGBA', (40, 30), (10, 120, 200, 128))
+    decoded = Image.open(BytesIO(encode_image(img, 'avif')))
+    assert decoded.format == 'AVIF'
+    assert decoded.mode == 'RGBA'
+
+def test_lossless_webp_uses_webp_extension():
+    assert output_filename('photo.png', 'webp-lossless').endswith('.webp')
+    with pytest.raises(ValueError):
+        encode_image(Image.new('RGB', (4, 4)), 'bmp')
+
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+def test_engine_records_stage_timings(backend):
+    engine = ProcessingEngine(backend=backend, workers=1)
+    image_files = [{'filename': f'{index}.png', 'content': make_image_bytes()} for index in range(2)]
+    try:
+        results = list(engine.run(image_files, make_options()))
+    finally:
+        engine.shutdown()
+    for file_data, _, error in results:
+        assert error is None
+        assert {'decode', 'watermark', 'resize', 'encode'} <= set(file_data['timings'])
+        assert all(seconds >= 0 for seconds in file_data['timings'].values())
+
+def make_animation(colors, durations, transparent=False):
+    frames = []
+    for color in colors:
+        frame = Image.new('RGBA', (64, 48), color)
+        if transparent:
+            frame.paste((0, 0, 0, 0), (0, 0, 16, 48))
+        frames.append(frame)
+    buffer = BytesIO()
+    frames[0].save(buffer, 'GIF', save_all=True, append_images=frames[1:], duration=durations,
+                   loop=0, disposal=2)
+    return buffer.getvalue()
+
+def test_animated_gif_keeps_every_frame_and_timing():
+    source = make_animation(['red', 'blue', 'blue', 'green'], [100, 50, 70, 120])
+    _, data = process_image(source, 'anim.gif', make_options(output_format='gif', reduce_size=False))
+    output = Image.open(BytesIO(data))
+    assert output.n_frames == 3
+    assert output.info['loop'] == 0
+    durations = []
+    for index in range(output.n_frames):
+        output.seek(index)
+        durations.append(output.info['duration'])
+        rgb = output.convert('RGB')
+        # The watermark is composited into every frame
+        assert rgb.getpixel((32, 24)) != rgb.getpixel((2, 2))
+    # The repeated blue frame only lengthens the one before it
+    assert durations == [100, 120, 120]
+
+def test_animated_gif_keeps_transparency():
+    source = make_animation(['red', 'blue'], [80, 80], transparent=True)
+    _, data = process_image(source, 'anim.gif', make_options(output_format='gif'))
+    output = Image.open(BytesIO(data))
+    assert output.n_frames == 2
+    for index in range(2):
+        output.seek(index)
+        frame = output.convert('RGBA')
+        assert frame.size == (32, 24)
+        assert frame.getpixel((1, 12))[3] == 0
+        assert frame.getpixel((30, 12))[3] == 255
+
+@pytest.mark.parametrize('with_watermark', [True, False])
+def test_animated_gif_keeps_opaque_colours_with_transparency(with_watermark):
+    colors = [(255, 0, 0), (0, 0, 255), (0, 128, 0), (255, 255, 0)]
+    source = make_animation(colors, [80] * 4, transparent=True)
+    options = make_options(output_format='gif', reduce_size=False)
+    if not with_watermark:
+        options['watermark'] = None
+    _, data = process_image(source, 'anim.gif', options)
+    output = Image.open(BytesIO(data))
+    for index, color in enumerate(colors):
+        output.seek(index)
+        frame = output.convert('RGBA')
+        assert frame.getpixel((1, 24))[3] == 0
+        # Away from the centred watermark
+        assert frame.getpixel((20, 2)) == color + (255,)
+
+def test_animated_gif_to_still_format_uses_first_frame():
+    source = make_animation(['red', 'blue'], [80, 80])
+    _, data = process_image(source, 'anim.gif', make_options(output_format='png', watermark=None))
+    assert Image.open(BytesIO(data)).convert('RGB').getpixel((0, 0)) == (255, 0, 0)
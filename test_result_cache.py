@@ -0,0 +1,48 @@
+import os
+import time
+from conftest import make_image_bytes, make_options
+from watermark.pipeline import ProcessingEngine
+from watermark.result_cache import ResultCache, result_key
+
+def test_result_key_covers_settings():
+    options = make_options()
+    key = result_key('source', options)
+    assert key == result_key('source', dict(options))
+    assert key != result_key('other', options)
+    assert key != result_key('source', make_options(opacity_pct=51))
+    assert key != result_key('source', make_options(output_format='jpg'))
+    # reduce_pct is irrelevant when the image is not resized
+    assert result_key('source', make_options(reduce_size=False, reduce_pct=10)) == \
+        result_key('source', make_options(reduce_size=False, reduce_pct=90))
+
+def test_result_cache_roundtrip_and_stats(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    assert cache.get('ab' * 32) is None
+    cache.put('ab' * 32, b'encoded')
+    assert cache.get('ab' * 32) == b'encoded'
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'hit_ratio': 0.5}
+
+def test_result_cache_prunes_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    for index, key in enumerate(('aa' * 32, 'bb' * 32, 'cc' * 32)):
+        cache.put(key, b'x' * 100)
+        past = time.time() - 100 + index
+        os.utime(os.path.join(str(tmp_path), key[:2], key), (past, past))
+    cache.get('aa' * 32)  # refresh the oldest entry
+    cache.max_bytes = 250
+    assert cache.prune() == 1
+    assert cache.get('bb' * 32) is None
+    assert cache.get('aa' * 32) is not None
+    assert cache.get('cc' * 32) is not None
+
+def test_engine_serves_repeated_uploads_from_cache(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    engine = ProcessingEngine()
+    source = make_image_bytes()
+
+    first = list(engine.run([{'filename': 'a.png', 'content': source}], make_options(), cache=cache))
+    second = list(engine.run([{'filename': 'a.png', 'content': source}], make_options(), cache=cache))
+
+    assert not first[0][0].get('cached')
+    assert second[0][0]['cached'] is True
+    assert second[0][1][1] == first[0][1][1]
@@ -0,0 +1,268 @@
+import json
+import os
+import pstats
+import subprocess
+import sys
+import threading
+import time
+import pytest
+from io import BytesIO
+from PIL import Image
+from watermark.app import create_app
+from watermark.config import Config
+from watermark.profiling import _profile_lock, profiled
+from watermark.scheduler import QueueFull
+
+class TestConfig(Config):
+    TESTING = True
+    PROGRESS_STREAM_KEEPALIVE = 0.2
+    # Run the pipeline every time so timings are complete
+    RESULT_CACHE_MAX_BYTES = 0
+
+@pytest.fixture
+def app(tmp_path):
+    # Every file the app writes stays under this test's tmp_path
+    class IsolatedConfig(TestConfig):
+        UPLOAD_FOLDER = str(tmp_path / 'output')
+        ZIP_FOLDER = str(tmp_path / 'zips')
+        SPOOL_FOLDER = str(tmp_path / 'spool')
+        EXPIRY_INDEX = str(tmp_path / 'expiry.sqlite3')
+        METRICS_FOLDER = str(tmp_path / 'metrics')
+        RESULT_CACHE_FOLDER = str(tmp_path / 'results')
+    return create_app(IsolatedConfig)
+
+@pytest.fixture
+def client(app):
+    with app.test_client() as client:
+        yield client
+
+def post_batch(client, photos, headers=None, **fields):
+    """Upload (bytes, filename) photos through the form; return the job id."""
+    response = client.post('/', data={
+        'photos': [(BytesIO(data), filename) for data, filename in photos],
+        **fields
+    }, content_type='multipart/form-data', headers=headers)
+    return response.get_data(as_text=True).split('const sessionId = "')[1].split('"')[0]
+
+def wait_finished(app, session_id):
+    """Return the job once it has finished, or its last state after ~50s."""
+    job = None
+    version = None
+    for _ in range(50):
+        job = app.jobs.wait_for_change(session_id, version, timeout=1)
+        version = job['version']
+        if job['finished']:
+            break
+    return job
+
+def read_events(response):
+    events = []
+    for block in response.get_data(as_text=True).split('\n\n'):
+        for line in block.splitlines():
+            if line.startswith('data: '):
+                events.append(json.loads(line[len('data: '):]))
+    return events
+
+def test_progress_stream_pushes_changes_until_finished(app, client):
+    app.jobs.create('job', total=2, done=0, failed=0, zip=None, current_file=None,
+                    start_time=time.time(), finished=False)
+
+    def worker():
+        for name in ('a.jpg', 'b.jpg'):
+            time.sleep(0.05)
+            app.jobs.update('job', current_file=name)
+            app.jobs.increment('job', 'done')
+        app.jobs.update('job', zip='/download/job')
+        app.jobs.update('job', finished=True)
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    response = client.get('/progress/job/stream')
+    thread.join()
+
+    assert response.mimetype == 'text/event-stream'
+    events = read_events(response)
+    assert events[-1]['finished'] is True
+    assert events[-1]['zip'] == '/download/job'
+    assert [e['done'] for e in events] == sorted(e['done'] for e in events)
+    assert len(events) <= 8
+
+def test_progress_stream_unknown_job(client):
+    response = client.get('/progress/missing/stream')
+    assert 'event: not_found' in response.get_data(as_text=True)
+
+def test_progress_not_found(client):
+    response = client.get('/progress/missing')
+    assert response.status_code == 404
+
+def test_full_queue_returns_503_with_retry_after(app, client, monkeypatch):
+    def refuse(*args, **kwargs):
+        raise QueueFull(7)
+
+    monkeypatch.setattr(app.scheduler, 'submit_all', refuse)
+    buffer = BytesIO()
+    Image.new('RGB', (8, 8), 'white').save(buffer, 'PNG')
+    response = client.post('/', data={
+        'photos': (BytesIO(buffer.getvalue()), 'a.png')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '7'
+
+def test_per_image_units_finalize_once(app, client):
+    buffer = BytesIO()
+    Image.new('RGB', (16, 16), 'white').save(buffer, 'PNG')
+    data = buffer.getvalue()
+    session_id = post_batch(client, [(data, 'a.png'), (data[:40], 'b.png'), (data, 'c.png')], format='png')
+
+    job = wait_finished(app, session_id)
+    assert job['finished'] is True
+    assert (job['done'], job['failed']) == (3, 1)
+    assert job['zip'] == f"/download/{session_id}"
+    assert client.get(job['zip']).status_code == 200
+
+    progress = client.get(f'/progress/{session_id}').get_json()
+    assert 'images' not in progress
+    assert progress['eta_seconds'] == 0
+    assert set(progress['stage_seconds']) == {'decode', 'resize', 'watermark', 'encode', 'zip'}
+    detail = client.get(f'/progress/{session_id}?detail=1').get_json()
+    assert [image['file'] for image in detail['images']] == ['a.png', 'b.png', 'c.png']
+    assert [image['failed'] for image in detail['images']] == [False, True, False]
+    assert {'decode', 'encode', 'zip'} <= set(detail['images'][0]['stages'])
+
+def test_chunked_upload_processes_files_as_they_land(app, client):
+    buffer = BytesIO()
+    Image.new('RGB', (16, 16), 'white').save(buffer, 'PNG')
+    data = buffer.getvalue()
+    response = client.post('/uploads', data={
+        'files': json.dumps([
+            {'name': 'a.png', 'size': len(data)},
+            {'name': 'b.png', 'size': len(data)},
+            {'name': 'c.png', 'size': len(data)}
+        ]),
+        'format': 'png'
+    })
+    assert response.status_code == 201
+    session_id = response.get_json()['job_id']
+    base = f'/uploads/{session_id}/files'
+
+    assert client.put(f'{base}/0?offset=0', data=data[:30]).get_json() == {'received': 30}
+    # A repeated chunk is refused with the offset to resume from
+    response = client.put(f'{base}/0?offset=0', data=data[:30])
+    assert response.status_code == 409
+    assert response.get_json()['received'] == 30
+    assert client.put(f'{base}/0?offset=30', data=data[30:]).status_code == 200
+    # The first file is processed while the others are still uploading
+    job = app.jobs.get(session_id)
+    for _ in range(50):
+        if job['done']:
+            break
+        job = app.jobs.wait_for_change(session_id, job['version'], timeout=1)
+    assert (job['done'], job['finished']) == (1, False)
+    response = client.put(f'{base}/1?offset=0', data=b'not an image'.ljust(len(data)))
+    assert response.status_code == 400
+    client.put(f'{base}/2?offset=0', data=data[:10])
+    assert [f['received'] for f in client.get(f'/uploads/{session_id}').get_json()['files']] == [len(data)] * 2 + [10]
+
+    response = client.post(f'/uploads/{session_id}/commit')
+    assert response.status_code == 202
+    job = wait_finished(app, session_id)
+    assert (job['done'], job['failed']) == (3, 2)
+    assert job['zip'] == f"/download/{session_id}"
+    assert client.get(f'/uploads/{session_id}').status_code == 404
+
+def test_idle_chunked_upload_is_committed_for_the_client(app, client):
+    buffer = BytesIO()
+    Image.new('RGB', (16, 16), 'white').save(buffer, 'PNG')
+    data = buffer.getvalue()
+    response = client.post('/uploads', data={
+        'files': json.dumps([{'name': 'a.png', 'size': len(data)}, {'name': 'b.png', 'size': len(data)}]),
+        'format': 'png'
+    })
+    session_id = response.get_json()['job_id']
+    client.put(f'/uploads/{session_id}/files/0?offset=0', data=data)
+    client.put(f'/uploads/{session_id}/files/1?offset=0', data=data[:10])
+
+    app.commit_idle_uploads()
+    assert client.get(f'/uploads/{session_id}').get_json()['committed'] is False
+    app.config['UPLOAD_IDLE_TIMEOUT'] = 0
+    app.commit_idle_uploads()
+    job = wait_finished(app, session_id)
+    assert (job['done'], job['failed']) == (2, 1)
+    assert client.get(f'/uploads/{session_id}').status_code == 404
+
+def test_chunked_upload_rejects_bad_declarations(client):
+    assert client.post('/uploads', data={'files': 'nope'}).status_code == 400
+    response = client.post('/uploads', data={'files': json.dumps([{'name': 'a.pdf', 'size': 10}])})
+    assert response.status_code == 400
+
+def test_metrics_endpoint(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert '# TYPE watermark_images_total counter' in response.get_data(as_text=True)
+
+def test_profiled_job_saves_downloadable_stats(app, client, tmp_path):
+    app.config['PROFILE_TOKEN'] = 'secret'
+    buffer = BytesIO()
+    Image.new('RGB', (16, 16), 'white').save(buffer, 'PNG')
+    photos = [(buffer.getvalue(), 'a.png'), (buffer.getvalue(), 'b.png')]
+    session_id = post_batch(client, photos, headers={'X-Profile-Token': 'secret'}, format='png')
+
+    job = wait_finished(app, session_id)
+    assert job['finished'] is True
+
+    assert client.get(f'/profile/{session_id}').status_code == 404
+    assert client.get(f'/profile/{session_id}?token=wrong').status_code == 404
+    profile = client.get(f'/profile/{session_id}', headers={'X-Profile-Token': 'secret'})
+    assert profile.status_code == 200
+    (tmp_path / 'job.prof').write_bytes(profile.data)
+    stats = pstats.Stats(str(tmp_path / 'job.prof'))
+    assert any(func[2] == 'process_image' for func in stats.stats)
+
+def test_profiled_job_runs_its_images_one_at_a_time(app, client, monkeypatch):
+    # Python 3.12 refuses to enable a second profiler while one is active
+    app.config['PROFILE_TOKEN'] = 'secret'
+    assert app.scheduler.workers > 1
+    running = []
+    overlaps = []
+    process = app.engine.process
+
+    def tracked(*args, **kwargs):
+        running.append(None)
+        overlaps.append(len(running))
+        time.sleep(0.05)
+        try:
+            return process(*args, **kwargs)
+        finally:
+            running.pop()
+
+    monkeypatch.setattr(app.engine, 'process', tracked)
+    buffer = BytesIO()
+    Image.new('RGB', (16, 16), 'white').save(buffer, 'PNG')
+    photos = [(buffer.getvalue(), f'{name}.png') for name in 'abcd']
+    session_id = post_batch(client, photos, headers={'X-Profile-Token': 'secret'}, format='png')
+
+    job = wait_finished(app, session_id)
+    assert (job['done'], job['failed']) == (4, 0)
+    assert overlaps == [1, 1, 1, 1]
+
+def test_busy_profiler_runs_block_unprofiled(tmp_path):
+    with _profile_lock:
+        with profiled(str(tmp_path)):
+            pass
+    assert list(tmp_path.iterdir()) == []
+    with profiled(str(tmp_path)):
+        pass
+    assert len(list(tmp_path.glob('*.prof'))) == 1
+
+def test_create_app_defers_heavy_imports(tmp_path):
+    code = (
+        "import sys; from watermark.app import create_app; create_app(); "
+        "print(sorted(m for m in ('apscheduler', 'numpy', 'magic', 'flask_caching') if m in sys.modules))"
+    )
+    env = dict(os.environ, WARMUP_CODECS='0', PYTHONPATH=os.pathsep.join(sys.path))
+    for key in ('UPLOAD_FOLDER', 'ZIP_FOLDER', 'SPOOL_FOLDER', 'EXPIRY_INDEX', 'METRICS_FOLDER', 'RESULT_CACHE_FOLDER'):
+        env[key] = str(tmp_path / key.lower())
+    result = subprocess.run([sys.executable, '-c', code], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == '[]'
@@ -0,0 +1,86 @@
+import time
+import pytest
+from watermark.scheduler import FairScheduler, QueueFull
+
+class ManualExecutor:
+    """Executor stand-in that runs submitted calls only when told to."""
+
+    def __init__(self):
+        self.pending = []
+
+    def submit(self, fn, *args):
+        self.pending.append((fn, args))
+
+    def run_next(self):
+        fn, args = self.pending.pop(0)
+        fn(*args)
+
+def test_clients_take_turns():
+    executor = ManualExecutor()
+    order = []
+    scheduler = FairScheduler(executor, workers=1)
+    for index in range(3):
+        scheduler.submit('big', f'big{index}', lambda i=index: order.append(f'big{i}'))
+    scheduler.submit('small', 'small0', lambda: order.append('small0'))
+    while executor.pending:
+        executor.run_next()
+    assert order == ['big0', 'big1', 'small0', 'big2']
+
+def test_positions_are_published_until_start():
+    executor = ManualExecutor()
+    positions = {}
+    scheduler = FairScheduler(executor, workers=1, on_position=lambda job, pos: positions.__setitem__(job, pos))
+    for job in ('a', 'b', 'c'):
+        scheduler.submit('client', job, lambda: None)
+    assert positions == {'b': 1, 'c': 2}
+    assert scheduler.position('c') == 2
+    executor.run_next()
+    assert positions == {'b': None, 'c': 1}
+
+def test_position_writes_are_throttled():
+    executor = ManualExecutor()
+    writes = []
+    scheduler = FairScheduler(executor, workers=1, on_position=lambda job, pos: writes.append((job, pos)),
+                              position_interval=0.2)
+    for job in ('a', 'b', 'c', 'd'):
+        scheduler.submit('client', job, lambda: None)
+    assert writes == []
+    executor.run_next()
+    time.sleep(0.4)
+    # One batch with the latest ranks; 'b' started before it was ever published
+    assert sorted(writes) == [('c', 1), ('d', 2)]
+    del writes[:]
+    executor.run_next()
+    time.sleep(0.4)
+    assert sorted(writes) == [('c', None), ('d', 1)]
+
+def test_queue_limits_refuse_with_retry_after():
+    executor = ManualExecutor()
+    scheduler = FairScheduler(executor, workers=1, max_images=5, max_bytes=1000, default_retry_after=12)
+    scheduler.submit('a', 'running', lambda: None, images=50, size=10 ** 6)
+    # An empty waiting queue always admits, however large the job
+    scheduler.submit('a', 'waiting', lambda: None, images=50, size=10 ** 6)
+    with pytest.raises(QueueFull) as excinfo:
+        scheduler.submit('b', 'refused', lambda: None, images=1, size=1)
+    assert excinfo.value.retry_after == 12
+    # Recording a failed file holds no upload data, so it is never refused
+    scheduler.submit('b', 'failed', lambda: None, images=0, size=0)
+    assert scheduler.stats()['queued_images'] == 50
+
+def test_limited_job_leaves_free_workers_to_others():
+    executor = ManualExecutor()
+    scheduler = FairScheduler(executor, workers=3)
+    scheduler.limit('profiled', 1)
+    tasks = [('a', 'profiled'), ('a', 'profiled'), ('a', 'profiled'), ('b', 'other'), ('b', 'other')]
+    for client, job in tasks:
+        scheduler.submit(client, job, lambda: None)
+    # One profiled unit plus both of the other job's units, none waiting in a worker
+    assert len(executor.pending) == 3
+    assert scheduler.stats()['queued_images'] == 2
+    executor.run_next()
+    assert len(executor.pending) == 3
+    scheduler.limit('profiled', None)
+    assert len(executor.pending) == 3
+    while executor.pending:
+        executor.run_next()
+    assert scheduler.stats()['queued_images'] == 0
@@ -0,0 +1,33 @@
+import pytest
+from io import BytesIO
+from watermark.uploads import ChunkedUpload, OffsetMismatch
+
+def test_chunks_resume_from_received_bytes(tmp_path):
+    upload = ChunkedUpload(str(tmp_path / 'spool'), [{'name': 'a.jpg', 'size': 10}])
+    assert upload.write(0, 0, BytesIO(b'abcd')) == 4
+    with pytest.raises(OffsetMismatch) as excinfo:
+        upload.write(0, 0, BytesIO(b'abcd'))
+    assert excinfo.value.received == 4
+    with pytest.raises(ValueError):
+        upload.write(0, 4, BytesIO(b'x' * 7))
+    assert upload.claim(0) is None
+
+    assert upload.write(0, 4, BytesIO(b'efghij')) == 10
+    assert upload.status()[0]['complete'] is True
+    file_data = upload.claim(0)
+    assert open(file_data['path'], 'rb').read() == b'abcdefghij'
+    assert upload.claim(0) is None
+    upload.release(0)
+    assert upload.claim(0) is file_data
+
+def test_commit_hands_out_incomplete_files_once(tmp_path):
+    upload = ChunkedUpload(str(tmp_path / 'spool'), [
+        {'name': 'a.jpg', 'size': 2}, {'name': 'b.jpg', 'size': 2}, {'name': 'c.jpg', 'size': 2}
+    ])
+    upload.write(0, 0, BytesIO(b'ab'))
+    upload.write(1, 0, BytesIO(b'a'))
+    assert upload.claim(0) is not None
+    assert [index for index, _ in upload.commit()] == [1, 2]
+    with pytest.raises(ValueError):
+        upload.write(1, 1, BytesIO(b'b'))
+    assert upload.commit() == []
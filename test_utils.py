@@ -0,0 +1,98 @@
+import pytest
+from io import BytesIO
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from watermark.utils import (
+    WatermarkCache,
+    apply_watermark,
+    spool_upload,
+    validate_file,
+    build_pattern_layer,
+    single_position,
+    watermark_cache,
+    watermark_digest
+)
+
+@pytest.fixture(autouse=True)
+def reset_watermark_cache():
+    watermark_cache.clear()
+    yield
+    watermark_cache.clear()
+
+def test_watermark_cache_reuses_prepared_tile():
+    watermark = Image.new('RGBA', (20, 10), 'black')
+    digest = watermark_digest(watermark.tobytes())
+    for _ in range(3):
+        img = Image.new('RGB', (100, 100), 'white')
+        result = apply_watermark(img, watermark, 20, 50, digest=digest)
+        assert result.size == (100, 100)
+    stats = watermark_cache.stats()
+    assert stats['misses'] == 1
+    assert stats['hits'] == 2
+
+def test_watermark_cache_matches_uncached_output():
+    img = Image.new('RGB', (120, 80), 'white')
+    watermark = Image.new('RGBA', (30, 15), (200, 0, 0, 255))
+    uncached = apply_watermark(img, watermark, 40, 60)
+    cached = apply_watermark(img, watermark, 40, 60, digest='wm')
+    assert uncached.tobytes() == cached.tobytes()
+
+def test_watermark_cache_evicts_by_size():
+    cache = WatermarkCache(max_bytes=2 * 10 * 10 * 4)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, Image.new('RGBA', (10, 10)))
+    assert cache.get('a') is None
+    assert cache.get('c') is not None
+    assert cache.stats()['bytes'] <= cache.max_bytes
+
+def test_single_position_corners_keep_margin():
+    assert single_position((100, 100), (20, 10), 'center') == (40, 45)
+    assert single_position((100, 100), (20, 10), 'top-left') == (2, 2)
+    assert single_position((100, 100), (20, 10), 'bottom-right') == (78, 88)
+
+@pytest.mark.parametrize('pattern', ['grid', 'diagonal'])
+def test_pattern_layer_covers_whole_frame(pattern):
+    tile = Image.new('RGBA', (10, 10), (0, 0, 0, 128))
+    layer = build_pattern_layer(tile, (200, 120), pattern)
+    assert layer.size == (200, 120)
+    alpha = layer.getchannel('A')
+    # Every quadrant holds watermark pixels, not just one pasted copy
+    for box in ((0, 0, 100, 60), (100, 0, 200, 60), (0, 60, 100, 120), (100, 60, 200, 120)):
+        assert alpha.crop(box).getbbox() is not None
+
+def test_pattern_layer_is_reused_per_image_size():
+    watermark = Image.new('RGBA', (20, 10), 'black')
+    for _ in range(3):
+        apply_watermark(Image.new('RGB', (100, 80), 'white'), watermark, 10, 50, digest='wm', pattern='grid')
+    apply_watermark(Image.new('RGB', (80, 100), 'white'), watermark, 10, 50, digest='wm', pattern='grid')
+    stats = watermark_cache.stats()
+    # One tile and one layer per distinct image size
+    assert stats['entries'] == 4
+    assert stats['hits'] == 4
+
+def test_tiled_output_matches_uncached():
+    img = Image.new('RGB', (120, 90), 'white')
+    watermark = Image.new('RGBA', (30, 15), (200, 0, 0, 255))
+    uncached = apply_watermark(img, watermark, 15, 60, pattern='diagonal')
+    cached = apply_watermark(img, watermark, 15, 60, digest='wm', pattern='diagonal')
+    assert uncached.tobytes() == cached.tobytes()
+
+def make_upload(content, filename='photo.png'):
+    return FileStorage(stream=BytesIO(content), filename=filename)
+
+def test_validate_file_sniffs_header_and_checks_size():
+    buffer = BytesIO()
+    Image.new('RGB', (32, 32), 'white').save(buffer, 'PNG')
+    png = buffer.getvalue()
+    assert validate_file(make_upload(png), {'png'}, len(png))
+    with pytest.raises(ValueError, match='too large'):
+        validate_file(make_upload(png), {'png'}, len(png) - 1)
+    with pytest.raises(ValueError, match='Invalid file type'):
+        validate_file(make_upload(b'plain text' * 100), {'png'}, 10000)
+
+def test_spool_upload_writes_whole_file(tmp_path):
+    upload = make_upload(b'x' * 100000)
+    upload.read(10)
+    path = spool_upload(upload, str(tmp_path / 'spool'), '00000')
+    with open(path, 'rb') as f:
+        assert f.read() == b'x' * 100000